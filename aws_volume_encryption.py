@@ -2,19 +2,63 @@
 
 """
 Overview:
-    Encrypt the root or ALL volumes by system instance_name.  Can do up to five systems at a time.
+    Encrypt the root or ALL volumes by system instance_name.  Can do many systems at a time with --use_pool.
 Params:
     All parameters are handled by the configuration file (aws_volume_encryption_config.py)
 Conditions:
     Will return a log of activities and their results
 """
 
-import boto3
 import botocore
 import botocore.exceptions as exceptions
 import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
 import aws_volume_encryption_config
-from multiprocessing import Pool
+from aws_volume_encryption_clients import SHARED_POOL
+from aws_volume_encryption_groups import GroupRoller
+from aws_volume_encryption_inventory import Inventory, parse_filters
+from aws_volume_encryption_journal import StateJournal, FINAL_PHASES, phase_done
+from aws_volume_encryption_lifecycle import LifecycleCoordinator
+from aws_volume_encryption_lineage import GIB, bytes_saved, is_fresh, snapshot_age_seconds, snapshot_data_bytes
+from aws_volume_encryption_metrics import PhaseMetrics, phase_history
+from aws_volume_encryption_planner import Planner, ThroughputRates, choose_encryption_path, snapshot_cost, \
+    volume_needs_encryption
+from aws_volume_encryption_poller import StatusPoller, VOLUME_TIMEOUT
+from aws_volume_encryption_progress import ProgressTracker, PROGRESS_MODES
+from aws_volume_encryption_prewarm import MAX_FAST_SNAPSHOT_RESTORES, MIN_INITIALIZATION_RATE, \
+    MAX_INITIALIZATION_RATE, PREWARM_MODES, INITIALIZATION_POLL_INTERVAL, INITIALIZATION_TIMEOUT_MARGIN, \
+    disable_fast_snapshot_restore, enable_fast_snapshot_restore, initialization_progress, initialization_seconds, \
+    wait_fast_snapshot_restore
+from aws_volume_encryption_ratelimit import THROTTLE_ERROR_CODES
+from aws_volume_encryption_report import ReportWriter, REPORT_FORMATS
+from aws_volume_encryption_scheduler import JobEstimator, longest_first, makespan, lower_bound, format_duration
+from aws_volume_encryption_sweeper import Sweeper, RUN_TAG_KEY, new_run_id, run_tags
+from aws_volume_encryption_volumetypes import describe_performance, performance_args, performance_settings, \
+    target_settings
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# How many times a waiter is started again after being throttled.
+WAITER_THROTTLE_RETRIES = 8
+
+
+class ConcurrencyLimits:
+    def __init__(self,
+                 _max_snapshot_copies=20,
+                 _max_volume_creations=20,
+                 _max_instance_stops=20,
+                 _max_fast_snapshot_restores=MAX_FAST_SNAPSHOT_RESTORES):
+
+        # Separate limits for the EC2 quotas, shared by every instance running in this process.
+        self.snapshot_copies = threading.BoundedSemaphore(_max_snapshot_copies)
+        self.volume_creations = threading.BoundedSemaphore(_max_volume_creations)
+        self.instance_stops = threading.BoundedSemaphore(_max_instance_stops)
+        self.fast_snapshot_restores = threading.BoundedSemaphore(_max_fast_snapshot_restores)
 
 
 class InstanceVolumeEncrypter:
@@ -26,9 +70,27 @@ class InstanceVolumeEncrypter:
                  _instance_id=None,
                  _encrypt_all=False,
                  _ignore_encrypted=True,
-                 _force_volume_type="gp2",
+                 _force_volume_type="",
+                 _gp2_to_gp3=False,
                  _encryption_key_arn=None,
-                 _keep_snapshots=False
+                 _keep_snapshots=False,
+                 _max_volume_workers=1,
+                 _hot_snapshot=False,
+                 _copy_snapshot=False,
+                 _snapshot_lineage_max_age_hours=24,
+                 _prewarm="none",
+                 _volume_initialization_rate=MAX_INITIALIZATION_RATE,
+                 _wait_for_initialization=False,
+                 _run_id=None,
+                 _inventory=None,
+                 _poller=None,
+                 _lifecycle=None,
+                 _limits=None,
+                 _journal=None,
+                 _resume=False,
+                 _clients=None,
+                 _metrics=None,
+                 _progress=None
                  ):
 
         # Set up AWS Session + Client + Resources + Waiters
@@ -38,10 +100,45 @@ class InstanceVolumeEncrypter:
         self.ignore_encrypted = _ignore_encrypted
         self.generate_report = _generate_report
         self.force_volume_type = _force_volume_type
+        self.gp2_to_gp3 = _gp2_to_gp3
         self.keep_snapshots = _keep_snapshots
+        self.max_volume_workers = _max_volume_workers
+        self.hot_snapshot = _hot_snapshot
+        self.copy_snapshot = _copy_snapshot
+        self.snapshot_lineage_max_age_hours = _snapshot_lineage_max_age_hours
+        self.prewarm = _prewarm
+        self.volume_initialization_rate = _volume_initialization_rate
+        self.wait_for_initialization = _wait_for_initialization
+        self.run_id = _run_id or new_run_id()
+        self.inventory = _inventory
+        self.poller = _poller
+        self.lifecycle = _lifecycle
+        self.progress = _progress
+        self.journal = _journal
+        self.resume = _resume
+        self.status = "pending"
+        self.errors = []
+        self.downtime_seconds = None
+        self.volume_reports = []
+        self.timers = []
+
+        # (volume report, savings future, snapshot to delete once they're counted), read after the start.
+        self.pending_savings = []
+
+        # Devices left without a volume after a failed attach, which keep the instance from being started.
+        self.unattached_devices = []
+
+        # Whether the instance was running when it was stopped (or an interrupted run had stopped it), and so is
+        # started again.
+        self.restart = False
+        self.resumed = False
         self.instance = None
+        self.availability_zone = None
         self.volume_queue = []
 
+        # Encrypted snapshots holding one of the region's fast snapshot restore slots.
+        self.fast_snapshot_restores = set()
+
         if _instance_name is not None:
             self.instance_name = _instance_name
             self.instance_identification = _instance_name
@@ -56,8 +153,16 @@ class InstanceVolumeEncrypter:
 
         self.instance_volume_mappings = []
 
-        # Create custom session
-        self.session = boto3.session.Session(profile_name=self.aws_profile, region_name=self.aws_region)
+        if _limits is not None:
+            self.limits = _limits
+        else:
+            self.limits = ConcurrencyLimits()
+
+        # Phase timings are always collected, and exported when the metrics were given file paths.
+        if _metrics is not None:
+            self.metrics = _metrics
+        else:
+            self.metrics = PhaseMetrics()
 
         # Get CMK
         if _encryption_key_arn is not None:
@@ -65,22 +170,96 @@ class InstanceVolumeEncrypter:
         else:
             self.aws_encryption_key_arn = ""
 
-        # Pre-create the clients for reuse
-        self.ec2_client = self.session.client("ec2")
-        self.ec2_resource = self.session.resource("ec2")
+        # Reuse the session and client shared by every instance of this profile and region, from the process-wide
+        # pool when none was handed in.  The waiters are built on first use, by the client set.
+        if _clients is not None:
+            self.clients = _clients
+        else:
+            self.clients = SHARED_POOL.get(self.aws_profile, self.aws_region)
+
+        self.session = self.clients.session
+        self.ec2_client = self.clients.ec2_client
+        self.ec2_resource = self.clients.ec2_resource()
+
+    @property
+    def waiter_instance_exists(self):
+
+        return self.clients.waiter("instance_exists", max_attempts=2)
+
+    @property
+    def waiter_instance_stopped(self):
+
+        return self.clients.waiter("instance_stopped", max_attempts=40)
+
+    @property
+    def waiter_instance_running(self):
+
+        return self.clients.waiter("instance_running")
 
-        # Pre-create and configure the waiters
-        self.waiter_instance_exists = self.ec2_client.get_waiter("instance_exists")
-        self.waiter_instance_exists.config.max_attempts = 2
-        self.waiter_instance_stopped = self.ec2_client.get_waiter("instance_stopped")
-        self.waiter_instance_running = self.ec2_client.get_waiter("instance_running")
-        self.waiter_snapshot_complete = self.ec2_client.get_waiter("snapshot_completed")
-        self.waiter_volume_available = self.ec2_client.get_waiter("volume_available")
-        self.waiter_volume_in_use = self.ec2_client.get_waiter("volume_in_use")
+    @property
+    def waiter_snapshot_complete(self):
+
+        return self.clients.waiter("snapshot_completed", max_attempts=120)
+
+    @property
+    def waiter_volume_available(self):
+
+        return self.clients.waiter("volume_available")
+
+    @property
+    def waiter_volume_in_use(self):
+
+        return self.clients.waiter("volume_in_use")
 
     def encrypt_instance_volumes(self):
 
-        if self.instance_id == "":
+        # Returns the InstanceResult of the instance, with one entry per volume it worked on, whatever happened.
+        started_at = time.time()
+        try:
+            message = self.process_instance()
+        except Exception as e:
+            self.status = "failed"
+            self.errors.append("{}".format(e))
+            message = None
+            print(e)
+            self.collect_savings()
+
+        return self.result(message, time.time() - started_at)
+
+    def result(self, message=None, duration_seconds=None):
+
+        result = InstanceResult(self.instance_identification, self.aws_region)
+        result.profile = self.aws_profile
+        result.run_id = self.run_id
+        result.instance_id = self.instance.id if self.instance is not None else self.instance_id
+        result.instance_name = self.instance_name
+        result.status = self.status
+        result.message = message
+        result.errors = self.errors
+        result.volumes = self.volume_reports
+        result.downtime_seconds = self.downtime_seconds
+        result.duration_seconds = duration_seconds
+        result.phase_seconds = self.phase_seconds()
+        return result
+
+    def process_instance(self):
+
+        if self.inventory is not None:
+            # Read the instance from the batched discovery instead of describing it again.
+            if self.instance_id == "":
+                self.instance_id = self.inventory.find_instance_id(self.instance_name)
+
+            print("****Checking instance {}.".format(self.instance_identification))
+            instance_data = self.inventory.get_instance(self.instance_id)
+
+            if instance_data is None:
+                self.status = "not_found"
+                return "****Instance {} not found in {}.".format(self.instance_identification, self.aws_region)
+
+            self.instance = self.ec2_resource.Instance(self.instance_id)
+            self.instance.meta.data = instance_data
+
+        elif self.instance_id == "":
             # Get the instance information from the name tag
             self.get_instance_info_from_name()
         else:
@@ -96,16 +275,27 @@ class InstanceVolumeEncrypter:
                 )
             except botocore.exceptions.WaiterError as e:
                 if "Max attempts exceeded" in e.message:
+                    self.status = "not_found"
                     return "****Instance {} not found in {}.".format(self.instance_identification, self.aws_region)
                 else:
+                    self.status = "failed"
+                    self.errors.append("ERROR: {} on {}".format(e, self.instance_identification))
                     return "ERROR: {} on {}".format(e, self.instance_identification)
 
+        # Read once here, so the volume workers don't have to touch the instance.
+        self.availability_zone = self.instance.placement["AvailabilityZone"]
+
         # Save instance volume mappings and tags to persist to new volume
         for block_device_mapping in self.instance.block_device_mappings:
             device_id = block_device_mapping["Ebs"]["VolumeId"]
             device_name = block_device_mapping["DeviceName"]
             delete_on_termination = block_device_mapping["Ebs"]["DeleteOnTermination"]
             volume = self.ec2_resource.Volume(device_id)
+
+            # Seed the volume attributes from discovery so reading them doesn't trigger a describe per volume.
+            if self.inventory is not None and self.inventory.get_volume(device_id) is not None:
+                volume.meta.data = self.inventory.get_volume(device_id)
+
             self.instance_volume_mappings.append({
                 "VolumeId": device_id,
                 "Volume": volume,
@@ -113,251 +303,1048 @@ class InstanceVolumeEncrypter:
                 "DeviceName": device_name,
             })
 
-        # Iterate through the volumes and decide what to do.
+        # Iterate through the volumes and decide what to do.  Non-root volumes only with encrypt_all.
         for v in self.instance_volume_mappings:
-            if v["DeviceName"] == self.instance.root_device_name:
-                if v["Volume"].encrypted:
-
-                    # If the volume is already encrypted, decide what do to.
-                    if self.ignore_encrypted is False and v["Volume"].kms_key_id != self.aws_encryption_key_arn:
-                        self.volume_queue.append(v)
-
-                else:
-
-                    # If not encrypted, add to queue
+            if v["DeviceName"] == self.instance.root_device_name or self.encrypt_all:
+                if volume_needs_encryption(v["Volume"].encrypted, v["Volume"].kms_key_id,
+                                           self.aws_encryption_key_arn, self.ignore_encrypted):
                     self.volume_queue.append(v)
 
-            elif self.encrypt_all:
-
-                # Inspect non-root volumes to add to the queue
-                if v["Volume"].encrypted:
-                    # If the volume is already encrypted, decide what do to.
-                    if self.ignore_encrypted is False and v["Volume"].kms_key_id != self.aws_encryption_key_arn:
-                        self.volume_queue.append(v)
+        # Bring back the volumes an interrupted run left between phases.
+        if self.journal is not None and self.resume:
+            self.queue_resumed_volumes()
 
-                else:
+        if len(self.volume_queue) > 0:
 
-                    # If not encrypted, add to queue
-                    self.volume_queue.append(v)
+            # Continue the volumes' own snapshot lineage when discovery found one.
+            if self.inventory is not None and self.inventory.snapshot_lineage:
+                self.find_base_snapshots()
 
-        if len(self.volume_queue) > 0:
+            # Snapshot the volumes while the instance is still running so the snapshot taken after the stop
+            # only has to hold the blocks that changed in between.
+            if self.hot_snapshot:
+                self.take_hot_snapshots()
 
             # If there are any volumes to action against, stop the instance.
+            stopped_at = time.time()
             self.stop_instance()
 
-            for volume in self.volume_queue:
-                self.process_volume(volume["Volume"], volume["DeviceName"], volume["DeleteOnTermination"])
+            if self.max_volume_workers > 1 and len(self.volume_queue) > 1:
+                results = self.prepare_volumes_concurrently()
+            else:
+                results = [self.prepare_volume(volume["Volume"], volume["DeviceName"], volume["DeleteOnTermination"],
+                                               pre_snapshot=volume.get("PreSnapshot"),
+                                               base_snapshot_id=volume.get("BaseSnapshotId"))
+                           for volume in self.volume_queue]
+
+            # A prepared volume comes back as a dictionary, a failed one as its error.
+            prepared = []
+            errors = []
+            for volume, result in zip(self.volume_queue, results):
+                if isinstance(result, dict):
+                    prepared.append(result)
+                else:
+                    errors.append(result)
+                    self.volume_reports.append(self.volume_result(volume["Volume"], volume["DeviceName"], "failed",
+                                                                  error=result))
+
+            # Swap every prepared volume at once, then clean up after the ones that made it.
+            swapped, swap_errors = self.swap_volumes(prepared)
+            for prepared_volume in swapped:
+                self.finish_volume(prepared_volume)
+
+            swapped_ids = set([p["Volume"].id for p in swapped])
+            for p in prepared:
+                if p["Volume"].id not in swapped_ids:
+                    self.volume_reports.append(self.volume_result(p["Volume"], p["DeviceName"], "failed", prepared=p,
+                                                                  error=p.get("Error")))
+
+            for error in errors + swap_errors:
+                print(error)
+                self.errors.append(error)
+
+            # Once all the volumes are done being manipulated, start the system back.  Never without a volume it
+            # had, which would boot it broken or not at all.
+            if self.unattached_devices:
+                print("ERROR: {} left stopped, nothing is attached at {}; run again with --resume once it's "
+                      "fixed".format(self.instance_identification, ", ".join(self.unattached_devices)))
+            elif not self.restart:
+                print("---Leaving instance {} stopped, as it was before the run".format(self.instance_identification))
+            else:
+                self.start_instance()
+            self.collect_savings()
 
-            # Once all the volumes are done being manipulated, start the system back.
-            self.start_instance()
+            self.downtime_seconds = time.time() - stopped_at
+            if self.errors:
+                self.status = "failed"
+            else:
+                self.status = "encrypted"
+            print("****Instance {} was stopped for {:.0f} seconds".format(self.instance_identification,
+                                                                         self.downtime_seconds))
+
+            # Volumes created with an initialization rate finish loading their blocks after the start.
+            if self.prewarm != "none" and not self.unattached_devices:
+                self.report_initialization()
 
             # Print out the new volume information
             if self.generate_report:
-                # Print a report of the new mappings
+                # Print a report of the new mappings, refreshed since the swaps changed them.
+                self.instance.reload()
+                replaced = dict([(r["NewVolumeId"], r) for r in self.volume_reports if r["Status"] == "encrypted"])
+
                 print("\n---New volume mappings for {}".format(self.instance_identification))
                 for block_device_mapping in self.instance.block_device_mappings:
                     device_id = block_device_mapping["Ebs"]["VolumeId"]
                     device_name = block_device_mapping["DeviceName"]
-                    print("---Volume {} is attached at {}".format(device_id, device_name))
+                    if device_id in replaced:
+                        print("---Volume {} is attached at {} (replaced {} using the {} path, {} -> {})".format(
+                            device_id, device_name, replaced[device_id]["VolumeId"],
+                            replaced[device_id]["EncryptionPath"],
+                            describe_performance(replaced[device_id]["Before"]),
+                            describe_performance(replaced[device_id]["After"])))
+                    else:
+                        print("---Volume {} is attached at {}".format(device_id, device_name))
 
         else:
+            self.status = "skipped"
             print("---No volumes to encrypt for {}".format(self.instance_identification))
 
         print("\n****Encryption finished for {}".format(self.instance_identification))
 
-    def process_volume(self, volume, device_name, delete_on_termination):
+    def queue_resumed_volumes(self):
+
+        for entry in self.journal.unfinished(self.instance.id):
+            # An earlier run stopped the instance, so it's started again even though it's stopped now.
+            self.resumed = True
+
+            # The replacement volume of an interrupted swap is ours, never encrypt it again.
+            self.volume_queue = [v for v in self.volume_queue if v["VolumeId"] != entry["new_volume_id"]]
+
+            # Volumes detached before the interruption are no longer in the mappings.
+            if entry["volume_id"] not in [v["VolumeId"] for v in self.volume_queue]:
+                print("---Resuming volume {} for {} from the journal".format(entry["volume_id"],
+                                                                            self.instance_identification))
+                self.volume_queue.append({
+                    "VolumeId": entry["volume_id"],
+                    "Volume": self.ec2_resource.Volume(entry["volume_id"]),
+                    "DeleteOnTermination": entry["delete_on_termination"],
+                    "DeviceName": entry["device_name"],
+                })
+
+    def find_base_snapshots(self):
+
+        # The newest snapshot of a volume (a nightly backup, or one kept by an earlier run) is what EBS makes the
+        # next snapshot of it incremental to.  One still being taken is waited on first, before the stop, so ours
+        # only holds what changed after it.  Base snapshots aren't ours and are never deleted.
+        for volume in self.volume_queue:
+            base = self.inventory.get_base_snapshot(volume["VolumeId"])
+            if not is_fresh(base, self.snapshot_lineage_max_age_hours):
+                continue
+
+            if base["State"] == "pending":
+                print("---Waiting for snapshot {} of volume {} to complete for {}".format(
+                    base["SnapshotId"], volume["VolumeId"], self.instance_identification))
+                try:
+                    self.wait_snapshot_completed(base["SnapshotId"], "base_snapshot", {
+                        "region": self.aws_region, "instance_id": self.instance.id,
+                        "volume_id": volume["VolumeId"], "size_gib": base.get("VolumeSize")})
+                except botocore.exceptions.WaiterError as e:
+                    print("ERROR: {} on {}, not basing volume {} on it".format(e, self.instance_identification,
+                                                                            volume["VolumeId"]))
+                    continue
+
+            print("---Volume {} continues from snapshot {} taken {:.1f} hours ago for {}".format(
+                volume["VolumeId"], base["SnapshotId"], snapshot_age_seconds(base) / 3600.0,
+                self.instance_identification))
+            volume["BaseSnapshotId"] = base["SnapshotId"]
+
+    def take_hot_snapshots(self):
+
+        # Start every snapshot first so they run side by side, then wait on each of them.
+        for volume in self.volume_queue:
+            entry = self.journal_entry(volume["VolumeId"])
+            if entry is not None and (entry["pre_snapshot_id"] or phase_done(entry, "snapshotted")):
+                # A resumed volume already has its hot snapshot, or is past needing one.
+                if entry["pre_snapshot_id"]:
+                    volume["PreSnapshot"] = self.ec2_resource.Snapshot(entry["pre_snapshot_id"])
+                else:
+                    volume["PreSnapshot"] = None
+                continue
+
+            print("---Create hot snapshot of volume {} for {}".format(volume["VolumeId"],
+                                                                     self.instance_identification))
+            volume["PreSnapshotTimer"] = self.start_timer("hot_snapshot", **self.phase_labels(volume["Volume"]))
+            volume["PreSnapshot"] = self.ec2_resource.create_snapshot(
+                VolumeId=volume["VolumeId"],
+                Description="Hot snapshot of volume {} for {}".format(volume["VolumeId"],
+                                                                      self.instance_identification),
+                TagSpecifications=self.tag_specifications("snapshot"),
+            )
+            if self.journal is not None:
+                self.journal.reset(volume["VolumeId"],
+                                   instance_id=self.instance.id,
+                                   device_name=volume["DeviceName"],
+                                   delete_on_termination=volume["DeleteOnTermination"],
+                                   pre_snapshot_id=volume["PreSnapshot"].id)
+
+        for volume in self.volume_queue:
+            if volume["PreSnapshot"] is None:
+                continue
 
-        print("\n---Processing volume {} attached to {} on {}".format(volume.id, device_name,
+            try:
+                self.wait_snapshot_completed(volume["PreSnapshot"].id, "hot_snapshot",
+                                             self.phase_labels(volume["Volume"]))
+            except botocore.exceptions.WaiterError as e:
+                # Fall back to a full snapshot while stopped for this volume.
+                print("ERROR: {} on {}, taking a full snapshot after the stop instead".format(
+                    e, self.instance_identification))
+                if volume.get("PreSnapshotTimer") is not None:
+                    volume["PreSnapshotTimer"].done("error")
+                volume["PreSnapshot"].delete()
+                volume["PreSnapshot"] = None
+                self.record_phase(volume["VolumeId"], pre_snapshot_id=None)
+                continue
+
+            if volume.get("PreSnapshotTimer") is not None:
+                volume["PreSnapshotTimer"].done()
+
+    def prepare_volumes_concurrently(self):
+
+        # Snapshot, copy and create every queued volume in parallel.  The swaps happen afterwards, all at once,
+        # in swap_volumes.
+        pool_size = min(self.max_volume_workers, len(self.volume_queue))
+        print("****Processing {} volumes with {} workers for {}".format(len(self.volume_queue), pool_size,
                                                                         self.instance_identification))
 
-        # Take a snapshot and wait until it's complete.
-        print("---Create snapshot of volume {} for {}".format(volume.id, self.instance_identification))
+        executor = ThreadPoolExecutor(max_workers=pool_size)
+        try:
+            futures = [executor.submit(self.prepare_volume,
+                                       volume["Volume"],
+                                       volume["DeviceName"],
+                                       volume["DeleteOnTermination"],
+                                       pre_snapshot=volume.get("PreSnapshot"),
+                                       base_snapshot_id=volume.get("BaseSnapshotId"))
+                       for volume in self.volume_queue]
+
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append("ERROR: {} on {}".format(e, self.instance_identification))
+        finally:
+            executor.shutdown(wait=True)
+
+        return results
+
+    def prepare_volume(self, volume, device_name, delete_on_termination, pre_snapshot=None, base_snapshot_id=None):
+
+        # Everything up to the new encrypted volume being available, while the original stays attached.  Returns
+        # what swap_volumes and finish_volume need, or the error when the volume failed.
+
+        # Resources aren't thread safe, and this may run on a volume worker: use this thread's own, seeded with
+        # what's already been described.
+        ec2_resource = self.clients.ec2_resource()
+        volume = self.rebuild(ec2_resource.Volume(volume.id), volume)
+        if pre_snapshot is not None:
+            pre_snapshot = self.rebuild(ec2_resource.Snapshot(pre_snapshot.id), pre_snapshot)
+
+        # On --resume pick the volume up after its last completed phase, otherwise start a fresh journal entry.
+        entry = self.journal_entry(volume.id)
+
+        if entry is None:
+            print("\n---Processing volume {} attached to {} on {}".format(volume.id, device_name,
+                                                                            self.instance_identification))
+            if self.journal is not None:
+                self.journal.reset(volume.id,
+                                   instance_id=self.instance.id,
+                                   device_name=device_name,
+                                   delete_on_termination=delete_on_termination,
+                                   pre_snapshot_id=pre_snapshot.id if pre_snapshot is not None else None)
+        else:
+            print("\n---Resuming volume {} attached to {} on {} after phase {}".format(
+                volume.id, device_name, self.instance_identification, entry["phase"]))
+            if pre_snapshot is None and entry["pre_snapshot_id"]:
+                pre_snapshot = ec2_resource.Snapshot(entry["pre_snapshot_id"])
 
-        snapshot = self.ec2_resource.create_snapshot(
-            VolumeId=volume.id,
-            Description="Snapshot of volume {} for {}".format(volume.id, self.instance_identification),
-        )
+        labels = self.phase_labels(volume)
 
-        # Set the max_attempts for this waiter (default 40)
-        self.waiter_snapshot_complete.config.max_attempts = 120
+        # Keep the original's size, IOPS and throughput, on the forced or upgraded type when there is one.
+        before = performance_settings(volume.volume_type, volume.size, volume.iops, volume.throughput)
+        after = target_settings(volume.volume_type, volume.size, volume.iops, volume.throughput,
+                                self.force_volume_type, self.gp2_to_gp3)
 
-        try:
-            self.waiter_snapshot_complete.wait(
-                SnapshotIds=[
-                    snapshot.id,
-                ]
-            )
-        except botocore.exceptions.WaiterError as e:
-            snapshot.delete()
-            return "ERROR: {} on {}".format(e, self.instance_identification)
+        # The snapshot this one is incremental to: the hot snapshot, or else the volume's own newest one.
+        parent_snapshot_id = pre_snapshot.id if pre_snapshot is not None else base_snapshot_id
+        savings = None
 
-        # Copy the snapshot and encrypt it.
-        print("---Create encrypted copy of snapshot for {}".format(volume.id))
-
-        if self.aws_encryption_key_arn:
-            # Use custom key
-            snapshot_encrypted_dict = snapshot.copy(
-                SourceRegion=self.session.region_name,
-                Description="Encrypted copy of snapshot {} for {}"
-                            .format(snapshot.id, self.instance_identification),
-                KmsKeyId=self.aws_encryption_key_arn,
-                Encrypted=True,
-            )
+        if phase_done(entry, "snapshotted"):
+            snapshot = ec2_resource.Snapshot(entry["snapshot_id"])
         else:
-            # Use default key
-            snapshot_encrypted_dict = snapshot.copy(
-                SourceRegion=self.session.region_name,
-                Description="Encrypted copy of snapshot {} for {}"
-                            .format(snapshot.id, self.instance_identification),
-                Encrypted=True,
-            )
+            # After a hot or base snapshot this one only holds the blocks changed since, so it's timed apart.
+            if parent_snapshot_id is not None:
+                timer = self.start_timer("incremental_snapshot", **labels)
+            else:
+                timer = self.start_timer("snapshot", **labels)
 
-        # Get the snapshot object from the copy response and wait.
-        snapshot_encrypted = self.ec2_resource.Snapshot(snapshot_encrypted_dict["SnapshotId"])
+            if entry is not None and entry["snapshot_id"]:
+                # The snapshot was started before the interruption, just wait for it again.
+                snapshot = ec2_resource.Snapshot(entry["snapshot_id"])
+            else:
+                # Take a snapshot and wait until it's complete.
+                print("---Create snapshot of volume {} for {}".format(volume.id, self.instance_identification))
 
-        # Set the max_attempts for this waiter (default 40)
-        self.waiter_snapshot_complete.config.max_attempts = 120
+                snapshot = ec2_resource.create_snapshot(
+                    VolumeId=volume.id,
+                    Description="Snapshot of volume {} for {}".format(volume.id, self.instance_identification),
+                    TagSpecifications=self.tag_specifications("snapshot"),
+                )
+                self.record_phase(volume.id, snapshot_id=snapshot.id)
 
-        try:
-            self.waiter_snapshot_complete.wait(
-                SnapshotIds=[
-                    snapshot_encrypted.id,
-                ],
-            )
-        except botocore.exceptions.WaiterError as e:
-            snapshot.delete()
-            snapshot_encrypted.delete()
-            return "ERROR: {} on {}".format(e, self.instance_identification)
+            try:
+                self.wait_snapshot_completed(snapshot.id, timer.phase, labels)
+            except botocore.exceptions.WaiterError as e:
+                timer.done("error")
+                self.delete_resources(pre_snapshot, snapshot)
+                self.record_phase(volume.id, "failed")
+                return "ERROR: {} on {}".format(e, self.instance_identification)
+
+            timer.done()
+            self.record_phase(volume.id, "snapshotted")
+
+            # Counted on the side while the instance is down, and read back before the snapshot is deleted.
+            if parent_snapshot_id is not None:
+                executor = ThreadPoolExecutor(max_workers=1)
+                savings = executor.submit(self.snapshot_bytes_saved, parent_snapshot_id, snapshot.id, volume.id,
+                                          volume.size)
+                executor.shutdown(wait=False)
+
+        # Decide between the single-step path (create the encrypted volume straight from the snapshot) and the
+        # two-step path (encrypted snapshot copy first).  The copy is only needed when asked for, or when an
+        # already encrypted volume has to move to the default key, since create_volume keeps the snapshot's key.
+        if entry is not None and entry["encryption_path"]:
+            encryption_path = entry["encryption_path"]
+        else:
+            encryption_path = choose_encryption_path(volume.encrypted, self.copy_snapshot or self.prewarm == "fsr",
+                                                     self.aws_encryption_key_arn)
 
-        # Create a new volume from the encrypted snapshot and wait.
-        print("---Create encrypted volume from snapshot for {}".format(volume.id))
+        self.record_phase(volume.id, encryption_path=encryption_path)
+        labels["encryption_path"] = encryption_path
 
-        if self.force_volume_type is not volume.volume_type:
-            update_volume_type = self.force_volume_type
-        else:
-            update_volume_type = volume.volume_type
+        snapshot_encrypted = None
 
-        volume_encrypted = self.ec2_resource.create_volume(
-            SnapshotId=snapshot_encrypted.id,
-            AvailabilityZone=self.instance.placement["AvailabilityZone"],
-            VolumeType=update_volume_type,
-        )
+        if encryption_path == "copy" and phase_done(entry, "copied"):
+            snapshot_encrypted = ec2_resource.Snapshot(entry["encrypted_snapshot_id"])
 
-        # Wait for the volume to be available before updating the tags.
-        try:
-            self.waiter_volume_available.wait(
-                VolumeIds=[
-                    volume_encrypted.id,
-                ],
-            )
-        except botocore.exceptions.WaiterError as e:
-            snapshot.delete()
-            snapshot_encrypted.delete()
-            volume_encrypted.delete()
-            return "ERROR: {} on {}".format(e, self.instance_identification)
+        elif encryption_path == "copy":
+            timer = self.start_timer("copy", **labels)
 
-        # Update the tags to match the old tags if they exist
-        if volume.tags:
-            volume_encrypted.create_tags(Tags=volume.tags)
+            # Hold a snapshot copy slot until the encrypted copy is complete.
+            with self.limits.snapshot_copies:
+                if entry is not None and entry["encrypted_snapshot_id"]:
+                    # The copy was started before the interruption, just wait for it again.
+                    snapshot_encrypted = ec2_resource.Snapshot(entry["encrypted_snapshot_id"])
+                else:
+                    # Copy the snapshot and encrypt it.
+                    print("---Create encrypted copy of snapshot for {}".format(volume.id))
+
+                    if self.aws_encryption_key_arn:
+                        # Use custom key
+                        snapshot_encrypted_dict = snapshot.copy(
+                            SourceRegion=self.session.region_name,
+                            Description="Encrypted copy of snapshot {} for {}"
+                                        .format(snapshot.id, self.instance_identification),
+                            KmsKeyId=self.aws_encryption_key_arn,
+                            Encrypted=True,
+                            TagSpecifications=self.tag_specifications("snapshot"),
+                        )
+                    else:
+                        # Use default key
+                        snapshot_encrypted_dict = snapshot.copy(
+                            SourceRegion=self.session.region_name,
+                            Description="Encrypted copy of snapshot {} for {}"
+                                        .format(snapshot.id, self.instance_identification),
+                            Encrypted=True,
+                            TagSpecifications=self.tag_specifications("snapshot"),
+                        )
+
+                    # Get the snapshot object from the copy response and wait.
+                    snapshot_encrypted = ec2_resource.Snapshot(snapshot_encrypted_dict["SnapshotId"])
+                    self.record_phase(volume.id, encrypted_snapshot_id=snapshot_encrypted.id)
+
+                try:
+                    self.wait_snapshot_completed(snapshot_encrypted.id, "copy", labels)
+                except botocore.exceptions.WaiterError as e:
+                    timer.done("error")
+                    self.delete_resources(pre_snapshot, snapshot, snapshot_encrypted)
+                    self.record_phase(volume.id, "failed")
+                    return "ERROR: {} on {}".format(e, self.instance_identification)
 
-        # Switch the original volume for the new volume.
-        print("---Detach volume {} for {}".format(volume.id, self.instance_identification))
-        self.instance.detach_volume(
-            VolumeId=volume.id,
-            Device=device_name,
-        )
+            timer.done()
+            self.record_phase(volume.id, "copied")
+
+        prewarm = self.prewarm
+
+        if phase_done(entry, "created"):
+            volume_encrypted = ec2_resource.Volume(entry["new_volume_id"])
+        else:
+            # Fast snapshot restore only works on a snapshot with the volume's own key, so only on the copy path.
+            if prewarm == "fsr" and (snapshot_encrypted is None or
+                                     not self.enable_fast_snapshot_restore(snapshot_encrypted, labels)):
+                prewarm = "initialization_rate"
+
+            initialization_args = {}
+            if prewarm == "initialization_rate":
+                initialization_args["VolumeInitializationRate"] = self.volume_initialization_rate
+
+            volume_args = performance_args(after)
+            volume_args.update(initialization_args)
+
+            timer = self.start_timer("create_volume", **labels)
+
+            if after != before:
+                print("---Volume {} goes from {} to {} for {}".format(volume.id, describe_performance(before),
+                                                                     describe_performance(after),
+                                                                     self.instance_identification))
+
+            # Hold a volume creation slot until the new volume is available.
+            with self.limits.volume_creations:
+                if entry is not None and entry["new_volume_id"]:
+                    # The volume was requested before the interruption, just wait for it again.
+                    volume_encrypted = ec2_resource.Volume(entry["new_volume_id"])
+
+                elif encryption_path == "copy":
+                    # Create a new volume from the encrypted snapshot and wait.
+                    print("---Create encrypted volume from encrypted snapshot for {}".format(volume.id))
+
+                    volume_encrypted = ec2_resource.create_volume(
+                        SnapshotId=snapshot_encrypted.id,
+                        AvailabilityZone=self.availability_zone,
+                        TagSpecifications=self.tag_specifications("volume"),
+                        **volume_args
+                    )
+                else:
+                    # Create a new encrypted volume directly from the snapshot and wait.
+                    print("---Create encrypted volume directly from snapshot for {}".format(volume.id))
+
+                    create_volume_args = {
+                        "SnapshotId": snapshot.id,
+                        "AvailabilityZone": self.availability_zone,
+                        "Encrypted": True,
+                        "TagSpecifications": self.tag_specifications("volume"),
+                    }
+
+                    if self.aws_encryption_key_arn:
+                        # Use custom key
+                        create_volume_args["KmsKeyId"] = self.aws_encryption_key_arn
+
+                    create_volume_args.update(volume_args)
+                    volume_encrypted = ec2_resource.create_volume(**create_volume_args)
+
+                self.record_phase(volume.id, new_volume_id=volume_encrypted.id)
+
+                # Wait for the volume to be available before updating the tags.
+                try:
+                    # Keep the describe data, so the report reads the volume's key without describing it again.
+                    volume_data = self.wait_volume_available(volume_encrypted.id, "create_volume", labels)
+                    if volume_data:
+                        volume_encrypted.meta.data = volume_data
+                except botocore.exceptions.WaiterError as e:
+                    timer.done("error")
+                    self.end_fast_snapshot_restore(snapshot_encrypted)
+                    self.delete_resources(pre_snapshot, snapshot, snapshot_encrypted, volume_encrypted)
+                    self.record_phase(volume.id, "failed")
+                    return "ERROR: {} on {}".format(e, self.instance_identification)
 
-        # Wait for the old volume to be detached before attaching the new volume.
+            # Update the tags to match the old tags if they exist
+            if volume.tags:
+                volume_encrypted.create_tags(Tags=volume.tags)
+
+            timer.done()
+            self.record_phase(volume.id, "created")
+
+        return {
+            "Volume": volume,
+            "DeviceName": device_name,
+            "DeleteOnTermination": delete_on_termination,
+            "Entry": entry,
+            "Labels": labels,
+            "PreSnapshot": pre_snapshot,
+            "Snapshot": snapshot,
+            "EncryptedSnapshot": snapshot_encrypted,
+            "NewVolume": volume_encrypted,
+            "EncryptionPath": encryption_path,
+            "ParentSnapshotId": parent_snapshot_id,
+            "Savings": savings,
+            "Prewarm": prewarm,
+            "Before": before,
+            "After": after,
+        }
+
+    def swap_volumes(self, prepared):
+
+        # Switch every original volume for its new one in one phase: the detaches are all sent, then waited on
+        # together, then the attaches are all sent and one modify_attribute call sets every DeleteOnTermination.
+        # EC2 has no batched detach or attach, but nothing waits in between the calls.  Returns the volumes that
+        # were swapped and the errors of the ones that weren't.
+        errors = []
+        failures = {}
+
+        detaching = []
+        for p in [p for p in prepared if not phase_done(p["Entry"], "detached")]:
+            volume = p["Volume"]
+            p["Timer"] = self.start_timer("detach", **p["Labels"])
+
+            # A resumed run may have sent the detach already; only send it while the volume is still attached.
+            if p["Entry"] is not None:
+                volume.reload()
+
+            if p["Entry"] is None or volume.state == "in-use":
+                print("---Detach volume {} for {}".format(volume.id, self.instance_identification))
+                try:
+                    self.instance.detach_volume(
+                        VolumeId=volume.id,
+                        Device=p["DeviceName"],
+                    )
+                except botocore.exceptions.ClientError as e:
+                    # Still attached, so the volume just isn't swapped; the others carry on.
+                    p["Timer"].done("error")
+                    failures[volume.id] = e
+                    p["Error"] = "ERROR: {} on {}".format(e, self.instance_identification)
+                    errors.append(p["Error"])
+                    self.abandon_volume(p)
+                    continue
+
+            detaching.append(p)
+
+        # Wait for the old volumes to be detached before attaching the new volumes.
+        wait_failures = self.wait_volumes_available([p["Volume"].id for p in detaching])
+        failures.update(wait_failures)
+
+        reattached = []
+        for p in detaching:
+            volume = p["Volume"]
+            if volume.id in wait_failures:
+                p["Timer"].done("error")
+                p["Error"] = "ERROR: {} on {}".format(wait_failures[volume.id], self.instance_identification)
+                errors.append(p["Error"])
+
+                # A volume that's still attached is simply not swapped.  One that got as far as detaching has to
+                # go back first, or the instance would boot without it.
+                volume.reload()
+                if volume.state == "in-use":
+                    self.abandon_volume(p)
+                elif self.reattach_original(p):
+                    reattached.append(p)
+            else:
+                p["Timer"].done()
+                self.record_phase(volume.id, "detached")
+
+        swapped = [p for p in prepared if p["Volume"].id not in failures]
+
+        attaching = []
+        for p in swapped:
+            if phase_done(p["Entry"], "attached"):
+                continue
+
+            volume_encrypted = p["NewVolume"]
+            p["Timer"] = self.start_timer("attach", **p["Labels"])
+
+            if p["Entry"] is not None:
+                volume_encrypted.reload()
+
+            if p["Entry"] is None or volume_encrypted.state == "available":
+                print("---Attach volume {} for {}".format(volume_encrypted.id, self.instance_identification))
+
+                try:
+                    self.instance.attach_volume(
+                        VolumeId=volume_encrypted.id,
+                        Device=p["DeviceName"]
+                    )
+                except botocore.exceptions.ClientError as e:
+                    p["Timer"].done("error")
+                    failures[p["Volume"].id] = e
+                    p["Error"] = "ERROR: {} on {}".format(e, self.instance_identification)
+                    errors.append(p["Error"])
+
+                    # The original is already detached: put it back so the instance doesn't boot without it.
+                    if self.reattach_original(p):
+                        reattached.append(p)
+                    continue
+
+            attaching.append(p)
+
+        if attaching or reattached:
+            # Modify instance volume attributes to match the originals.  The volumes are attached by now, so a
+            # failure here only leaves their DeleteOnTermination flags to be set by hand.
+            try:
+                self.instance.modify_attribute(
+                    BlockDeviceMappings=[
+                        {
+                            "DeviceName": p["DeviceName"],
+                            "Ebs": {
+                                "DeleteOnTermination": p["DeleteOnTermination"],
+                            },
+                        }
+                        for p in attaching + reattached
+                    ],
+                )
+            except botocore.exceptions.ClientError as e:
+                error = "ERROR: DeleteOnTermination not set on {} of {}: {}".format(
+                    ", ".join([p["DeviceName"] for p in attaching + reattached]), self.instance_identification, e)
+                errors.append(error)
+                for p in attaching + reattached:
+                    p["Error"] = "{}; {}".format(p["Error"], error) if p.get("Error") else error
+
+        for p in attaching:
+            p["Timer"].done()
+            self.record_phase(p["Volume"].id, "attached")
+
+        return [p for p in swapped if p["Volume"].id not in failures], errors
+
+    def abandon_volume(self, prepared):
+
+        # The original stays (or is back) where it was: the new resources go, as if the volume had never been
+        # worked on.
+        self.end_fast_snapshot_restore(prepared["EncryptedSnapshot"])
+        self.delete_resources(prepared["PreSnapshot"], prepared["Snapshot"], prepared["EncryptedSnapshot"],
+                              prepared["NewVolume"])
+        self.record_phase(prepared["Volume"].id, "failed")
+
+        # Deleted now, so the result doesn't point at it.
+        prepared["NewVolume"] = None
+
+    def reattach_original(self, prepared):
+
+        # Attach the original volume back where it was after it couldn't be swapped.  If it can't go back,
+        # everything is kept for --resume to try again and the instance is left stopped.
+        volume = prepared["Volume"]
+        print("---Reattach original volume {} at {} for {}".format(volume.id, prepared["DeviceName"],
+                                                                 self.instance_identification))
         try:
-            self.waiter_volume_available.wait(
-                VolumeIds=[
-                    volume.id,
-                ],
+            self.instance.attach_volume(
+                VolumeId=volume.id,
+                Device=prepared["DeviceName"]
             )
-        except botocore.exceptions.WaiterError as e:
-            snapshot.delete()
-            snapshot_encrypted.delete()
-            volume_encrypted.delete()
-            return "ERROR: {} on {}".format(e, self.instance_identification)
+        except botocore.exceptions.ClientError as e:
+            error = "ERROR: Original volume {} couldn't be reattached at {}, leaving {} stopped: {}".format(
+                volume.id, prepared["DeviceName"], self.instance_identification, e)
+            print(error)
+            self.unattached_devices.append(prepared["DeviceName"])
+            self.errors.append(error)
+            prepared["Error"] = "{}; {}".format(prepared["Error"], error)
+            return False
 
-        print("---Attach volume {} for {}".format(volume_encrypted.id, self.instance_identification))
+        self.abandon_volume(prepared)
+        return True
 
-        self.instance.attach_volume(
-            VolumeId=volume_encrypted.id,
-            Device=device_name
-        )
+    def finish_volume(self, prepared):
 
-        # Modify instance volume attributes to match the original.
-        self.instance.modify_attribute(
-            BlockDeviceMappings=[
-                {
-                    "DeviceName": device_name,
-                    "Ebs": {
-                        "DeleteOnTermination": delete_on_termination,
-                    },
-                },
-            ],
-        )
+        # Delete snapshots and original volume.  Whatever a failure leaves behind keeps its run id tag, for the
+        # sweep command to find.
+        volume = prepared["Volume"]
+        snapshot = prepared["Snapshot"]
+        volume_encrypted = prepared["NewVolume"]
 
-        # Delete snapshots and original volume
-        # TODO: Need to move this to a separate function that gets called on exception
+        # Counting the bytes saved reads the snapshot, so it's only deleted once they're in, after the start.
+        savings = prepared["Savings"]
 
         print("---Clean up resources for {}".format(volume.id))
+        timer = self.start_timer("cleanup", **prepared["Labels"])
+
+        # On a resumed run the slot is gone, but fast snapshot restore may still be on.
+        if prepared["Prewarm"] == "fsr":
+            self.end_fast_snapshot_restore(prepared["EncryptedSnapshot"], always=True)
 
         if self.keep_snapshots:
             print("---Keeping snapshot {} per the configuration.".format(snapshot.id))
-            snapshot_encrypted.delete()
-            volume.delete()
+            self.release(volume_encrypted.id, snapshot.id)
+            self.delete_resources(prepared["PreSnapshot"], prepared["EncryptedSnapshot"], volume)
         else:
-            snapshot.delete()
-            snapshot_encrypted.delete()
-            volume.delete()
+            self.release(volume_encrypted.id)
+            self.delete_resources(prepared["PreSnapshot"], snapshot if savings is None else None,
+                                  prepared["EncryptedSnapshot"], volume)
+
+        timer.done()
+        self.record_phase(volume.id, "cleaned")
+
+        report = self.volume_result(volume, prepared["DeviceName"], "encrypted", prepared=prepared,
+                                    error=prepared.get("Error"))
+        self.volume_reports.append(report)
+        if savings is not None:
+            self.pending_savings.append((report, savings, None if self.keep_snapshots else snapshot))
 
         print("---Encryption finished for {}".format(volume.id))
 
+    def volume_result(self, volume, device_name, status, prepared=None, error=None, snapshot_bytes_saved=None):
+
+        # What the run report says about one volume.  A volume that failed before it was prepared only has its
+        # original side.
+        prepared = prepared or {}
+        volume_encrypted = prepared.get("NewVolume")
+        prewarm = prepared.get("Prewarm")
+
+        return {
+            "VolumeId": volume.id,
+            "NewVolumeId": volume_encrypted.id if volume_encrypted is not None else None,
+            "DeviceName": device_name,
+            "Status": status,
+            "Error": error,
+            "KmsKeyId": volume.kms_key_id,
+            "NewKmsKeyId": volume_encrypted.kms_key_id if volume_encrypted is not None else None,
+            "EncryptionPath": prepared.get("EncryptionPath"),
+            "BaseSnapshotId": prepared.get("ParentSnapshotId"),
+            "SnapshotBytesSaved": snapshot_bytes_saved,
+            "Prewarm": None if prewarm == "none" else prewarm,
+            "SizeGiB": volume.size,
+            "Before": prepared.get("Before") or performance_settings(volume.volume_type, volume.size, volume.iops,
+                                                                     volume.throughput),
+            "After": prepared.get("After"),
+            "PhaseSeconds": self.phase_seconds(volume.id),
+        }
+
+    def start_timer(self, phase, **labels):
+
+        # Every phase of the instance is also kept here, for the timings in its result.
+        timer = self.metrics.start(phase, **labels)
+        self.timers.append(timer)
+        return timer
+
+    def phase_seconds(self, volume_id=None):
+
+        # {phase: seconds} of the finished phases of one volume, or of the instance itself (stop, start).
+        seconds = {}
+        for timer in self.timers:
+            if timer.duration is not None and timer.labels.get("volume_id") == volume_id:
+                seconds[timer.phase] = round(seconds.get(timer.phase, 0) + timer.duration, 3)
+        return seconds
+
+    def enable_fast_snapshot_restore(self, snapshot, labels):
+
+        # Turn fast snapshot restore on for the snapshot in the instance's zone and wait until it's enabled.  False
+        # when no slot is free or it doesn't get there, for the volume to fall back to an initialization rate.
+        if not self.limits.fast_snapshot_restores.acquire(False):
+            print("---No fast snapshot restore slot free for {}, using an initialization rate instead".format(
+                snapshot.id))
+            return False
+
+        self.fast_snapshot_restores.add(snapshot.id)
+        availability_zone = self.availability_zone
+        timer = self.start_timer("fast_snapshot_restore", **labels)
+
+        print("---Enable fast snapshot restore on {} in {} for {}".format(snapshot.id, availability_zone,
+                                                                        self.instance_identification))
+        try:
+            enable_fast_snapshot_restore(self.ec2_client, snapshot.id, availability_zone)
+            self.wait_fast_snapshot_restore_enabled(snapshot.id, availability_zone)
+        except Exception as e:
+            timer.done("error")
+            print("ERROR: {} on {}, using an initialization rate instead".format(e, self.instance_identification))
+            self.end_fast_snapshot_restore(snapshot)
+            return False
+
+        timer.done()
+        return True
+
+    def end_fast_snapshot_restore(self, snapshot, always=False):
+
+        # Turn it off again, since it's billed for every hour it's on, and give the slot back.
+        if snapshot is None or (snapshot.id not in self.fast_snapshot_restores and not always):
+            return
+
+        disable_fast_snapshot_restore(self.ec2_client, snapshot.id, self.availability_zone)
+        if snapshot.id in self.fast_snapshot_restores:
+            self.fast_snapshot_restores.discard(snapshot.id)
+            self.limits.fast_snapshot_restores.release()
+
+    def report_initialization(self):
+
+        # Report how far the volumes created with an initialization rate are, and with wait_for_initialization wait
+        # until they're all fully initialized.
+        reports = [r for r in self.volume_reports if r["Prewarm"] == "initialization_rate"]
+        if not reports:
+            return
+
+        expected = max([initialization_seconds(r["SizeGiB"], self.volume_initialization_rate) for r in reports])
+        deadline = time.time() + expected + INITIALIZATION_TIMEOUT_MARGIN
+        interval = self.poller.max_interval if self.poller is not None else INITIALIZATION_POLL_INTERVAL
+
+        while True:
+            progress = initialization_progress(self.ec2_client, [r["NewVolumeId"] for r in reports])
+            for report in reports:
+                percent, seconds_left = progress.get(report["NewVolumeId"], (None, None))
+                report["InitializationProgress"] = percent
+                if percent is not None and percent >= 100:
+                    print("---Volume {} of {} is fully initialized".format(report["NewVolumeId"],
+                                                                        self.instance_identification))
+                elif percent is not None:
+                    print("---Volume {} of {} is {}% initialized, about {} seconds left".format(
+                        report["NewVolumeId"], self.instance_identification, percent, seconds_left or 0))
+
+            # Volumes EBS doesn't report on can't be waited for.
+            initializing = [r for r in reports if r["InitializationProgress"] is not None and
+                            r["InitializationProgress"] < 100]
+            if not initializing or not self.wait_for_initialization:
+                return
+            if time.time() > deadline:
+                print("ERROR: Volumes of {} still initializing, not waiting for them any longer".format(
+                    self.instance_identification))
+                return
+            time.sleep(interval)
+
+    def tag_specifications(self, resource_type):
+
+        # Everything the run creates carries its run id until it's meant to stay, so leftovers can be swept.
+        return [{"ResourceType": resource_type, "Tags": run_tags(self.run_id, self.instance.id)}]
+
+    def release(self, *resource_ids):
+
+        # Take the run id off what stays (the attached encrypted volume, kept snapshots) so it's never swept.
+        self.ec2_client.delete_tags(Resources=list(resource_ids), Tags=[{"Key": RUN_TAG_KEY}])
+
+    def collect_savings(self):
+
+        # The bytes saved are only a report, so they're read once the instance is back up, and the snapshots kept
+        # for counting them are deleted then.
+        for report, savings, snapshot in self.pending_savings:
+            try:
+                report["SnapshotBytesSaved"] = savings.result()
+            except Exception as e:
+                print("---Can't count the bytes saved by volume {}: {}".format(report["VolumeId"], e))
+            self.delete_resources(snapshot)
+        self.pending_savings = []
+
+    def snapshot_bytes_saved(self, parent_snapshot_id, snapshot_id, volume_id, size_gib):
+
+        # What the snapshot didn't have to upload thanks to its parent: the parent's data less what changed since.
+        parent_data_bytes = snapshot_data_bytes(self.ec2_client, parent_snapshot_id)
+        saved = bytes_saved(self.clients.ebs_client(), parent_snapshot_id, snapshot_id, size_gib,
+                            parent_data_bytes)
+        if saved is not None:
+            print("---Snapshot {} of volume {} ({} GiB) saved {}{:.1f} GiB by continuing from snapshot {}".format(
+                snapshot_id, volume_id, size_gib, "" if parent_data_bytes is not None else "at most ",
+                saved / float(GIB), parent_snapshot_id))
+        return saved
+
+    def phase_labels(self, volume):
+
+        # What every phase event of a volume carries, so durations can be related to size and type.
+        return {
+            "region": self.aws_region,
+            "instance_id": self.instance.id,
+            "volume_id": volume.id,
+            "size_gib": volume.size,
+            "volume_type": volume.volume_type,
+        }
+
+    def journal_entry(self, volume_id):
+
+        # Only a resumed run reuses what the journal holds; a fresh run starts every volume over.
+        if self.journal is None or not self.resume:
+            return None
+
+        entry = self.journal.get(volume_id)
+        if entry is None or entry["phase"] in FINAL_PHASES:
+            return None
+
+        return entry
+
+    def record_phase(self, volume_id, phase=None, **fields):
+
+        if self.journal is not None:
+            self.journal.record(volume_id, phase, **fields)
+
+    @staticmethod
+    def rebuild(resource, original):
+
+        # The same EC2 object as original, from the calling thread's resource, without describing it again.
+        if original.meta.data is not None:
+            resource.meta.data = dict(original.meta.data)
+        return resource
+
+    @staticmethod
+    def delete_resources(*resources):
+
+        # Delete the snapshots and volumes that were created (or replaced), skipping the ones never made and,
+        # on a resumed run, the ones already deleted before the interruption.
+        for resource in resources:
+            if resource is not None:
+                try:
+                    resource.delete()
+                except botocore.exceptions.ClientError as e:
+                    if not e.response.get("Error", {}).get("Code", "").endswith(".NotFound"):
+                        raise
+
     def stop_instance(self):
 
         print("****Stopping instance {}".format(self.instance_identification))
 
-        # Exit if instance is pending, shutting-down, or terminated
-        instance_exit_states = [0, 32, 48]
-        if self.instance.state["Code"] in instance_exit_states:
-            raise Exception("ERROR: Instance is {} please make sure this instance {} is active.".format(
-                self.instance.state["Name"],
-                self.instance_name
-            ))
+        timer = self.start_timer("stop", region=self.aws_region, instance_id=self.instance.id)
 
-        # Validate successful shutdown if it is running or stopping
-        if self.instance.state["Code"] is 16:
-            self.instance.stop()
+        # Hold an instance stop slot until the instance is stopped.
+        with self.limits.instance_stops:
+            # The state read at discovery can be hours old by now (hot snapshots, a long queue), so decide on a
+            # fresh one.
+            self.instance.reload()
 
-        # Set the max_attempts for this waiter (default 40)
-        self.waiter_instance_stopped.config.max_attempts = 40
+            # Exit if instance is pending, shutting-down, or terminated
+            instance_exit_states = [0, 32, 48]
+            if self.instance.state["Code"] in instance_exit_states:
+                timer.done("error")
+                raise Exception("ERROR: Instance is {} please make sure this instance {} is active.".format(
+                    self.instance.state["Name"],
+                    self.instance_name
+                ))
 
-        try:
-            self.waiter_instance_stopped.wait(
-                InstanceIds=[
-                    self.instance.id,
-                ]
-            )
-        except botocore.exceptions.WaiterError as e:
-            raise Exception("ERROR: {} on {}".format(e, self.instance_identification))
+            # Only an instance that was running is started again once its volumes are swapped.
+            self.restart = self.instance.state["Code"] == 16 or self.resumed
+
+            # Validate successful shutdown if it is running or stopping
+            if self.instance.state["Code"] == 16:
+                self.send_stop()
+
+            try:
+                self.wait_instance_stopped(self.instance.id)
+            except botocore.exceptions.WaiterError as e:
+                timer.done("error")
+                raise Exception("ERROR: {} on {}".format(e, self.instance_identification))
+
+        timer.done()
 
     def start_instance(self):
 
         # Start the instance and wait until it's running
         print("---Restart instance {}".format(self.instance_identification))
-        self.instance.start()
+        timer = self.start_timer("start", region=self.aws_region, instance_id=self.instance.id)
+        self.send_start()
 
         try:
-            self.waiter_instance_running.wait(
-                InstanceIds=[
-                    self.instance_id,
-                ]
-            )
+            self.wait_instance_running(self.instance_id)
         except botocore.exceptions.WaiterError as e:
+            timer.done("error")
             raise Exception("ERROR: {} on {}".format(e, self.instance_identification))
 
+        timer.done()
+
+    def send_stop(self):
+
+        # Batched with the other instances of the region when there's a lifecycle coordinator.
+        if self.lifecycle is not None:
+            self.lifecycle.stop_instance(self.instance.id)
+        else:
+            self.instance.stop()
+
+    def send_start(self):
+
+        if self.lifecycle is not None:
+            self.lifecycle.start_instance(self.instance.id)
+        else:
+            self.instance.start()
+
+    def wait_snapshot_completed(self, snapshot_id, phase=None, labels=None):
+
+        # Use the shared status poller when there is one, otherwise fall back to the waiter.
+        self.track_progress(snapshot_id, "snapshot", phase, labels)
+        try:
+            if self.poller is not None:
+                self.poller.wait_snapshot_completed(snapshot_id)
+            else:
+                self.wait_through_throttling(self.waiter_snapshot_complete, SnapshotIds=[snapshot_id])
+        except botocore.exceptions.WaiterError:
+            self.done_progress(snapshot_id, "error")
+            raise
+        self.done_progress(snapshot_id)
+
+    def wait_volume_available(self, volume_id, phase=None, labels=None):
+
+        # Returns the volume's describe data when the poller has it.
+        self.track_progress(volume_id, "volume", phase, labels)
+        volume_data = None
+        try:
+            if self.poller is not None:
+                volume_data = self.poller.wait_volume_available(volume_id)
+            else:
+                self.wait_through_throttling(self.waiter_volume_available, VolumeIds=[volume_id])
+        except botocore.exceptions.WaiterError:
+            self.done_progress(volume_id, "error")
+            raise
+        self.done_progress(volume_id)
+        return volume_data
+
+    def track_progress(self, resource_id, kind, phase, labels):
+
+        # Only the waits that say which phase they're for show up in the progress view.
+        if self.progress is not None and phase is not None:
+            self.progress.track(resource_id, kind, phase, **(labels or {}))
+
+    def done_progress(self, resource_id, status="ok"):
+
+        if self.progress is not None:
+            self.progress.done(resource_id, status)
+
+    def wait_volumes_available(self, volume_ids):
+
+        # One wait for a batch of volumes.  Returns {volume id: error} for the ones that didn't become available.
+        failures = {}
+        if not volume_ids:
+            return failures
+
+        if self.poller is not None:
+            # Watched together, so every poll describes the whole batch in one call.
+            futures = [(volume_id, self.poller.watch_volume_available(volume_id)) for volume_id in volume_ids]
+            for volume_id, future in futures:
+                try:
+                    self.poller.result(future, VOLUME_TIMEOUT)
+                except botocore.exceptions.WaiterError as e:
+                    failures[volume_id] = e
+        else:
+            try:
+                self.wait_through_throttling(self.waiter_volume_available, VolumeIds=list(volume_ids))
+            except botocore.exceptions.WaiterError:
+                # The waiter doesn't say which volume it gave up on, so find out one volume at a time.
+                for volume_id in volume_ids:
+                    try:
+                        self.wait_volume_available(volume_id)
+                    except botocore.exceptions.WaiterError as e:
+                        failures[volume_id] = e
+
+        return failures
+
+    def wait_fast_snapshot_restore_enabled(self, snapshot_id, availability_zone):
+
+        if self.poller is not None:
+            self.poller.wait_fast_snapshot_restore_enabled(snapshot_id)
+        else:
+            wait_fast_snapshot_restore(self.ec2_client, snapshot_id, availability_zone)
+
+    def wait_instance_stopped(self, instance_id):
+
+        if self.poller is not None:
+            self.poller.wait_instance_stopped(instance_id)
+        else:
+            self.wait_through_throttling(self.waiter_instance_stopped, InstanceIds=[instance_id])
+
+    def wait_instance_running(self, instance_id):
+
+        if self.poller is not None:
+            self.poller.wait_instance_running(instance_id)
+        else:
+            self.wait_through_throttling(self.waiter_instance_running, InstanceIds=[instance_id])
+
+    @staticmethod
+    def wait_through_throttling(waiter, **kwargs):
+
+        # A waiter gives up on the first error that isn't one of its states, throttling included.  Being throttled
+        # says nothing about the resource, so wait again instead of failing the volume and deleting its snapshots.
+        for attempt in range(WAITER_THROTTLE_RETRIES):
+            try:
+                return waiter.wait(**kwargs)
+            except botocore.exceptions.WaiterError as e:
+                code = (e.last_response or {}).get("Error", {}).get("Code")
+                if code not in THROTTLE_ERROR_CODES or attempt == WAITER_THROTTLE_RETRIES - 1:
+                    raise
+                time.sleep(min(30, 2 ** attempt))
+
     def get_instance_info_from_name(self):
 
         # Setup the filter for getting the instance
@@ -410,9 +1397,20 @@ class Worker:
                  _force_volume_type,
                  _encryption_key_arn,
                  _keep_snapshots,
-                 _instance_unknown):
-
-        if "i-" in _instance_unknown:
+                 _instance_unknown,
+                 _gp2_to_gp3=False,
+                 _max_volume_workers=1,
+                 _hot_snapshot=False,
+                 _copy_snapshot=False,
+                 _snapshot_lineage_max_age_hours=24,
+                 _prewarm="none",
+                 _volume_initialization_rate=MAX_INITIALIZATION_RATE,
+                 _wait_for_initialization=False,
+                 _run_id=None,
+                 _inventory=None,
+                 _resume=False):
+
+        if _instance_unknown.startswith("i-"):
             self.instance_id = _instance_unknown
             self.instance_name = None
         else:
@@ -425,29 +1423,658 @@ class Worker:
         self.ignore_encrypted = _ignore_encrypted
         self.generate_report = _generate_report
         self.force_volume_type = _force_volume_type
+        self.gp2_to_gp3 = _gp2_to_gp3
         self.encryption_key_arn = _encryption_key_arn
         self.keep_snapshots = _keep_snapshots
+        self.max_volume_workers = _max_volume_workers
+        self.hot_snapshot = _hot_snapshot
+        self.copy_snapshot = _copy_snapshot
+        self.snapshot_lineage_max_age_hours = _snapshot_lineage_max_age_hours
+        self.prewarm = _prewarm
+        self.volume_initialization_rate = _volume_initialization_rate
+        self.wait_for_initialization = _wait_for_initialization
+        self.run_id = _run_id
+        self.inventory = _inventory
+        self.resume = _resume
+
+    def queued_volume_sizes(self):
+
+        # Sizes in GiB of the volumes the encrypter will queue, read from discovery.  None when it isn't known.
+        volumes = self.queued_volumes()
+        if volumes is None:
+            return None
+        return [size for size, encryption_path in volumes]
+
+    def queued_volumes(self):
+
+        # (size in GiB, encryption path) of the volumes the encrypter will queue, read from discovery, with the
+        # path chosen the way prepare_volume chooses it.  None when it isn't known.
+        if self.inventory is None:
+            return None
 
+        try:
+            instance_id = self.instance_id or self.inventory.find_instance_id(self.instance_name)
+        except Exception:
+            return None
+
+        instance_data = self.inventory.get_instance(instance_id)
+        if instance_data is None:
+            return None
+
+        volumes = []
+        for block_device_mapping in instance_data.get("BlockDeviceMappings", []):
+            volume_data = self.inventory.get_volume(block_device_mapping["Ebs"]["VolumeId"])
+            if volume_data is None:
+                continue
+            if block_device_mapping["DeviceName"] == instance_data.get("RootDeviceName") or self.encrypt_all:
+                if volume_needs_encryption(volume_data.get("Encrypted"), volume_data.get("KmsKeyId"),
+                                           self.encryption_key_arn, self.ignore_encrypted):
+                    encryption_path = choose_encryption_path(volume_data.get("Encrypted"),
+                                                             self.copy_snapshot or self.prewarm == "fsr",
+                                                             self.encryption_key_arn)
+                    volumes.append((volume_data["Size"], encryption_path))
+        return volumes
+
+
+class InstanceResult:
+    def __init__(self, _instance_identification, _region):
+
+        # Structured outcome of one instance, returned by the encrypter and run() instead of only printed.
+        self.instance_identification = _instance_identification
+        self.region = _region
+        self.profile = None
+        self.run_id = None
+        self.instance_id = ""
+        self.instance_name = ""
+        self.status = "pending"
+        self.message = None
+        self.errors = []
+        self.volumes = []
+        self.downtime_seconds = None
+        self.duration_seconds = None
+        self.phase_seconds = {}
+
+    def to_dict(self):
+
+        return {
+            "Instance": self.instance_identification,
+            "InstanceId": self.instance_id,
+            "InstanceName": self.instance_name,
+            "Profile": self.profile,
+            "Region": self.region,
+            "RunId": self.run_id,
+            "Status": self.status,
+            "Message": self.message,
+            "Errors": self.errors,
+            "Volumes": self.volumes,
+            "DowntimeSeconds": self.downtime_seconds,
+            "DurationSeconds": self.duration_seconds,
+            "PhaseSeconds": self.phase_seconds,
+        }
+
+
+def run(worker, _poller=None, _limits=None, _journal=None, _clients=None, _metrics=None, _lifecycle=None,
+        _progress=None):
+
+    result = InstanceResult(worker.instance_id or worker.instance_name, worker.region)
+    result.profile = worker.profile
+    result.run_id = worker.run_id
+    started_at = time.time()
+
+    try:
+        # Each worker creates a VolumeEncryption obj and runs the utility.
+        worker_ve = InstanceVolumeEncrypter(_profile=worker.profile,
+                                            _region=worker.region,
+                                            _encrypt_all=worker.encrypt_all,
+                                            _ignore_encrypted=worker.ignore_encrypted,
+                                            _generate_report=worker.generate_report,
+                                            _force_volume_type=worker.force_volume_type,
+                                            _gp2_to_gp3=worker.gp2_to_gp3,
+                                            _encryption_key_arn=worker.encryption_key_arn,
+                                            _keep_snapshots=worker.keep_snapshots,
+                                            _max_volume_workers=worker.max_volume_workers,
+                                            _hot_snapshot=worker.hot_snapshot,
+                                            _copy_snapshot=worker.copy_snapshot,
+                                            _snapshot_lineage_max_age_hours=worker.snapshot_lineage_max_age_hours,
+                                            _prewarm=worker.prewarm,
+                                            _volume_initialization_rate=worker.volume_initialization_rate,
+                                            _wait_for_initialization=worker.wait_for_initialization,
+                                            _run_id=worker.run_id,
+                                            _inventory=worker.inventory,
+                                            _poller=_poller,
+                                            _lifecycle=_lifecycle,
+                                            _limits=_limits,
+                                            _journal=_journal,
+                                            _resume=worker.resume,
+                                            _clients=_clients,
+                                            _metrics=_metrics,
+                                            _progress=_progress,
+                                            _instance_id=worker.instance_id,
+                                            _instance_name=worker.instance_name)
+        result = worker_ve.encrypt_instance_volumes()
+
+        if result.message is not None:
+            print(result.message)
+
+    except Exception as e:
+        result.status = "failed"
+        result.errors.append("{}".format(e))
+        print(e)
+
+    result.duration_seconds = time.time() - started_at
+    return result
+
+
+class Orchestrator:
+    def __init__(self, _max_workers=20, _poller=None, _limits=None, _journal=None, _clients=None, _metrics=None,
+                 _forget_finished=False, _lifecycle=None, _progress=None, _report=None):
+
+        # Runs many instances of one profile and region at once on threads in this process, sharing one client set,
+        # one poller, one lifecycle coordinator, one set of limits and one journal.
+        self.max_workers = _max_workers
+        self.poller = _poller
+        self.lifecycle = _lifecycle
+        self.progress = _progress
+        self.journal = _journal
+        self.clients = _clients
+        self.metrics = _metrics
+        self.forget_finished = _forget_finished
+
+        # Every result goes into the run report as soon as its instance is done.
+        self.report = _report
+
+        if _limits is not None:
+            self.limits = _limits
+        else:
+            self.limits = ConcurrencyLimits()
 
-def run(worker):
+        # Group waves call run() from one thread per group, side by side: every instance of every call takes one of
+        # these slots, so together they never work on more than max_workers instances.
+        self.slots = threading.BoundedSemaphore(max(1, _max_workers))
 
-    # Each worker creates a VolumeEncryption obj and runs the utility.
-    worker_ve = InstanceVolumeEncrypter(_profile=worker.profile,
-                                        _region=worker.region,
-                                        _encrypt_all=worker.encrypt_all,
-                                        _ignore_encrypted=worker.ignore_encrypted,
-                                        _generate_report=worker.generate_report,
-                                        _force_volume_type=worker.force_volume_type,
-                                        _encryption_key_arn=worker.encryption_key_arn,
-                                        _keep_snapshots=worker.keep_snapshots,
-                                        _instance_id=worker.instance_id,
-                                        _instance_name=worker.instance_name)
-    worker_ve.encrypt_instance_volumes()
+    def run(self, workers, summary=True):
 
+        # Workers may be a lazy iterator.  Only a couple of them per slot are taken at a time, so a streamed
+        # selection starts working right away and never sits in memory as a whole.
+        results = []
+        workers = iter(workers)
+        pending = {}
 
-if __name__ == "__main__":
+        def submit_next():
+            for worker in workers:
+                pending[executor.submit(self.run_in_slot, worker)] = worker
+                return True
+            return False
+
+        executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        try:
+            while len(pending) < 2 * self.max_workers and submit_next():
+                pass
+
+            while pending:
+                done, not_done = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    worker = pending.pop(future)
+                    result = future.result()
+                    print("****Finished {} with status {}".format(result.instance_identification, result.status))
+                    results.append(result)
+                    if self.report is not None:
+                        self.report.write(result)
+
+                    if self.forget_finished and worker.inventory is not None:
+                        worker.inventory.forget(result.instance_id or worker.instance_id)
+                    submit_next()
+        finally:
+            executor.shutdown(wait=True)
+
+        if summary:
+            self.print_summary(results)
+        return results
+
+    def run_in_slot(self, worker):
+
+        with self.slots:
+            return run(worker, self.poller, self.limits, self.journal, self.clients, self.metrics, self.lifecycle,
+                       self.progress)
+
+    @staticmethod
+    def print_summary(results):
+
+        print("\n****Summary of {} instances".format(len(results)))
+        for status in ["encrypted", "skipped", "not_found", "failed"]:
+            matching = [r for r in results if r.status == status]
+            if matching:
+                print("---{}: {}".format(status, ", ".join([r.instance_identification for r in matching])))
+
+
+def load_targets(manifest_path, profile, region, instance_ids, instance_names, filters=None, groups=None):
+
+    # Targets come from the manifest file, then the config file, then the single profile and region of the CLI.
+    # Filters are "Name=Value1,Value2" strings everywhere.  Groups are {"asg": name} or {"tags": [filters]}, with an
+    # optional "max_unavailable" of their own.
+    # Entries for the same (profile, region) pair are merged so each pair is worked on once.
+    if manifest_path:
+        with open(manifest_path) as manifest:
+            entries = json.load(manifest)
+    elif aws_volume_encryption_config.targets:
+        entries = aws_volume_encryption_config.targets
+    else:
+        entries = [{
+            "profile": profile,
+            "region": region,
+            "instance_ids": instance_ids,
+            "instance_names": instance_names,
+            "filters": filters or [],
+            "groups": groups or [],
+        }]
+
+    targets = []
+    for entry in entries:
+        for target_region in entry.get("regions", [entry.get("region", region)]):
+            target_profile = entry.get("profile", profile)
+            matching = [t for t in targets if t["profile"] == target_profile and t["region"] == target_region]
+
+            if matching:
+                target = matching[0]
+            else:
+                target = {"profile": target_profile, "region": target_region, "instance_ids": [],
+                          "instance_names": [], "filters": [], "groups": []}
+                targets.append(target)
+
+            # The same instance in several entries is only worked on once.
+            target["instance_ids"] += [i for i in entry.get("instance_ids", [])
+                                       if i not in target["instance_ids"]]
+            target["instance_names"] += [n for n in entry.get("instance_names", [])
+                                         if n not in target["instance_names"]]
+            target["filters"] += parse_filters(entry.get("filters", []))
+            target["groups"] += entry.get("groups", [])
+
+    return targets
+
+
+def run_target(target, args, client_pool, journal, metrics=None, progress=None, report=None):
+
+    print("\n****Working on profile {} in {}".format(target["profile"] or "default", target["region"]))
+    clients = client_pool.get(target["profile"], target["region"])
+
+    # Discover every target instance and volume up front with batched describe calls.
+    inventory = Inventory(_snapshot_lineage=args.reuse_snapshot_lineage).discover(
+        clients.ec2_client,
+        instance_ids=target["instance_ids"],
+        instance_names=target["instance_names"],
+    )
+
+    # Every instance of the region shares one batched status poller and one set of EC2 quota limits, since the
+    # EC2 limits are per region.
+    limits = ConcurrencyLimits(_max_snapshot_copies=args.max_snapshot_copies,
+                               _max_volume_creations=args.max_volume_creations,
+                               _max_instance_stops=args.max_instance_stops,
+                               _max_fast_snapshot_restores=args.max_fast_snapshot_restores)
+
+    if args.use_pool:
+        max_workers = args.max_workers
+    else:
+        max_workers = 1
+
+    poller = StatusPoller(clients.ec2_client, _min_interval=args.min_poll_interval,
+                          _max_interval=args.max_poll_interval, _progress=progress)
+
+    # Instance stops and starts of the region are sent in batches, and waited on with the poller's batched describe.
+    # The poller and the lifecycle batcher run threads of their own; stop them however the run ends.
+    lifecycle = None
+    try:
+        if args.lifecycle_batch_window > 0:
+            lifecycle = LifecycleCoordinator(clients.ec2_client, _batch_window=args.lifecycle_batch_window)
+
+        orchestrator = Orchestrator(_max_workers=max_workers, _poller=poller, _limits=limits, _journal=journal,
+                                    _clients=clients, _metrics=metrics, _forget_finished=bool(target["filters"]),
+                                    _lifecycle=lifecycle, _progress=progress, _report=report)
+
+        # Get master list to work off of, each instance once however it was named.
+        instance_ids, instance_names = unique_selection(inventory, target["instance_ids"], target["instance_names"])
+        master_list = instance_ids + instance_names
+
+        # Create worker objects with all the settings in place
+        worker_list = [make_worker(target, args, inventory, item) for item in master_list]
+
+        # Start the biggest instances first so none of them is left to run alone at the end.
+        estimator = JobEstimator(_seconds_per_gib=args.estimated_seconds_per_gib,
+                                 _overhead_seconds=args.estimated_overhead_seconds,
+                                 _copy_seconds_per_gib=args.estimated_copy_seconds_per_gib,
+                                 _max_volume_workers=args.max_volume_workers)
+        jobs = []
+        for worker in worker_list:
+            volumes = worker.queued_volumes() or []
+            jobs.append((worker, estimator.estimate([size for size, encryption_path in volumes],
+                                                    [encryption_path == "copy" for size, encryption_path in volumes])))
+        if args.schedule == "longest_first":
+            jobs = longest_first(jobs)
+        worker_list = [worker for worker, seconds in jobs]
+
+        durations = [seconds for worker, seconds in jobs]
+        if progress is not None:
+            progress.expect(sum([sum(worker.queued_volume_sizes() or []) for worker, seconds in jobs]))
+        print("****Expected run time for {} instances on {} workers: {} ({} at best)".format(
+            len(jobs), max_workers, format_duration(makespan(durations, max_workers)),
+            format_duration(lower_bound(durations, max_workers))))
+
+        if target["filters"]:
+            # Instances matching the filters are worked on as their describe pages come in, after the listed ones.
+            print("****Streaming the instances matching {}".format(
+                ", ".join(["{}={}".format(f["Name"], ",".join(f["Values"])) for f in target["filters"]])))
+            listed = set(instance_ids + [resolve_name(inventory, n) for n in instance_names])
+            streamed = (make_worker(target, args, inventory, instance_id)
+                        for instance_id in inventory.stream(clients.ec2_client, target["filters"],
+                                                            wanted=stream_filter(args))
+                        if instance_id not in listed)
+            worker_list = itertools.chain(worker_list, streamed)
+
+        results = []
+        if len(master_list) > 0 or target["filters"]:
+            results += orchestrator.run(worker_list)
+        if target["groups"]:
+            results += roll_groups(target, args, clients, orchestrator)
+        return results
+    finally:
+        poller.stop()
+        if lifecycle is not None:
+            lifecycle.stop()
+
+
+def roll_groups(target, args, clients, orchestrator):
+
+    # Each group is rolled a wave at a time, so no more than its max_unavailable members are down at once.  The
+    # groups themselves are independent and roll side by side, sharing the orchestrator's poller, limits, journal
+    # and worker slots, so all of them together stay within --max_workers.
+    def roll_group(group):
+
+        inventory = Inventory(_snapshot_lineage=args.reuse_snapshot_lineage)
+        roller = GroupRoller(_ec2_client=clients.ec2_client,
+                             _autoscaling_client=clients.autoscaling_client(),
+                             _inventory=inventory,
+                             _group=group,
+                             _max_unavailable=group.get("max_unavailable", args.max_unavailable),
+                             _healthy_timeout=args.group_healthy_timeout,
+                             _poll_interval=args.min_poll_interval,
+                             _elb_client=clients.elb_client(),
+                             _elbv2_client=clients.elbv2_client())
+        try:
+            # Members with nothing to encrypt are left alone rather than stopped for nothing.
+            members = roller.members()
+            workers = [make_worker(target, args, inventory, instance_id) for instance_id in members]
+            workers = [w for w in workers if w.queued_volume_sizes()]
+            by_id = dict([(w.instance_id, w) for w in workers])
+            results = roller.roll([w.instance_id for w in workers],
+                                  lambda wave: orchestrator.run([by_id[i] for i in wave], summary=False),
+                                  group_size=len(members))
+        except Exception as e:
+            roller.errors.append("{}".format(e))
+            results = []
+
+        if roller.errors:
+            result = InstanceResult(roller.name, target["region"])
+            result.status = "failed"
+            result.errors = roller.errors
+            results.append(result)
+            if orchestrator.report is not None:
+                orchestrator.report.write(result)
+        return results
+
+    group_executor = ThreadPoolExecutor(max_workers=len(target["groups"]))
+    try:
+        results = []
+        for future in [group_executor.submit(roll_group, group) for group in target["groups"]]:
+            results += future.result()
+    finally:
+        group_executor.shutdown(wait=True)
+
+    orchestrator.print_summary(results)
+    return results
+
+
+def resolve_name(inventory, instance_name):
+
+    # The id of the one discovered instance with the name, None when there's none or it's ambiguous.
+    instance_ids = inventory.names.get(instance_name, [])
+    if len(instance_ids) == 1:
+        return instance_ids[0]
+    return None
+
+
+def unique_selection(inventory, instance_ids, instance_names):
+
+    # Instance ids and names with every instance in them once: repeated ids go, and so do names of instances
+    # that are already listed by id.  Names that don't resolve are kept, for their workers to report.
+    unique_ids = []
+    for instance_id in instance_ids:
+        if instance_id not in unique_ids:
+            unique_ids.append(instance_id)
+
+    unique_names = []
+    resolved = set(unique_ids)
+    for instance_name in instance_names:
+        instance_id = resolve_name(inventory, instance_name)
+        if instance_name in unique_names or instance_id in resolved:
+            continue
+        unique_names.append(instance_name)
+        if instance_id is not None:
+            resolved.add(instance_id)
+
+    return unique_ids, unique_names
+
+
+def stream_filter(args):
+
+    # --unencrypted_only streams the instances with a volume the encrypter would work on, chosen the way it chooses
+    # them: the root volume (every volume with --encrypt_all), when it's unencrypted or has to move to another key.
+    if not args.unencrypted_only:
+        return None
+
+    def wanted(instance, volumes):
+
+        for device_name, volume in volumes:
+            if device_name != instance.get("RootDeviceName") and not args.encrypt_all:
+                continue
+            if volume_needs_encryption(volume["Encrypted"], volume.get("KmsKeyId"), args.encryption_key_arn,
+                                       args.ignore_encrypted):
+                return True
+        return False
+
+    return wanted
+
+
+def make_worker(target, args, inventory, instance_unknown):
+
+    return Worker(_profile=target["profile"],
+                  _region=target["region"],
+                  _encrypt_all=args.encrypt_all,
+                  _ignore_encrypted=args.ignore_encrypted,
+                  _generate_report=args.generate_report,
+                  _force_volume_type=args.force_volume_type,
+                  _encryption_key_arn=args.encryption_key_arn,
+                  _keep_snapshots=args.keep_snapshots,
+                  _instance_unknown=instance_unknown,
+                  _gp2_to_gp3=args.gp2_to_gp3,
+                  _max_volume_workers=args.max_volume_workers,
+                  _hot_snapshot=args.hot_snapshot,
+                  _copy_snapshot=args.copy_snapshot,
+                  _snapshot_lineage_max_age_hours=args.snapshot_lineage_max_age_hours,
+                  _prewarm=args.prewarm,
+                  _volume_initialization_rate=args.volume_initialization_rate,
+                  _wait_for_initialization=args.wait_for_initialization,
+                  _run_id=args.run_id,
+                  _inventory=inventory,
+                  _resume=args.resume)
+
+
+def plan_targets(targets, args, client_pool):
+
+    # Throughput of earlier runs, from their metrics files, merged phase by phase.
+    history = {}
+    for path in args.plan_history:
+        if os.path.exists(path):
+            for phase, totals in phase_history(path).items():
+                merged = history.setdefault(phase, {"count": 0, "seconds": 0.0, "gib": 0})
+                for key in merged:
+                    merged[key] += totals[key]
+
+    rates = ThroughputRates(_seconds_per_gib=args.estimated_seconds_per_gib,
+                            _copy_seconds_per_gib=args.estimated_copy_seconds_per_gib,
+                            _history=history)
+
+    if args.use_pool:
+        max_workers = args.max_workers
+    else:
+        max_workers = 1
+
+    target_plans = []
+    for target in targets:
+        clients = client_pool.get(target["profile"], target["region"])
+
+        # The same batched discovery a run starts with, and nothing else.
+        inventory = Inventory(_snapshot_lineage=args.reuse_snapshot_lineage).discover(
+            clients.ec2_client,
+            instance_ids=target["instance_ids"],
+            instance_names=target["instance_names"],
+        )
+
+        planner = Planner(_inventory=inventory,
+                          _rates=rates,
+                          _encrypt_all=args.encrypt_all,
+                          _ignore_encrypted=args.ignore_encrypted,
+                          _encryption_key_arn=args.encryption_key_arn,
+                          _force_volume_type=args.force_volume_type,
+                          _gp2_to_gp3=args.gp2_to_gp3,
+                          _keep_snapshots=args.keep_snapshots,
+                          _max_volume_workers=args.max_volume_workers,
+                          _hot_snapshot=args.hot_snapshot,
+                          _copy_snapshot=args.copy_snapshot,
+                          _snapshot_lineage_max_age_hours=args.snapshot_lineage_max_age_hours,
+                          _prewarm=args.prewarm,
+                          _volume_initialization_rate=args.volume_initialization_rate)
+
+        # The plan needs the whole selection, so filters are listed out here rather than streamed.
+        instance_ids = list(target["instance_ids"])
+        for instance_id in inventory.stream(clients.ec2_client, target["filters"],
+                                            wanted=stream_filter(args)) if target["filters"] else []:
+            if instance_id not in instance_ids:
+                instance_ids.append(instance_id)
+
+        # Group members are planned like any other instance; their waves only change the order.
+        for group in target["groups"]:
+            roller = GroupRoller(_ec2_client=clients.ec2_client, _autoscaling_client=clients.autoscaling_client(),
+                                 _inventory=inventory, _group=group)
+            instance_ids += [i for i in roller.members() if i not in instance_ids]
+
+        # A named instance that's also listed by id, or matched by the filters or a group, is planned once.
+        instance_ids, instance_names = unique_selection(inventory, instance_ids, target["instance_names"])
+        target_plans.append(planner.plan_target(target["profile"], target["region"], instance_ids,
+                                                instance_names, max_workers))
+
+    # The targets run side by side, so the run takes as long as the longest of them.
+    run_seconds = max([p["ExpectedRunSeconds"] for p in target_plans] or [0])
+    snapshot_gib = sum([p["SnapshotGiB"] for p in target_plans])
+    copy_gib = sum([v["SizeGiB"] for p in target_plans for i in p["Instances"] for v in i["Volumes"]
+                    if v["EncryptionPath"] == "copy"])
+
+    return {
+        "Rates": rates.to_dict(),
+        "Targets": target_plans,
+        "SnapshotGiB": snapshot_gib,
+        "CopyGiB": copy_gib,
+        "ExpectedRunSeconds": run_seconds,
+        "ExpectedDowntimeSeconds": sum([i["ExpectedDowntimeSeconds"] for p in target_plans
+                                        for i in p["Instances"]]),
+        "EstimatedSnapshotCost": snapshot_cost(snapshot_gib, run_seconds, args.snapshot_price_per_gib_month,
+                                               copy_gib=copy_gib, keep_snapshots=args.keep_snapshots),
+    }
+
+
+def sweep_targets(targets, args, client_pool):
+
+    # Resources an unfinished journal entry still needs are kept, so --resume can still finish them.
+    protected_ids = []
+    if os.path.exists(args.journal_path):
+        journal = StateJournal(args.journal_path)
+        protected_ids = journal.resource_ids(journal.unfinished())
+        journal.close()
+
+    def sweep_target(target):
+
+        clients = client_pool.get(target["profile"], target["region"])
+        sweeper = Sweeper(clients.ec2_client, _run_ids=args.sweep_run_ids, _min_age_hours=args.sweep_min_age_hours,
+                          _protected_ids=protected_ids, _max_workers=args.max_workers)
+        leftovers = sweeper.find()
+
+        print("\n****{} leftovers ({} GiB) in {} with profile {}, found with {} API calls".format(
+            len(leftovers), sum([l["SizeGiB"] for l in leftovers]), target["region"], target["profile"] or "default",
+            sweeper.api_calls))
+        for leftover in leftovers:
+            print("---{} {} {} ({} GiB, {}) of run {} for {}".format(
+                "Would delete" if args.dry_run else "Deleting", leftover["Type"], leftover["Id"],
+                leftover["SizeGiB"], leftover["State"], leftover["RunId"], leftover["InstanceId"]))
+
+        if args.dry_run or not leftovers:
+            return {"leftovers": len(leftovers), "deleted": [], "in_use": [], "failed": []}
+
+        results = sweeper.delete(leftovers)
+        results["leftovers"] = len(leftovers)
+        return results
+
+    # The regions are swept side by side, like they're encrypted.
+    region_executor = ThreadPoolExecutor(max_workers=max(1, len(targets)))
+    try:
+        all_results = [future.result() for future in
+                       [region_executor.submit(sweep_target, target) for target in targets]]
+    finally:
+        region_executor.shutdown(wait=True)
+
+    print("\n****Sweep summary: {} leftovers".format(sum([r["leftovers"] for r in all_results])))
+    for outcome in ["deleted", "in_use", "failed"]:
+        ids = [i for r in all_results for i in r[outcome]]
+        if ids:
+            print("---{}: {}".format(outcome, len(ids)))
+    return all_results
+
+
+def boolean(value):
+
+    # argparse type of the True/False options.  Without it argparse compares the string "True" with the bool True
+    # and rejects every value.
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ["true", "yes", "1"]:
+        return True
+    if value.lower() in ["false", "no", "0"]:
+        return False
+    raise argparse.ArgumentTypeError("{} is not True or False".format(value))
+
+
+def initialization_rate(value):
+
+    # argparse type of --volume_initialization_rate: EBS only accepts 100 to 300 MiB/s.
+    rate = int(value)
+    if not MIN_INITIALIZATION_RATE <= rate <= MAX_INITIALIZATION_RATE:
+        raise argparse.ArgumentTypeError("{} is not between {} and {} MiB/s".format(
+            value, MIN_INITIALIZATION_RATE, MAX_INITIALIZATION_RATE))
+    return rate
+
+
+def rate_limits(args):
+
+    return {
+        "describe": (args.describe_rate_limit, aws_volume_encryption_config.describe_burst),
+        "mutate": (args.mutate_rate_limit, aws_volume_encryption_config.mutate_burst),
+    }
+
+
+def build_parser():
 
     parser = argparse.ArgumentParser(description='aws_volume_encryption')
+    parser.add_argument('command', nargs='?', choices=["encrypt", "sweep"], default="encrypt",
+                        help="encrypt (the default) runs the encryption.  sweep deletes the snapshots and volumes"
+                             " failed runs left behind.")
+
     parser.add_argument('--profile',
                         default=aws_volume_encryption_config.aws_profile,
                         help="The aws profile you want to use.")
@@ -456,20 +2083,20 @@ if __name__ == "__main__":
                         default=aws_volume_encryption_config.aws_region,
                         help="The aws region you want to work in.")
 
-    parser.add_argument('--encrypt_all', choices=[True, False],
+    parser.add_argument('--encrypt_all', type=boolean, choices=[True, False],
                         default=aws_volume_encryption_config.encrypt_all,
                         help="True to encrypt all the disks on the instance.  False will encrypt just the root disk.")
 
-    parser.add_argument('--ignore_encrypted', choices=[True, False],
+    parser.add_argument('--ignore_encrypted', type=boolean, choices=[True, False],
                         default=aws_volume_encryption_config.ignore_encrypted,
                         help="True will ignore disks that are already encrypted.  False will re-encrypt them.")
 
-    parser.add_argument('--keep_snapshots', choices=[True, False],
+    parser.add_argument('--keep_snapshots', type=boolean, choices=[True, False],
                         default=aws_volume_encryption_config.keep_snapshots,
                         help="True will keep the snapshots after the new disks are created (you will need to clean them"
                              " up).  False will delete them.")
 
-    parser.add_argument('--generate_report', choices=[True, False],
+    parser.add_argument('--generate_report', type=boolean, choices=[True, False],
                         default=aws_volume_encryption_config.generate_report,
                         help="True will generate a report at the end.")
 
@@ -479,7 +2106,13 @@ if __name__ == "__main__":
 
     parser.add_argument('--force_volume_type',
                         default=aws_volume_encryption_config.force_volume_type,
-                        help="If you put a disk type here, all disks will be created with this type.  Default is GP2.")
+                        help="If you put a disk type here, all disks will be created with this type.  Default is the"
+                             " type of the original disk.")
+
+    parser.add_argument('--gp2_to_gp3', type=boolean, choices=[True, False],
+                        default=aws_volume_encryption_config.gp2_to_gp3,
+                        help="True will create gp2 disks as gp3, with IOPS and throughput at least as high as the gp2"
+                             " disk's burst baseline.")
 
     parser.add_argument('--instance_ids_list', nargs='*',
                         default=aws_volume_encryption_config.instance_ids,
@@ -489,72 +2122,285 @@ if __name__ == "__main__":
                         default=aws_volume_encryption_config.instance_names,
                         help="Instance Names that you want to encrypt.")
 
+    parser.add_argument('--filters', nargs='*',
+                        default=aws_volume_encryption_config.instance_filters,
+                        help="EC2 filters that select instances, like tag:Environment=prod or"
+                             " availability-zone=us-east-1a,us-east-1b.  Matches are streamed into the run.")
+
+    parser.add_argument('--unencrypted_only', action='store_true',
+                        default=aws_volume_encryption_config.unencrypted_only,
+                        help="Only select instances by --filters that have at least one volume to encrypt or re-key.")
+
+    parser.add_argument('--asg_names', nargs='*',
+                        default=aws_volume_encryption_config.asg_names,
+                        help="Auto Scaling groups to encrypt the members of, a wave of --max_unavailable at a time.")
+
+    parser.add_argument('--group_tags', nargs='*',
+                        default=aws_volume_encryption_config.group_tags,
+                        help="Instance groups to encrypt a wave at a time, each one tag filter like tag:Service=api.")
+
+    parser.add_argument('--max_unavailable',
+                        default=aws_volume_encryption_config.max_unavailable,
+                        help="How many members of a group may be down at once, as a count (2) or a percentage (25%%).")
+
+    parser.add_argument('--group_healthy_timeout', type=float,
+                        default=aws_volume_encryption_config.group_healthy_timeout,
+                        help="Seconds a wave may take to report healthy again before the roll of its group stops.")
+
+    parser.add_argument('--max_volume_workers', type=int,
+                        default=aws_volume_encryption_config.max_volume_workers,
+                        help="How many volumes of one instance to snapshot, copy and create in parallel.  Default is 1"
+                             " (one volume at a time).")
+
+    parser.add_argument('--hot_snapshot', type=boolean, choices=[True, False],
+                        default=aws_volume_encryption_config.hot_snapshot,
+                        help="True will snapshot the volumes while the instance is still running and only take an"
+                             " incremental snapshot after the stop.  False snapshots only after the stop.")
+
+    parser.add_argument('--copy_snapshot', type=boolean, choices=[True, False],
+                        default=aws_volume_encryption_config.copy_snapshot,
+                        help="True will always make an encrypted copy of the snapshot before creating the volume."
+                             "  False creates the encrypted volume straight from the snapshot when possible.")
+
+    parser.add_argument('--reuse_snapshot_lineage', type=boolean, choices=[True, False],
+                        default=aws_volume_encryption_config.reuse_snapshot_lineage,
+                        help="True will look up the newest snapshot of every volume, wait for it if it's still being"
+                             " taken and report what the new snapshot saved by being incremental to it.")
+
+    parser.add_argument('--snapshot_lineage_max_age_hours', type=float,
+                        default=aws_volume_encryption_config.snapshot_lineage_max_age_hours,
+                        help="Only volume snapshots newer than this are continued from.")
+
+    parser.add_argument('--prewarm', choices=PREWARM_MODES,
+                        default=aws_volume_encryption_config.prewarm,
+                        help="fsr enables fast snapshot restore on the encrypted snapshot and waits for it before"
+                             " creating the volume.  initialization_rate creates the volume with a provisioned"
+                             " initialization rate and reports its progress.  none lets the blocks load on first"
+                             " read.")
+
+    parser.add_argument('--volume_initialization_rate', type=initialization_rate,
+                        default=aws_volume_encryption_config.volume_initialization_rate,
+                        help="MiB/s the volumes are initialized at with --prewarm initialization_rate (100 to 300).")
+
+    parser.add_argument('--wait_for_initialization', type=boolean, choices=[True, False],
+                        default=aws_volume_encryption_config.wait_for_initialization,
+                        help="True will wait after the start until the volumes created with an initialization rate"
+                             " are fully initialized, reporting their progress.")
+
+    parser.add_argument('--journal_path',
+                        default=aws_volume_encryption_config.journal_path,
+                        help="SQLite file that records every phase of every volume.")
+
+    parser.add_argument('--resume', action='store_true',
+                        help="Will pick every volume up after the last phase recorded in the journal.")
+
+    parser.add_argument('--manifest',
+                        help="JSON file with a list of targets to run in one go, each with a profile, a region (or a list"
+                             " of regions), instance_ids and instance_names.")
+
+    parser.add_argument('--metrics_jsonl',
+                        default=aws_volume_encryption_config.metrics_jsonl_path,
+                        help="File to append one JSON line per timed phase to.")
+
+    parser.add_argument('--metrics_prometheus',
+                        default=aws_volume_encryption_config.metrics_prometheus_path,
+                        help="Prometheus textfile to write the phase duration histograms to.")
+
+    parser.add_argument('--min_poll_interval', type=float,
+                        default=aws_volume_encryption_config.min_poll_interval,
+                        help="Seconds between status polls while snapshots, volumes and instances are changing.")
+
+    parser.add_argument('--max_poll_interval', type=float,
+                        default=aws_volume_encryption_config.max_poll_interval,
+                        help="Longest the status poller backs off to while nothing changes.")
+
+    parser.add_argument('--report_path',
+                        default=aws_volume_encryption_config.report_path,
+                        help="File to write the run report to as instances finish: old and new volume ids, device,"
+                             " KMS key, type, phase timings and errors.  CSV for a .csv path, JSON otherwise.")
+
+    parser.add_argument('--report_format', choices=REPORT_FORMATS,
+                        help="Report format, when the extension of --report_path doesn't say.")
+
+    parser.add_argument('--progress', choices=PROGRESS_MODES,
+                        default=aws_volume_encryption_config.progress,
+                        help="live redraws one view of every snapshot, copy and volume in flight with its ETA."
+                             "  events writes them as a JSON line every --progress_interval seconds.  auto picks"
+                             " live on a terminal.")
+
+    parser.add_argument('--progress_interval', type=float,
+                        default=aws_volume_encryption_config.progress_interval,
+                        help="Seconds between progress events.")
+
+    parser.add_argument('--progress_stall_seconds', type=float,
+                        default=aws_volume_encryption_config.progress_stall_seconds,
+                        help="Warn about a snapshot or volume that hasn't moved in this many seconds.")
+
+    parser.add_argument('--lifecycle_batch_window', type=float,
+                        default=aws_volume_encryption_config.lifecycle_batch_window,
+                        help="Seconds instance stops and starts are gathered for before one batched call is sent for"
+                             " all of them.  0 stops and starts every instance on its own.")
+
     parser.add_argument('--use_pool', action='store_true',
-                        help="Will attempt to run multiple jobs in parallel.")
-
-    args = parser.parse_args()
-
-    if not args.use_pool:
-
-        if args.instance_ids_list:
-            for instance_id in args.instance_ids_list:
-                ve = InstanceVolumeEncrypter(_profile=args.profile,
-                                             _region=args.region,
-                                             _encrypt_all=args.encrypt_all,
-                                             _ignore_encrypted=args.ignore_encrypted,
-                                             _generate_report=args.generate_report,
-                                             _force_volume_type=args.force_volume_type,
-                                             _instance_id=instance_id,
-                                             _encryption_key_arn=args.encryption_key_arn,
-                                             _keep_snapshots=args.keep_snapshots,
-                                             _instance_name=None)
-                print(ve.encrypt_instance_volumes())
-
-        if args.instance_names_list:
-            for instance_name in args.instance_names_list:
-                ve = InstanceVolumeEncrypter(_profile=args.profile,
-                                             _region=args.region,
-                                             _encrypt_all=args.encrypt_all,
-                                             _ignore_encrypted=args.ignore_encrypted,
-                                             _generate_report=args.generate_report,
-                                             _force_volume_type=args.force_volume_type,
-                                             _encryption_key_arn=args.encryption_key_arn,
-                                             _keep_snapshots=args.keep_snapshots,
-                                             _instance_id=None,
-                                             _instance_name=instance_name)
-                print(ve.encrypt_instance_volumes())
+                        help="Will run multiple instances in parallel on threads (up to --max_workers at once).")
 
-    else:
+    parser.add_argument('--max_workers', type=int,
+                        default=aws_volume_encryption_config.max_workers,
+                        help="How many instances to run at once with --use_pool.")
 
-        # Get master list to work off of.
-        master_list = args.instance_ids_list + args.instance_names_list
-        worker_list = []
-
-        # Make sure there are names in the list and run a process for each.
-        if len(master_list) > 0:
-
-            # Create worker objects with all the settings in place
-            for item in master_list:
-                worker_list.append(Worker(_profile=args.profile,
-                                          _region=args.region,
-                                          _encrypt_all=args.encrypt_all,
-                                          _ignore_encrypted=args.ignore_encrypted,
-                                          _generate_report=args.generate_report,
-                                          _force_volume_type=args.force_volume_type,
-                                          _encryption_key_arn=args.encryption_key_arn,
-                                          _keep_snapshots=args.keep_snapshots,
-                                          _instance_unknown=item
-                                          ))
-
-            # Setting the max pool size to 5 (you can only do 5 snaps at a time)
-            if len(master_list) > 5:
-                max_pool_size = 5
-            else:
-                max_pool_size = len(master_list)
+    parser.add_argument('--max_snapshot_copies', type=int,
+                        default=aws_volume_encryption_config.max_snapshot_copies,
+                        help="How many encrypted snapshot copies may be in flight at once.")
+
+    parser.add_argument('--max_volume_creations', type=int,
+                        default=aws_volume_encryption_config.max_volume_creations,
+                        help="How many volume creations may be in flight at once.")
+
+    parser.add_argument('--max_instance_stops', type=int,
+                        default=aws_volume_encryption_config.max_instance_stops,
+                        help="How many instance stops may be in flight at once.")
+
+    parser.add_argument('--max_fast_snapshot_restores', type=int,
+                        default=aws_volume_encryption_config.max_fast_snapshot_restores,
+                        help="How many snapshots may have fast snapshot restore on at once.")
+
+    parser.add_argument('--schedule', choices=["longest_first", "given"],
+                        default=aws_volume_encryption_config.schedule,
+                        help="longest_first starts the instances with the most data to encrypt first.  given keeps"
+                             " the order of the lists.")
+
+    parser.add_argument('--estimated_seconds_per_gib', type=float,
+                        default=aws_volume_encryption_config.estimated_seconds_per_gib,
+                        help="Seconds a snapshot and volume creation take per GiB, for the run time estimate.")
+
+    parser.add_argument('--estimated_copy_seconds_per_gib', type=float,
+                        default=aws_volume_encryption_config.estimated_copy_seconds_per_gib,
+                        help="Extra seconds per GiB on the snapshot copy path, for the run time estimate.")
+
+    parser.add_argument('--estimated_overhead_seconds', type=float,
+                        default=aws_volume_encryption_config.estimated_overhead_seconds,
+                        help="Seconds each instance takes whatever its size (stop, swap, start).")
+
+    parser.add_argument('--describe_rate_limit', type=float,
+                        default=aws_volume_encryption_config.describe_rate_limit,
+                        help="Describe calls per second for the whole run, per profile and region.  0 for no limit.")
+
+    parser.add_argument('--mutate_rate_limit', type=float,
+                        default=aws_volume_encryption_config.mutate_rate_limit,
+                        help="Mutating calls per second for the whole run, per profile and region.  0 for no limit.")
+
+    parser.add_argument('--api_max_attempts', type=int,
+                        default=aws_volume_encryption_config.api_max_attempts,
+                        help="Attempts botocore makes at each throttled call.")
 
-            # Instantiate the tool
-            p = Pool(max_pool_size)
-            p.map(run, worker_list)
+    parser.add_argument('--run_id', default=new_run_id(),
+                        help="Tag value every snapshot and volume of this run carries until it's meant to stay.")
 
+    parser.add_argument('--sweep_run_ids', nargs='*',
+                        default=[],
+                        help="Only sweep what these runs left behind.  Default is every run.")
+
+    parser.add_argument('--sweep_min_age_hours', type=float,
+                        default=aws_volume_encryption_config.sweep_min_age_hours,
+                        help="Leave resources younger than this alone when sweeping, they may belong to a run that's"
+                             " still going.")
+
+    parser.add_argument('--dry_run', action='store_true',
+                        help="With sweep, only list what would be deleted.")
+
+    parser.add_argument('--plan', action='store_true',
+                        help="Print what a run would do as JSON, with its expected downtime and run time, without"
+                             " touching anything.")
+
+    parser.add_argument('--plan_output',
+                        help="File to write the --plan JSON to instead of printing it.")
+
+    parser.add_argument('--plan_history', nargs='*',
+                        default=aws_volume_encryption_config.plan_history,
+                        help="--metrics_jsonl files of earlier runs to take the snapshot throughput from.")
+
+    parser.add_argument('--snapshot_price_per_gib_month', type=float,
+                        default=aws_volume_encryption_config.snapshot_price_per_gib_month,
+                        help="Snapshot storage price, for the cost estimate of the plan.")
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = build_parser().parse_args()
+
+    # Every client of the run shares the API rate limits of its profile and region.
+    SHARED_POOL.configure(rate_limits=rate_limits(args), max_attempts=args.api_max_attempts)
+
+    groups = [{"asg": name} for name in args.asg_names] + [{"tags": [tags]} for tags in args.group_tags]
+    all_targets = load_targets(args.manifest, args.profile, args.region, args.instance_ids_list,
+                               args.instance_names_list, args.filters, groups)
+    targets = [t for t in all_targets if len(t["instance_ids"]) + len(t["instance_names"]) + len(t["filters"]) +
+               len(t["groups"]) > 0]
+
+    # A sweep covers every profile and region of the targets, whatever instances they list.
+    if args.command == "sweep":
+        sweep_targets(all_targets, args, SHARED_POOL)
+
+    # Make sure there are names in the list and run a job for each.
+    elif len(targets) > 0 and args.plan:
+
+        # Progress goes to stderr so stdout only holds the plan.
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            plan = plan_targets(targets, args, SHARED_POOL)
+        finally:
+            sys.stdout = stdout
+
+        if args.plan_output:
+            with open(args.plan_output, "w") as plan_file:
+                json.dump(plan, plan_file, indent=2, sort_keys=True)
+            print("****Plan written to {}".format(args.plan_output))
         else:
-            print("---Missing list of instance names in config")
+            print(json.dumps(plan, indent=2, sort_keys=True))
+
+    elif len(targets) > 0:
+
+        print("****Run {}.  What a failure leaves behind can be deleted with: sweep --sweep_run_ids {}".format(
+            args.run_id, args.run_id))
+
+        # One session and client set per (profile, region), one journal for the whole run.
+        client_pool = SHARED_POOL
+        journal = StateJournal(args.journal_path)
+
+        # Phase timings for the whole run, as JSON lines and as a Prometheus textfile when asked for.
+        metrics = PhaseMetrics(_jsonl_path=args.metrics_jsonl, _prometheus_path=args.metrics_prometheus)
+
+        # One live view (or stream of progress events) for every region of the run.
+        progress = ProgressTracker(_mode=args.progress, _interval=args.progress_interval,
+                                   _stall_seconds=args.progress_stall_seconds)
+        progress.start()
+
+        # One JSON or CSV report of every instance and volume, written as they finish.
+        report = None
+        if args.report_path:
+            report = ReportWriter(args.report_path, _format=args.report_format)
+
+        # The regions run side by side since the EC2 limits are per region.
+        region_executor = ThreadPoolExecutor(max_workers=len(targets))
+        try:
+            region_futures = [region_executor.submit(run_target, target, args, client_pool, journal, metrics,
+                                                     progress, report)
+                              for target in targets]
+            all_results = []
+            for region_future in region_futures:
+                all_results += region_future.result()
+        finally:
+            region_executor.shutdown(wait=True)
+            progress.close()
+            metrics.close()
+            if report is not None:
+                report.close()
+
+        if len(targets) > 1:
+            Orchestrator.print_summary(all_results)
+
+    else:
+        print("---Missing list of instance names in config")
@@ -0,0 +1,274 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Offline benchmark that runs the full encrypter against the simulated EC2 backend in aws_volume_encryption_fake_ec2.
+Params:
+    Fleet sizes, volumes per instance, the fake's latencies, snapshot throughput, throttling and failure rates, plus
+    the usual encryption options (--use_pool, --max_workers, --hot_snapshot, ...).
+Conditions:
+    Reports end-to-end throughput (instances per hour), API call counts and total instance downtime per fleet size,
+    all in simulated time.  No AWS account or network access is needed.  The startup and per-instance cost of the
+    boto3 sessions, clients and waiters is measured with the real boto3, which builds them without any network calls.
+"""
+
+import json
+import sys
+import time
+import boto3
+import aws_volume_encryption
+from aws_volume_encryption_clients import ClientPool, ClientSet
+from aws_volume_encryption_fake_ec2 import FakeEC2Backend, FakeSession
+from aws_volume_encryption_journal import StateJournal
+from aws_volume_encryption_metrics import PhaseMetrics
+from aws_volume_encryption_ratelimit import RateLimiter
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+WAITER_NAMES = ["instance_exists", "instance_stopped", "instance_running", "snapshot_completed", "volume_available",
+                "volume_in_use"]
+
+
+class NullOutput:
+
+    # Swallows the encrypter's progress prints while a fleet runs.
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def build_backend(args, fleet_size):
+
+    backend = FakeEC2Backend(
+        _region=args.region,
+        _speedup=args.speedup,
+        _latencies={"describe": args.describe_latency, "mutate": args.mutate_latency},
+        _snapshot_seconds_per_gib=args.snapshot_seconds_per_gib,
+        _copy_seconds_per_gib=args.copy_seconds_per_gib,
+        _change_rate_gib_per_hour=args.change_rate_gib_per_hour,
+        _throttle_rate=args.throttle_rate,
+        _failure_rate=args.failure_rate,
+        _api_rates={"describe": (args.ec2_describe_rate, args.ec2_describe_burst),
+                    "mutate": (args.ec2_mutate_rate, args.ec2_mutate_burst)} if args.ec2_api_limits else None,
+        _seed=args.seed,
+    )
+
+    # Cycle through the volume layouts so mixed fleets are easy to describe.
+    layouts = [[int(size) for size in layout.split(",")] for layout in args.volume_layouts]
+    instance_ids = []
+    for index in range(fleet_size):
+        instance_ids.append(backend.add_instance("bench-{}".format(index), layouts[index % len(layouts)],
+                                                 volume_type=args.volume_type,
+                                                 backup_age_hours=args.backup_age_hours))
+
+    return backend, instance_ids
+
+
+def run_fleet(args, fleet_size):
+
+    backend, instance_ids = build_backend(args, fleet_size)
+
+    # Seed the pool with a client set on the fake, so the encrypter runs unchanged against it.
+    # The rate limiter keeps the simulated time too, so its rates and recovery compare with the fake's limits.
+    client_pool = ClientPool()
+    rate_limiter = RateLimiter(aws_volume_encryption.rate_limits(args), _clock=backend.now, _sleep=backend.sleep)
+    client_set = ClientSet(args.profile, args.region, _session=FakeSession(backend), _rate_limiter=rate_limiter,
+                           _max_attempts=args.api_max_attempts)
+    client_pool.client_sets[(args.profile, args.region)] = client_set
+
+    target = {"profile": args.profile, "region": args.region, "instance_ids": instance_ids, "instance_names": [],
+              "filters": [], "groups": []}
+    metrics = PhaseMetrics()
+    journal = StateJournal(":memory:")
+
+    started_at = time.time()
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = NullOutput()
+    try:
+        results = aws_volume_encryption.run_target(target, args, client_pool, journal, metrics)
+    finally:
+        sys.stdout = stdout
+    wall_seconds = time.time() - started_at
+
+    simulated_seconds = wall_seconds * args.speedup
+    statuses = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+
+    return {
+        "fleet_size": fleet_size,
+        "volumes": sum([len([v for v in r.volumes if v["Status"] == "encrypted"]) for r in results]),
+        "statuses": statuses,
+        "wall_seconds": round(wall_seconds, 3),
+        "simulated_seconds": round(simulated_seconds, 1),
+        "instances_per_hour": round(fleet_size * 3600.0 / simulated_seconds, 1) if simulated_seconds else None,
+        "api_calls": backend.total_api_calls(),
+        "api_calls_per_instance": round(backend.total_api_calls() / float(fleet_size), 1),
+        "api_calls_by_operation": dict(sorted(backend.api_calls.items())),
+        "throttled_calls": backend.throttled_calls,
+        "rate_limiter": client_set.rate_limiter.stats(),
+        "total_downtime_seconds": round(backend.total_downtime(), 1),
+        "mean_downtime_seconds": round(backend.total_downtime() / float(fleet_size), 1),
+    }
+
+
+def measure(build, samples):
+
+    # Mean seconds and, where tracemalloc is available, mean bytes still allocated per call of build.
+    kept = []
+    if tracemalloc is not None:
+        tracemalloc.start()
+    started_at = time.time()
+    for sample in range(samples):
+        kept.append(build())
+    seconds = (time.time() - started_at) / samples
+    allocated = None
+    if tracemalloc is not None:
+        allocated = tracemalloc.get_traced_memory()[0] // samples
+        tracemalloc.stop()
+    return seconds, allocated
+
+
+def measure_client_overhead(args):
+
+    # What every instance used to pay (its own session, client, resource and six waiters) against what it pays with
+    # the shared client set (a thread's resource once, waiters once per run), plus the one-off startup.
+    region = args.region
+
+    def per_instance_session():
+        session = boto3.session.Session(region_name=region)
+        client = session.client("ec2")
+        return session, client, session.resource("ec2"), [client.get_waiter(n) for n in WAITER_NAMES]
+
+    startup_seconds, startup_bytes = measure(lambda: ClientSet(None, region), 1)
+    client_set = ClientSet(None, region)
+
+    def per_instance_shared():
+        return client_set.ec2_resource(), [client_set.waiter(n) for n in WAITER_NAMES]
+
+    # The resource of this thread is built once per worker thread, not per instance.
+    per_instance_shared()
+
+    old_seconds, old_bytes = measure(per_instance_session, args.client_overhead_samples)
+    shared_seconds, shared_bytes = measure(per_instance_shared, args.client_overhead_samples)
+
+    return {
+        "startup_ms": round(startup_seconds * 1000, 2),
+        "startup_bytes": startup_bytes,
+        "per_instance_session_ms": round(old_seconds * 1000, 2),
+        "per_instance_session_bytes": old_bytes,
+        "per_instance_shared_ms": round(shared_seconds * 1000, 4),
+        "per_instance_shared_bytes": shared_bytes,
+    }
+
+
+def print_client_overhead(overhead):
+
+    print("\n****Client construction")
+    print("---Startup (one client set): {} ms, {} bytes".format(overhead["startup_ms"], overhead["startup_bytes"]))
+    print("---Per instance with its own session, client, resource and waiters: {} ms, {} bytes".format(
+        overhead["per_instance_session_ms"], overhead["per_instance_session_bytes"]))
+    print("---Per instance with the shared client set: {} ms, {} bytes".format(
+        overhead["per_instance_shared_ms"], overhead["per_instance_shared_bytes"]))
+
+
+def print_report(report):
+
+    print("\n****Fleet of {} instances ({} volumes encrypted)".format(report["fleet_size"], report["volumes"]))
+    print("---Statuses: {}".format(", ".join(["{} {}".format(v, k) for k, v in sorted(report["statuses"].items())])))
+    print("---Simulated run time: {:.0f} s ({:.1f} s wall clock)".format(report["simulated_seconds"],
+                                                                       report["wall_seconds"]))
+    print("---Throughput: {} instances per hour".format(report["instances_per_hour"]))
+    print("---API calls: {} ({} per instance, {} throttled)".format(report["api_calls"],
+                                                                   report["api_calls_per_instance"],
+                                                                   report["throttled_calls"]))
+    for operation, count in report["api_calls_by_operation"].items():
+        print("------{}: {}".format(operation, count))
+    for category, stats in sorted(report["rate_limiter"].items()):
+        print("---Rate limiter {}: {} throttles, ended at {} calls per second".format(
+            category, stats["throttles"], stats["rate"]))
+    print("---Instance downtime: {:.0f} s total, {:.0f} s mean".format(report["total_downtime_seconds"],
+                                                                       report["mean_downtime_seconds"]))
+
+
+def build_parser():
+
+    # Start from the encrypter's own options so every mode can be benchmarked, then add the fake's knobs.
+    parser = aws_volume_encryption.build_parser()
+    parser.description = "aws_volume_encryption benchmark against a simulated EC2"
+
+    parser.add_argument('--fleet_sizes', type=int, nargs='*', default=[10, 100, 1000],
+                        help="Fleet sizes to run, one after the other.")
+    parser.add_argument('--volume_layouts', nargs='*', default=["8,100", "30,500,500", "8"],
+                        help="Comma separated volume sizes in GiB, root first.  Instances cycle through the layouts.")
+    parser.add_argument('--volume_type', default="gp2",
+                        help="Volume type of the simulated volumes.")
+    parser.add_argument('--backup_age_hours', type=float,
+                        help="Give every simulated volume a backup snapshot taken this many hours ago.")
+    parser.add_argument('--speedup', type=float, default=1000.0,
+                        help="Simulated seconds per wall clock second.")
+    parser.add_argument('--describe_latency', type=float, default=0.3,
+                        help="Simulated seconds per describe call.")
+    parser.add_argument('--mutate_latency', type=float, default=0.5,
+                        help="Simulated seconds per mutating call.")
+    parser.add_argument('--snapshot_seconds_per_gib', type=float, default=6.0,
+                        help="Simulated seconds a snapshot takes per changed GiB.")
+    parser.add_argument('--copy_seconds_per_gib', type=float, default=4.0,
+                        help="Simulated seconds an encrypted snapshot copy takes per GiB.")
+    parser.add_argument('--change_rate_gib_per_hour', type=float, default=2.0,
+                        help="How fast a volume changes between snapshots, for incremental snapshot sizes.")
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help="Share of calls answered with RequestLimitExceeded.")
+    parser.add_argument('--failure_rate', type=float, default=0.0,
+                        help="Share of snapshots and copies that end in the error state.")
+    parser.add_argument('--ec2_api_limits', action='store_true',
+                        help="Throttle the simulated calls with EC2's own token buckets (the --ec2_* rates).")
+    parser.add_argument('--ec2_describe_rate', type=float, default=20.0,
+                        help="Describe calls per simulated second the simulated account allows.")
+    parser.add_argument('--ec2_describe_burst', type=float, default=100.0,
+                        help="Bucket size of the simulated account's describe calls.")
+    parser.add_argument('--ec2_mutate_rate', type=float, default=5.0,
+                        help="Mutating calls per simulated second the simulated account allows.")
+    parser.add_argument('--ec2_mutate_burst', type=float, default=50.0,
+                        help="Bucket size of the simulated account's mutating calls.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for throttling and failure injection.")
+    parser.add_argument('--client_overhead_samples', type=int, default=20,
+                        help="How many sessions to build to measure the per-instance client overhead.  0 skips it.")
+    parser.add_argument('--output',
+                        help="JSON file to write the reports to.")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Show the encrypter's own output.")
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = build_parser().parse_args()
+    args.region = args.region or "us-east-1"
+
+    # Poll in simulated time, not wall clock time.
+    args.min_poll_interval = args.min_poll_interval / args.speedup
+    args.max_poll_interval = args.max_poll_interval / args.speedup
+    args.lifecycle_batch_window = args.lifecycle_batch_window / args.speedup
+
+    results = {"fleets": []}
+    if args.client_overhead_samples > 0:
+        results["client_overhead"] = measure_client_overhead(args)
+        print_client_overhead(results["client_overhead"])
+
+    for size in args.fleet_sizes:
+        report = run_fleet(args, size)
+        print_report(report)
+        results["fleets"].append(report)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
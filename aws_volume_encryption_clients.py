@@ -0,0 +1,134 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    One boto3 session and client set per (profile, region), shared by every instance worked on in that pair, and one
+    process-wide pool of them.
+Params:
+    The aws profile and region of each target.
+Conditions:
+    Clients and waiters are shared between threads and built on first use.  Resources are not thread safe, so each
+    thread gets its own, built from the shared session.  Sessions are only ever built one at a time, since building
+    them is not thread safe in boto3.  Every client of a set, the resources' included, goes through the set's rate
+    limiter.
+"""
+
+import threading
+import boto3
+import botocore.config
+from aws_volume_encryption_ratelimit import RateLimiter
+
+# Serializes every session, client and resource construction in the process.
+CONSTRUCTION_LOCK = threading.Lock()
+
+
+class ClientSet:
+    def __init__(self, _profile, _region, _session=None, _rate_limits=None, _max_attempts=None, _rate_limiter=None):
+
+        self.profile = _profile
+        self.region = _region
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.waiters = {}
+        if _rate_limiter is not None:
+            self.rate_limiter = _rate_limiter
+        else:
+            self.rate_limiter = RateLimiter(_rate_limits)
+
+        # botocore retries throttled calls on its own; give it room to, now that the limiter paces the retries.
+        if _max_attempts:
+            self.client_config = botocore.config.Config(retries={"max_attempts": _max_attempts, "mode": "standard"})
+        else:
+            self.client_config = None
+
+        with CONSTRUCTION_LOCK:
+            if _session is not None:
+                self.session = _session
+            else:
+                self.session = boto3.session.Session(profile_name=_profile, region_name=_region)
+            self.ec2_client = self.rate_limiter.attach(self.session.client("ec2", config=self.client_config))
+
+    def ec2_resource(self):
+
+        # The ec2 resource of the calling thread.
+        if getattr(self.local, "ec2_resource", None) is None:
+            with CONSTRUCTION_LOCK:
+                self.local.ec2_resource = self.session.resource("ec2", config=self.client_config)
+                self.rate_limiter.attach(self.local.ec2_resource.meta.client)
+        return self.local.ec2_resource
+
+    def autoscaling_client(self):
+
+        # Only group rolls need it, so it's built on first use.
+        with self.lock:
+            if getattr(self, "autoscaling", None) is None:
+                with CONSTRUCTION_LOCK:
+                    self.autoscaling = self.session.client("autoscaling", config=self.client_config)
+            return self.autoscaling
+
+    def elb_client(self):
+
+        # Classic load balancers, only read for the health of ASG members behind them.
+        with self.lock:
+            if getattr(self, "elb", None) is None:
+                with CONSTRUCTION_LOCK:
+                    self.elb = self.session.client("elb", config=self.client_config)
+            return self.elb
+
+    def elbv2_client(self):
+
+        # Target groups, only read for the health of ASG members registered in them.
+        with self.lock:
+            if getattr(self, "elbv2", None) is None:
+                with CONSTRUCTION_LOCK:
+                    self.elbv2 = self.session.client("elbv2", config=self.client_config)
+            return self.elbv2
+
+    def ebs_client(self):
+
+        # EBS direct APIs, only used to count changed blocks between snapshots.
+        with self.lock:
+            if getattr(self, "ebs", None) is None:
+                with CONSTRUCTION_LOCK:
+                    self.ebs = self.session.client("ebs", config=self.client_config)
+            return self.ebs
+
+    def waiter(self, name, max_attempts=None):
+
+        # Waiters only read their config while waiting, so one per (name, max_attempts) serves every thread.
+        key = (name, max_attempts)
+        with self.lock:
+            if key not in self.waiters:
+                waiter = self.ec2_client.get_waiter(name)
+                if max_attempts is not None:
+                    waiter.config.max_attempts = max_attempts
+                self.waiters[key] = waiter
+            return self.waiters[key]
+
+
+class ClientPool:
+    def __init__(self, _rate_limits=None, _max_attempts=None):
+
+        self.lock = threading.Lock()
+        self.client_sets = {}
+        self.configure(_rate_limits, _max_attempts)
+
+    def configure(self, rate_limits=None, max_attempts=None):
+
+        # Settings for the client sets built from here on.
+        self.rate_limits = rate_limits
+        self.max_attempts = max_attempts
+
+    def get(self, profile, region):
+
+        # Build the client set of a (profile, region) pair once and hand the same one out after that.
+        with self.lock:
+            key = (profile, region)
+            if key not in self.client_sets:
+                self.client_sets[key] = ClientSet(profile, region, _rate_limits=self.rate_limits,
+                                                  _max_attempts=self.max_attempts)
+            return self.client_sets[key]
+
+
+# The pool every run in this process shares, so repeated runs reuse the same sessions and clients.
+SHARED_POOL = ClientPool()
@@ -14,6 +14,32 @@ instance_ids = []
 # Comma delimited array of quoted instance names to encrypt the volumes for.
 instance_names = []
 
+# instance_filters: select instances with EC2 describe_instances filters instead of (or on top of) the lists above.
+# -- Each is "Name=Value1,Value2".  Matching instances are streamed into the run page by page, so work starts right
+# -- away and very large fleets don't have to be listed out first.
+# instance_filters = ["tag:Environment=prod", "vpc-id=vpc-0123456789abcdef0", "availability-zone=us-east-1a"]
+instance_filters = []
+
+# unencrypted_only: only select instances by instance_filters that have at least one volume to encrypt or re-key
+# (the root volume, or every volume with encrypt_all).
+# unencrypted_only = True
+unencrypted_only = False
+
+# Groups of instances that serve the same thing, encrypted a wave at a time so only max_unavailable of them are ever
+# down at once.  During each wave the ASG's HealthCheck, ReplaceUnhealthy and AZRebalance processes are suspended, and
+# the next wave only starts once the members are back InService and healthy (running with passing status checks for
+# tag groups).
+# -- asg_names: Auto Scaling groups by name.
+# -- group_tags: tag-defined groups, each one "Name=Value" filter.
+# -- max_unavailable: members of a group down at once, as a count ("2") or a percentage of the group ("25%").
+# -- group_healthy_timeout: seconds a wave may take to come back healthy before the roll of its group stops.
+# asg_names = ["web-asg"]
+# group_tags = ["tag:Service=api"]
+asg_names = []
+group_tags = []
+max_unavailable = "1"
+group_healthy_timeout = 900
+
 # AWS encryption key ARN to use if you're not using the default AWS key.  Full ARN.
 # If you want to use the default AWS\ebs key, just leave blank
 # encryption_key_arn = ""
@@ -39,5 +65,152 @@ keep_snapshots = False
 # generate_report: will generate some information helpful for updating terraform state files or other documentation
 generate_report = True
 
-# force_volume_types: will force all created volumes to a particular type (e.g. gp2)
-force_volume_type = "gp2"
+# report_path: file the machine-readable run report is written to as instances finish, one entry per volume with its
+# old and new ids, device, KMS key, type, performance, phase timings and errors.  A .csv path gets one CSV row per
+# volume, anything else a JSON array of instance results.  Leave blank to skip.
+report_path = ""
+
+# force_volume_types: will force all created volumes to a particular type (e.g. gp3).  Leave blank to keep the type of
+# the original volume.  Either way the new volume keeps the original's size, and its provisioned IOPS and throughput
+# as far as the new type takes them.
+# force_volume_type = "gp3"
+force_volume_type = ""
+
+# gp2_to_gp3:
+# -- Set to true to create gp2 volumes as gp3, with IOPS and throughput at least as high as the gp2 volume's burst
+# -- baseline (3000 IOPS or 3 per GiB above 1000 GiB, 128 or 250 MiB/s depending on the size).
+# gp2_to_gp3 = True
+gp2_to_gp3 = False
+
+# max_volume_workers: how many volumes of one instance to snapshot, copy and create in parallel when encrypt_all is set.
+# -- The detach/attach swaps of all the volumes are done together afterwards.
+# max_volume_workers = 4
+max_volume_workers = 1
+
+# hot_snapshot:
+# -- Set to true to snapshot the volumes while the instance is still running.  After the stop only an incremental
+# -- snapshot of the changed blocks is taken, which keeps the instance down for a much shorter time.
+# -- Set to false to take the only snapshot after the instance is stopped.
+# hot_snapshot = True
+hot_snapshot = False
+
+# copy_snapshot:
+# -- Set to true to always make an encrypted copy of the snapshot and create the new volume from that copy.
+# -- Set to false to create the encrypted volume straight from the snapshot, which skips the copy.  The copy is still
+# -- made when an encrypted volume has to be moved to the default key.
+# copy_snapshot = True
+copy_snapshot = False
+
+# reuse_snapshot_lineage:
+# -- Set to true to look up the newest snapshot of every volume (DLM or AWS Backup snapshots, or ones kept by earlier
+# -- runs with keep_snapshots).  EBS makes the new snapshot incremental to it, so one still being taken is waited on
+# -- first, and the bytes saved are reported (read with the EBS direct APIs, ebs:ListChangedBlocks).  These snapshots
+# -- are never deleted.
+# -- snapshot_lineage_max_age_hours: only snapshots newer than this are continued from (and planned as incremental).
+# reuse_snapshot_lineage = True
+reuse_snapshot_lineage = False
+snapshot_lineage_max_age_hours = 24
+
+# prewarm: how the new volumes get their blocks, which a volume created from a snapshot otherwise loads from S3 on first
+# read, running at a fraction of its IOPS for hours.
+# -- fsr: enable Fast Snapshot Restore on the encrypted snapshot in the instance's zone and wait until it's enabled
+# -- before creating the volume, which then runs at full speed right away.  Always makes the encrypted copy, the
+# -- wait adds to the downtime (about an hour per TiB) and it's billed per hour until it's disabled at cleanup.
+# -- Volumes that don't get one of the max_fast_snapshot_restores slots fall back to initialization_rate.
+# -- initialization_rate: create the volume with volume_initialization_rate (100 to 300 MiB/s) so it's fully
+# -- initialized in a predictable time after the start, and report its progress.  wait_for_initialization waits for
+# -- it to finish before moving on.
+# -- none: let the blocks load on first read.
+# prewarm = "fsr"
+prewarm = "none"
+volume_initialization_rate = 300
+wait_for_initialization = False
+
+# max_workers: how many instances to run at once with --use_pool.  They all run as threads in one process.
+max_workers = 20
+
+# Limits for the EC2 quotas, shared by every instance in the run.
+# -- max_snapshot_copies: encrypted snapshot copies in flight at once (the default EC2 quota is 20 per region).
+# -- max_volume_creations: volume creations in flight at once.
+# -- max_instance_stops: instance stops in flight at once.
+# -- max_fast_snapshot_restores: snapshots with Fast Snapshot Restore on at once (the EBS quota is 5 per region).
+max_snapshot_copies = 20
+max_volume_creations = 20
+max_instance_stops = 20
+max_fast_snapshot_restores = 5
+
+# journal_path: SQLite file that records every phase of every volume.  Run with --resume to pick an interrupted run up
+# where it stopped instead of starting over and leaving its snapshots and volumes behind.
+journal_path = "aws_volume_encryption_journal.db"
+
+# sweep_min_age_hours: the sweep command leaves tagged snapshots and volumes younger than this alone, since they may
+# belong to a run that's still going.
+sweep_min_age_hours = 1
+
+# targets: run several profiles and regions in one go.  Leave empty to use aws_profile, aws_region, instance_ids and
+# instance_names above.  The same list can be given as a JSON file with --manifest.
+# targets = [
+#     {"profile": "prod", "regions": ["us-east-1", "us-west-2"], "instance_names": ["web-1", "web-2"]},
+#     {"profile": "dev", "region": "us-east-1", "instance_ids": ["i-0123456789abcdef0"]},
+# ]
+targets = []
+
+# Phase timing export (snapshot, copy, create_volume, detach, attach, stop, start with volume size and type).
+# -- metrics_jsonl_path: file to append one JSON line per timed phase to.  Leave blank to skip.
+# -- metrics_prometheus_path: Prometheus textfile (e.g. for the node_exporter textfile collector).  Leave blank to skip.
+metrics_jsonl_path = ""
+metrics_prometheus_path = ""
+
+# Status poller interval bounds in seconds: it polls every min_poll_interval while things change and backs off up to
+# max_poll_interval while nothing does.
+min_poll_interval = 5
+max_poll_interval = 30
+
+# Progress of the snapshots, copies and volumes in flight, with throughput and ETA, on stderr.
+# -- progress: live redraws one view at the bottom of the terminal, events writes a JSON line every progress_interval
+# -- seconds (for logs and CI), auto picks live on a terminal and events otherwise, off shows nothing.
+# -- progress_stall_seconds: warn about a snapshot or volume that hasn't moved for this long.
+progress = "auto"
+progress_interval = 30
+progress_stall_seconds = 900
+
+# lifecycle_batch_window: seconds the instance stops (and starts) of a region are gathered for before one
+# stop_instances (or start_instances) call is sent for all of them.  Set to 0 to stop and start each instance on its
+# own.
+lifecycle_batch_window = 2
+
+# schedule: the order instances are handed to the workers.
+# -- longest_first: estimate each instance from the size of the volumes it will encrypt and start the longest first,
+# -- so a big instance never ends up running alone at the end of the run.
+# -- given: the order of the lists above.
+schedule = "longest_first"
+
+# Estimates behind the schedule and the expected run time printed before it starts.  They only have to rank the
+# instances, but tune them from the metrics export to get a realistic expected run time.
+# -- estimated_seconds_per_gib: snapshot and volume creation time per GiB.
+# -- estimated_copy_seconds_per_gib: extra time per GiB when the snapshot is copied.
+# -- estimated_overhead_seconds: stop, swap and start time of every instance.
+estimated_seconds_per_gib = 6
+estimated_copy_seconds_per_gib = 4
+estimated_overhead_seconds = 120
+
+# plan_history: metrics_jsonl_path files of earlier runs.  --plan takes its snapshot, copy, stop and start times from
+# them instead of the estimates above.
+# plan_history = ["aws_volume_encryption_metrics.jsonl"]
+plan_history = []
+
+# snapshot_price_per_gib_month: snapshot storage price, for the cost estimate of --plan.
+snapshot_price_per_gib_month = 0.05
+
+# Client-side API rate limits, shared by every worker of a profile and region.  Calls wait for a token instead of
+# being throttled by EC2.  Each throttle that still happens halves the rate of its kind, which then creeps back up to
+# the limit set here.  Set these to the account's EC2 API limits (the defaults are EC2's standard ones), 0 turns off.
+# -- describe_rate_limit / describe_burst: Describe* calls per second, and how many can go at once.
+# -- mutate_rate_limit / mutate_burst: every other call (snapshots, volumes, attach, stop, start, tags, ...).
+describe_rate_limit = 20
+describe_burst = 100
+mutate_rate_limit = 5
+mutate_burst = 50
+
+# api_max_attempts: attempts botocore makes at a throttled call before it gives up.
+api_max_attempts = 10
@@ -0,0 +1,1022 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    A purpose-built, in-memory stand-in for the EC2 API used by the encrypter, for offline benchmarks.
+Params:
+    Per-operation latencies, snapshot throughput per GiB, a block change rate, throttling and failure rates and a
+    speedup factor that compresses simulated time into wall-clock time.
+Conditions:
+    Only the calls the encrypter makes are implemented.  Every call is counted so benchmarks can report API usage.
+"""
+
+import copy
+import datetime
+import random
+import threading
+import time
+import botocore.exceptions
+import botocore.hooks
+from dateutil.tz import tzutc
+
+# Simulated seconds each call takes before it returns.
+DEFAULT_LATENCIES = {
+    "describe": 0.3,
+    "mutate": 0.5,
+}
+
+# Attempts per call on throttling, like botocore's legacy retry mode (jittered exponential backoff in between).
+RETRY_ATTEMPTS = 5
+
+# EBS direct API block size.
+BLOCK_SIZE = 512 * 1024
+GIB_BLOCKS = 1024 ** 3 // BLOCK_SIZE
+
+# Simulated seconds a state transition takes after the call that starts it.
+DEFAULT_TRANSITIONS = {
+    "volume_create": 10,
+    "volume_attach": 5,
+    "volume_detach": 10,
+    "instance_stop": 45,
+    "instance_start": 40,
+    "snapshot_base": 30,
+}
+
+# Filter names the fake understands, per resource type, and how to read their values.
+INSTANCE_FILTERS = {
+    "instance-id": lambda i: [i["InstanceId"]],
+    "instance-state-name": lambda i: [i["State"]["Name"]],
+    "availability-zone": lambda i: [i["Placement"]["AvailabilityZone"]],
+    "vpc-id": lambda i: [i.get("VpcId")],
+    "platform": lambda i: [i.get("Platform", "")],
+}
+VOLUME_FILTERS = {
+    "volume-id": lambda v: [v["VolumeId"]],
+    "status": lambda v: [v["State"]],
+    "encrypted": lambda v: [str(v["Encrypted"]).lower()],
+    "attachment.instance-id": lambda v: [a["InstanceId"] for a in v["Attachments"]],
+}
+SNAPSHOT_FILTERS = {
+    "snapshot-id": lambda s: [s["SnapshotId"]],
+    "volume-id": lambda s: [s["VolumeId"]],
+    "status": lambda s: [s["State"]],
+}
+
+
+def client_error(code, operation_name, message=""):
+
+    return botocore.exceptions.ClientError({"Error": {"Code": code, "Message": message}}, operation_name)
+
+
+class FakeEC2Backend:
+    def __init__(self,
+                 _region="us-east-1",
+                 _speedup=1000.0,
+                 _latencies=None,
+                 _transitions=None,
+                 _snapshot_seconds_per_gib=6.0,
+                 _copy_seconds_per_gib=4.0,
+                 _change_rate_gib_per_hour=2.0,
+                 _throttle_rate=0.0,
+                 _failure_rate=0.0,
+                 _api_rates=None,
+                 _seed=0):
+
+        self.region = _region
+        self.speedup = _speedup
+        self.latencies = dict(DEFAULT_LATENCIES, **(_latencies or {}))
+        self.transitions = dict(DEFAULT_TRANSITIONS, **(_transitions or {}))
+        self.snapshot_seconds_per_gib = _snapshot_seconds_per_gib
+        self.copy_seconds_per_gib = _copy_seconds_per_gib
+        self.change_rate_gib_per_hour = _change_rate_gib_per_hour
+        self.throttle_rate = _throttle_rate
+        self.failure_rate = _failure_rate
+        self.random = random.Random(_seed)
+
+        # EC2's own token buckets per call kind, in simulated time: {"describe": (rate, burst), ...}.
+        self.api_rates = _api_rates or {}
+        self.api_buckets = dict([(kind, [float(burst), 0.0]) for kind, (rate, burst) in self.api_rates.items()])
+
+        self.lock = threading.RLock()
+        self.started_at = time.time()
+        self.counter = 0
+        self.api_calls = {}
+        self.throttled_calls = 0
+        self.instances = {}
+        self.volumes = {}
+        self.snapshots = {}
+        self.fast_snapshot_restores = {}
+        self.auto_scaling_groups = {}
+        self.downtime = {}
+
+    # -- simulated time --------------------------------------------------------------------------------------------
+
+    def now(self):
+
+        return (time.time() - self.started_at) * self.speedup
+
+    def sleep(self, simulated_seconds):
+
+        time.sleep(simulated_seconds / self.speedup)
+
+    def timestamp(self, simulated_seconds):
+
+        # A boto3-style datetime for a point in simulated time, counted from when the backend was made.
+        return datetime.datetime.utcfromtimestamp(self.started_at + simulated_seconds).replace(tzinfo=tzutc())
+
+    def new_id(self, prefix):
+
+        with self.lock:
+            self.counter += 1
+            return "{}-{:017x}".format(prefix, self.counter)
+
+    # -- fleet setup -----------------------------------------------------------------------------------------------
+
+    def add_instance(self, name, volume_sizes, volume_type="gp2", encrypted=False, tags=None,
+                     availability_zone=None, iops=None, throughput=None, backup_age_hours=None):
+
+        # Create a running instance with one volume per size; the first one is the root volume.  backup_age_hours
+        # gives every volume a completed backup snapshot taken that long ago.
+        availability_zone = availability_zone or "{}a".format(self.region)
+        instance_id = self.new_id("i")
+        mappings = []
+
+        for index, size in enumerate(volume_sizes):
+            device_name = "/dev/xvda" if index == 0 else "/dev/xvd{}".format("bcdefghijklmnop"[index - 1])
+            volume_id = self.new_id("vol")
+            self.volumes[volume_id] = self.timeline({
+                "VolumeId": volume_id,
+                "Size": size,
+                "VolumeType": volume_type,
+                "Iops": iops if iops is not None else max(100, min(16000, 3 * size)),
+                "Throughput": throughput,
+                "Encrypted": encrypted,
+                "KmsKeyId": "arn:aws:kms:{}:123456789012:key/default".format(self.region) if encrypted else None,
+                "AvailabilityZone": availability_zone,
+                "State": "in-use",
+                "Attachments": [{"InstanceId": instance_id, "Device": device_name, "State": "attached",
+                                 "DeleteOnTermination": True, "VolumeId": volume_id}],
+                "Tags": [{"Key": "Name", "Value": "{}-{}".format(name, index)}],
+                "CreateTime": self.timestamp(self.now()),
+                "_written_at": self.now(),
+                "_last_snapshot_at": None,
+            })
+            mappings.append({"DeviceName": device_name,
+                             "Ebs": {"VolumeId": volume_id, "DeleteOnTermination": True, "Status": "attached"}})
+
+            if backup_age_hours is not None:
+                taken_at = self.now() - backup_age_hours * 3600
+                backup = self.new_snapshot(volume_id, size, encrypted, self.volumes[volume_id]["KmsKeyId"],
+                                           "Backup of {}".format(volume_id), None, 0)
+                backup.update({"State": "completed", "Progress": "100%", "StartTime": self.timestamp(taken_at),
+                               "FullSnapshotSizeInBytes": size * GIB_BLOCKS * BLOCK_SIZE, "_timeline": [],
+                               "_changed_gib": float(size)})
+                self.volumes[volume_id]["_last_snapshot_at"] = taken_at
+
+        instance_tags = [{"Key": "Name", "Value": name}] + list(tags or [])
+        self.instances[instance_id] = self.timeline({
+            "InstanceId": instance_id,
+            "State": {"Code": 16, "Name": "running"},
+            "RootDeviceName": "/dev/xvda",
+            "BlockDeviceMappings": mappings,
+            "Placement": {"AvailabilityZone": availability_zone},
+            "VpcId": "vpc-00000000",
+            "Tags": instance_tags,
+        })
+
+        return instance_id
+
+    def add_auto_scaling_group(self, name, instance_ids):
+
+        self.auto_scaling_groups[name] = {"AutoScalingGroupName": name, "InstanceIds": list(instance_ids),
+                                          "SuspendedProcesses": [], "_replaced": []}
+        return name
+
+    @staticmethod
+    def timeline(resource):
+
+        resource["_timeline"] = []
+        return resource
+
+    def schedule(self, resource, delay, updates):
+
+        # Apply updates to a resource once the simulated clock passes now + delay.
+        resource["_timeline"].append((self.now() + delay, updates))
+
+    def settle(self, resource):
+
+        # Apply every scheduled update that is due.
+        now = self.now()
+        due = [t for t in resource["_timeline"] if t[0] <= now]
+        resource["_timeline"] = [t for t in resource["_timeline"] if t[0] > now]
+
+        for at, updates in sorted(due, key=lambda t: t[0]):
+            if callable(updates):
+                updates(resource)
+            else:
+                resource.update(updates)
+
+        return resource
+
+    # -- call accounting -------------------------------------------------------------------------------------------
+
+    def call(self, operation_name, kind="mutate"):
+
+        with self.lock:
+            self.api_calls[operation_name] = self.api_calls.get(operation_name, 0) + 1
+            throttled = self.random.random() < self.throttle_rate
+
+            # Over the account's limit when the kind's bucket is empty.
+            if kind in self.api_buckets:
+                rate, burst = self.api_rates[kind]
+                bucket = self.api_buckets[kind]
+                now = self.now()
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                if bucket[0] >= 1:
+                    bucket[0] -= 1
+                else:
+                    throttled = True
+
+        self.sleep(self.latencies[kind])
+
+        if throttled:
+            with self.lock:
+                self.throttled_calls += 1
+            raise client_error("RequestLimitExceeded", operation_name, "Request limit exceeded.")
+
+    def total_api_calls(self):
+
+        return sum(self.api_calls.values())
+
+    # -- describe helpers ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def public(resource):
+
+        return copy.deepcopy(dict([(k, v) for k, v in resource.items() if not k.startswith("_")]))
+
+    @staticmethod
+    def matches(resource, filters, known_filters):
+
+        for f in filters or []:
+            name = f["Name"]
+            values = f["Values"]
+
+            if name.startswith("tag:"):
+                tags = dict([(t["Key"], t["Value"]) for t in resource.get("Tags", [])])
+                if tags.get(name[4:]) not in values:
+                    return False
+            elif name == "tag-key":
+                if not set(values) & set([t["Key"] for t in resource.get("Tags", [])]):
+                    return False
+            elif name in known_filters:
+                if not set(values) & set(known_filters[name](resource)):
+                    return False
+            else:
+                raise client_error("InvalidParameterValue", "Describe", "Unknown filter {}".format(name))
+
+        return True
+
+    @staticmethod
+    def page(items, max_results, next_token):
+
+        start = int(next_token or 0)
+        end = start + (max_results or 1000)
+        token = str(end) if end < len(items) else None
+        return items[start:end], token
+
+    # -- instances -------------------------------------------------------------------------------------------------
+
+    def describe_instances(self, InstanceIds=None, Filters=None, MaxResults=None, NextToken=None):
+
+        self.call("DescribeInstances", "describe")
+        with self.lock:
+            items = []
+            for instance_id in sorted(self.instances):
+                instance = self.settle(self.instances[instance_id])
+                if InstanceIds and instance_id not in InstanceIds:
+                    continue
+                if self.matches(instance, Filters, INSTANCE_FILTERS):
+                    items.append(self.public(instance))
+
+            missing = [i for i in (InstanceIds or []) if i not in self.instances]
+            if missing:
+                raise client_error("InvalidInstanceID.NotFound", "DescribeInstances", ", ".join(missing))
+
+        page, token = self.page(items, MaxResults, NextToken)
+        response = {"Reservations": [{"Instances": [i]} for i in page]}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def stop_instances(self, InstanceIds):
+
+        self.call("StopInstances")
+        with self.lock:
+            for instance_id in InstanceIds:
+                instance = self.settle(self.instances[instance_id])
+                if instance["State"]["Name"] == "running":
+                    instance["State"] = {"Code": 64, "Name": "stopping"}
+                    self.downtime.setdefault(instance_id, [0.0, None])[1] = self.now()
+                    self.schedule(instance, self.transitions["instance_stop"],
+                                  {"State": {"Code": 80, "Name": "stopped"}})
+        return {"StoppingInstances": [{"InstanceId": i} for i in InstanceIds]}
+
+    def start_instances(self, InstanceIds):
+
+        self.call("StartInstances")
+        with self.lock:
+            for instance_id in InstanceIds:
+                instance = self.settle(self.instances[instance_id])
+                if instance["State"]["Name"] == "stopped":
+                    instance["State"] = {"Code": 0, "Name": "pending"}
+                    self.schedule(instance, self.transitions["instance_start"], self.instance_running)
+        return {"StartingInstances": [{"InstanceId": i} for i in InstanceIds]}
+
+    def instance_running(self, instance):
+
+        instance["State"] = {"Code": 16, "Name": "running"}
+        downtime = self.downtime.setdefault(instance["InstanceId"], [0.0, None])
+        if downtime[1] is not None:
+            downtime[0] += self.now() - downtime[1]
+            downtime[1] = None
+
+    def total_downtime(self):
+
+        with self.lock:
+            return sum([d[0] for d in self.downtime.values()])
+
+    def describe_instance_status(self, InstanceIds=None, IncludeAllInstances=False):
+
+        self.call("DescribeInstanceStatus", "describe")
+        with self.lock:
+            statuses = []
+            for instance_id in InstanceIds or sorted(self.instances):
+                state = self.settle(self.instances[instance_id])["State"]
+                if state["Name"] != "running" and not IncludeAllInstances:
+                    continue
+                status = "ok" if state["Name"] == "running" else "not-applicable"
+                statuses.append({"InstanceId": instance_id, "InstanceState": dict(state),
+                                 "InstanceStatus": {"Status": status}, "SystemStatus": {"Status": status}})
+        return {"InstanceStatuses": statuses}
+
+    def modify_instance_attribute(self, InstanceId, BlockDeviceMappings=None, **kwargs):
+
+        self.call("ModifyInstanceAttribute")
+        with self.lock:
+            instance = self.settle(self.instances[InstanceId])
+            for change in BlockDeviceMappings or []:
+                for mapping in instance["BlockDeviceMappings"]:
+                    if mapping["DeviceName"] == change["DeviceName"]:
+                        mapping["Ebs"]["DeleteOnTermination"] = change["Ebs"]["DeleteOnTermination"]
+        return {}
+
+    # -- auto scaling ----------------------------------------------------------------------------------------------
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames=None):
+
+        self.call("DescribeAutoScalingGroups", "describe")
+        with self.lock:
+            groups = []
+            for name in AutoScalingGroupNames or sorted(self.auto_scaling_groups):
+                if name in self.auto_scaling_groups:
+                    groups.append(self.group_view(self.auto_scaling_groups[name]))
+        return {"AutoScalingGroups": groups}
+
+    def group_view(self, group):
+
+        # Members that aren't running are Unhealthy.  Unless its processes are suspended, the ASG terminates them,
+        # the way a real one replaces a stopped member in the middle of its volume swap.
+        suspended = [p["ProcessName"] for p in group["SuspendedProcesses"]]
+        members = []
+        for instance_id in list(group["InstanceIds"]):
+            instance = self.settle(self.instances[instance_id])
+            healthy = instance["State"]["Name"] == "running"
+            if not healthy and "HealthCheck" not in suspended and "ReplaceUnhealthy" not in suspended:
+                instance["State"] = {"Code": 48, "Name": "terminated"}
+                group["InstanceIds"].remove(instance_id)
+                group["_replaced"].append(instance_id)
+                continue
+            members.append({"InstanceId": instance_id, "LifecycleState": "InService",
+                            "HealthStatus": "Healthy" if healthy else "Unhealthy"})
+
+        view = self.public(group)
+        view["Instances"] = members
+        del view["InstanceIds"]
+        return view
+
+    def suspend_processes(self, AutoScalingGroupName, ScalingProcesses):
+
+        self.call("SuspendProcesses")
+        with self.lock:
+            group = self.auto_scaling_groups[AutoScalingGroupName]
+            for process in ScalingProcesses:
+                if process not in [p["ProcessName"] for p in group["SuspendedProcesses"]]:
+                    group["SuspendedProcesses"].append({"ProcessName": process})
+        return {}
+
+    def resume_processes(self, AutoScalingGroupName, ScalingProcesses):
+
+        self.call("ResumeProcesses")
+        with self.lock:
+            group = self.auto_scaling_groups[AutoScalingGroupName]
+            group["SuspendedProcesses"] = [p for p in group["SuspendedProcesses"]
+                                           if p["ProcessName"] not in ScalingProcesses]
+        return {}
+
+    # -- volumes ---------------------------------------------------------------------------------------------------
+
+    def describe_volumes(self, VolumeIds=None, Filters=None, MaxResults=None, NextToken=None):
+
+        self.call("DescribeVolumes", "describe")
+        with self.lock:
+            items = []
+            for volume_id in sorted(self.volumes):
+                volume = self.settle(self.volumes[volume_id])
+                if VolumeIds and volume_id not in VolumeIds:
+                    continue
+                if volume["State"] != "deleted" and self.matches(volume, Filters, VOLUME_FILTERS):
+                    items.append(self.public(volume))
+
+        page, token = self.page(items, MaxResults, NextToken)
+        response = {"Volumes": page}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def describe_volume_status(self, VolumeIds=None, Filters=None, MaxResults=None, NextToken=None):
+
+        self.call("DescribeVolumeStatus", "describe")
+        with self.lock:
+            items = []
+            for volume_id in VolumeIds or []:
+                volume = self.settle(self.volumes[volume_id])
+                status = {"VolumeId": volume_id, "VolumeStatus": {"Status": "ok", "Details": []}}
+                if volume.get("_initialized_at") is not None:
+                    remaining = max(0.0, volume["_initialized_at"] - self.now())
+                    total = max(1.0, volume["_initialized_at"] - volume["_created_at"])
+                    status["InitializationStatusDetails"] = {
+                        "InitializationType": "provisioned-rate",
+                        "Progress": int(100 * (1 - remaining / total)),
+                        "EstimatedTimeToCompleteInSeconds": int(remaining),
+                    }
+                items.append(status)
+        return {"VolumeStatuses": items}
+
+    def create_volume(self, AvailabilityZone, SnapshotId=None, VolumeType="gp2", Encrypted=False, KmsKeyId=None,
+                      Size=None, Iops=None, Throughput=None, TagSpecifications=None,
+                      VolumeInitializationRate=None, **kwargs):
+
+        self.call("CreateVolume")
+        with self.lock:
+            snapshot = self.settle(self.snapshots[SnapshotId])
+            if snapshot["State"] != "completed":
+                raise client_error("IncorrectState", "CreateVolume", "Snapshot {} is not completed".format(SnapshotId))
+
+            volume_id = self.new_id("vol")
+            size = Size or snapshot["VolumeSize"]
+            encrypted = Encrypted or snapshot["Encrypted"]
+            kms_key_id = KmsKeyId or snapshot.get("KmsKeyId")
+            if encrypted and kms_key_id is None:
+                kms_key_id = "arn:aws:kms:{}:123456789012:key/default".format(self.region)
+
+            volume = self.timeline({
+                "VolumeId": volume_id,
+                "Size": size,
+                "SnapshotId": SnapshotId,
+                "VolumeType": VolumeType,
+                "Iops": Iops,
+                "Throughput": Throughput,
+                "Encrypted": encrypted,
+                "KmsKeyId": kms_key_id if encrypted else None,
+                "AvailabilityZone": AvailabilityZone,
+                "State": "creating",
+                "Attachments": [],
+                "Tags": self.tags_for("volume", TagSpecifications),
+                "CreateTime": self.timestamp(self.now()),
+                "_written_at": self.now(),
+                "_created_at": self.now(),
+                "_last_snapshot_at": None,
+            })
+
+            if VolumeInitializationRate:
+                volume["_initialized_at"] = self.now() + size * 1024.0 / VolumeInitializationRate
+
+            self.volumes[volume_id] = volume
+            self.schedule(volume, self.transitions["volume_create"], {"State": "available"})
+            return self.public(volume)
+
+    def delete_volume(self, VolumeId):
+
+        self.call("DeleteVolume")
+        with self.lock:
+            volume = self.settle(self.volumes[VolumeId])
+            if volume["State"] == "in-use":
+                raise client_error("VolumeInUse", "DeleteVolume", VolumeId)
+            volume["State"] = "deleted"
+        return {}
+
+    def attach_volume(self, VolumeId, InstanceId, Device):
+
+        self.call("AttachVolume")
+        with self.lock:
+            volume = self.settle(self.volumes[VolumeId])
+            instance = self.settle(self.instances[InstanceId])
+            if volume["State"] != "available":
+                raise client_error("IncorrectState", "AttachVolume", VolumeId)
+
+            volume["State"] = "attaching"
+            volume["Attachments"] = [{"InstanceId": InstanceId, "Device": Device, "State": "attached",
+                                      "DeleteOnTermination": False, "VolumeId": VolumeId}]
+            instance["BlockDeviceMappings"].append({
+                "DeviceName": Device,
+                "Ebs": {"VolumeId": VolumeId, "DeleteOnTermination": False, "Status": "attached"},
+            })
+            self.schedule(volume, self.transitions["volume_attach"], {"State": "in-use"})
+        return {"VolumeId": VolumeId, "InstanceId": InstanceId, "Device": Device, "State": "attaching"}
+
+    def detach_volume(self, VolumeId, InstanceId=None, Device=None):
+
+        self.call("DetachVolume")
+        with self.lock:
+            volume = self.settle(self.volumes[VolumeId])
+            instance_id = InstanceId or volume["Attachments"][0]["InstanceId"]
+            instance = self.settle(self.instances[instance_id])
+
+            volume["State"] = "detaching"
+            instance["BlockDeviceMappings"] = [m for m in instance["BlockDeviceMappings"]
+                                               if m["Ebs"]["VolumeId"] != VolumeId]
+            self.schedule(volume, self.transitions["volume_detach"], {"State": "available", "Attachments": []})
+        return {"VolumeId": VolumeId, "InstanceId": instance_id, "State": "detaching"}
+
+    # -- snapshots -------------------------------------------------------------------------------------------------
+
+    def describe_snapshots(self, SnapshotIds=None, OwnerIds=None, Filters=None, MaxResults=None, NextToken=None):
+
+        self.call("DescribeSnapshots", "describe")
+        with self.lock:
+            items = []
+            for snapshot_id in sorted(self.snapshots):
+                snapshot = self.settle(self.snapshots[snapshot_id])
+                if SnapshotIds and snapshot_id not in SnapshotIds:
+                    continue
+                if snapshot["State"] != "deleted" and self.matches(snapshot, Filters, SNAPSHOT_FILTERS):
+                    items.append(self.public(snapshot))
+
+        page, token = self.page(items, MaxResults, NextToken)
+        response = {"Snapshots": page}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def create_snapshot(self, VolumeId, Description="", TagSpecifications=None):
+
+        self.call("CreateSnapshot")
+        with self.lock:
+            volume = self.settle(self.volumes[VolumeId])
+            now = self.now()
+
+            # Only the blocks changed since the last completed snapshot of the volume are uploaded.
+            if volume["_last_snapshot_at"] is None:
+                changed_gib = float(volume["Size"])
+            else:
+                changed_gib = min(float(volume["Size"]),
+                                  (now - volume["_last_snapshot_at"]) * self.change_rate_gib_per_hour / 3600.0)
+            volume["_last_snapshot_at"] = now
+
+            duration = self.transitions["snapshot_base"] + changed_gib * self.snapshot_seconds_per_gib
+            snapshot = self.new_snapshot(VolumeId, volume["Size"], volume["Encrypted"], volume.get("KmsKeyId"),
+                                         Description, TagSpecifications, duration)
+            snapshot["_changed_gib"] = changed_gib
+            return self.public(snapshot)
+
+    def copy_snapshot(self, SourceSnapshotId, SourceRegion=None, Description="", Encrypted=False, KmsKeyId=None,
+                      TagSpecifications=None, **kwargs):
+
+        self.call("CopySnapshot")
+        with self.lock:
+            source = self.settle(self.snapshots[SourceSnapshotId])
+            encrypted = Encrypted or source["Encrypted"]
+            kms_key_id = KmsKeyId or ("arn:aws:kms:{}:123456789012:key/default".format(self.region)
+                                      if encrypted else None)
+
+            duration = self.transitions["snapshot_base"] + source["VolumeSize"] * self.copy_seconds_per_gib
+            snapshot = self.new_snapshot(source["VolumeId"], source["VolumeSize"], encrypted, kms_key_id,
+                                         Description, TagSpecifications, duration)
+            return {"SnapshotId": snapshot["SnapshotId"]}
+
+    def new_snapshot(self, volume_id, size, encrypted, kms_key_id, description, tag_specifications, duration):
+
+        snapshot_id = self.new_id("snap")
+        failed = self.random.random() < self.failure_rate
+        started = self.now()
+
+        snapshot = self.timeline({
+            "SnapshotId": snapshot_id,
+            "VolumeId": volume_id,
+            "VolumeSize": size,
+            "Encrypted": encrypted,
+            "KmsKeyId": kms_key_id,
+            "Description": description,
+            "State": "pending",
+            "Progress": "0%",
+            "StartTime": self.timestamp(started),
+            "OwnerId": "123456789012",
+            "Tags": self.tags_for("snapshot", tag_specifications),
+            "_started": started,
+            "_duration": duration,
+        })
+
+        def progress(s):
+            s["Progress"] = "{}%".format(min(99, int(100 * (self.now() - s["_started"]) / s["_duration"])))
+
+        # A few progress updates on the way, then the final state.
+        for step in [0.25, 0.5, 0.75]:
+            self.schedule(snapshot, duration * step, progress)
+        if failed:
+            self.schedule(snapshot, duration * 0.5, {"State": "error"})
+        else:
+            self.schedule(snapshot, duration, {"State": "completed", "Progress": "100%",
+                                               "FullSnapshotSizeInBytes": size * GIB_BLOCKS * BLOCK_SIZE})
+
+        self.snapshots[snapshot_id] = snapshot
+        return snapshot
+
+    def delete_snapshot(self, SnapshotId):
+
+        self.call("DeleteSnapshot")
+        with self.lock:
+            self.settle(self.snapshots[SnapshotId])["State"] = "deleted"
+        return {}
+
+    def list_changed_blocks(self, FirstSnapshotId, SecondSnapshotId, MaxResults=None, NextToken=None):
+
+        # Only the number of changed blocks is modelled: what the second snapshot had to upload.
+        self.call("ListChangedBlocks", "describe")
+        with self.lock:
+            second = self.settle(self.snapshots[SecondSnapshotId])
+            if FirstSnapshotId not in self.snapshots or second["State"] != "completed":
+                raise client_error("ValidationException", "ListChangedBlocks", "Snapshots not comparable")
+            changed_blocks = int(second.get("_changed_gib", second["VolumeSize"]) * GIB_BLOCKS)
+
+        start = int(NextToken or 0)
+        end = min(changed_blocks, start + (MaxResults or 10000))
+        response = {"ChangedBlocks": [{"BlockIndex": i} for i in range(start, end)], "BlockSize": BLOCK_SIZE,
+                    "VolumeSize": second["VolumeSize"]}
+        if end < changed_blocks:
+            response["NextToken"] = str(end)
+        return response
+
+    # -- fast snapshot restore -------------------------------------------------------------------------------------
+
+    def enable_fast_snapshot_restores(self, AvailabilityZones, SourceSnapshotIds):
+
+        self.call("EnableFastSnapshotRestores")
+        with self.lock:
+            for snapshot_id in SourceSnapshotIds:
+                for zone in AvailabilityZones:
+                    entry = self.timeline({"SnapshotId": snapshot_id, "AvailabilityZone": zone, "State": "enabling"})
+                    self.schedule(entry, 60, {"State": "optimizing"})
+                    self.schedule(entry, 120, {"State": "enabled"})
+                    self.fast_snapshot_restores[(snapshot_id, zone)] = entry
+        return {"Successful": [{"SnapshotId": s} for s in SourceSnapshotIds], "Unsuccessful": []}
+
+    def disable_fast_snapshot_restores(self, AvailabilityZones, SourceSnapshotIds):
+
+        self.call("DisableFastSnapshotRestores")
+        with self.lock:
+            for snapshot_id in SourceSnapshotIds:
+                for zone in AvailabilityZones:
+                    self.fast_snapshot_restores.pop((snapshot_id, zone), None)
+        return {"Successful": [{"SnapshotId": s} for s in SourceSnapshotIds], "Unsuccessful": []}
+
+    def describe_fast_snapshot_restores(self, Filters=None, MaxResults=None, NextToken=None):
+
+        self.call("DescribeFastSnapshotRestores", "describe")
+        with self.lock:
+            items = []
+            for entry in self.fast_snapshot_restores.values():
+                entry = self.settle(entry)
+                if self.matches(entry, Filters, {"snapshot-id": lambda e: [e["SnapshotId"]],
+                                                 "availability-zone": lambda e: [e["AvailabilityZone"]],
+                                                 "state": lambda e: [e["State"]]}):
+                    items.append(self.public(entry))
+        return {"FastSnapshotRestores": items}
+
+    # -- tags ------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def tags_for(resource_type, tag_specifications):
+
+        tags = []
+        for specification in tag_specifications or []:
+            if specification["ResourceType"] == resource_type:
+                tags.extend(copy.deepcopy(specification["Tags"]))
+        return tags
+
+    def create_tags(self, Resources, Tags):
+
+        self.call("CreateTags")
+        with self.lock:
+            for resource_id in Resources:
+                for collection in [self.instances, self.volumes, self.snapshots]:
+                    if resource_id in collection:
+                        existing = dict([(t["Key"], t["Value"]) for t in collection[resource_id].get("Tags", [])])
+                        existing.update(dict([(t["Key"], t["Value"]) for t in Tags]))
+                        collection[resource_id]["Tags"] = [{"Key": k, "Value": v} for k, v in existing.items()]
+        return {}
+
+    def delete_tags(self, Resources, Tags):
+
+        self.call("DeleteTags")
+        with self.lock:
+            keys = [t["Key"] for t in Tags]
+            for resource_id in Resources:
+                for collection in [self.instances, self.volumes, self.snapshots]:
+                    if resource_id in collection:
+                        collection[resource_id]["Tags"] = [t for t in collection[resource_id].get("Tags", [])
+                                                           if t["Key"] not in keys]
+        return {}
+
+
+class FakePaginator:
+    def __init__(self, _method):
+
+        self.method = _method
+
+    def paginate(self, **kwargs):
+
+        page_size = kwargs.pop("PaginationConfig", {}).get("PageSize")
+        if page_size:
+            kwargs["MaxResults"] = page_size
+
+        while True:
+            page = self.method(**kwargs)
+            yield page
+
+            if not page.get("NextToken"):
+                return
+            kwargs["NextToken"] = page["NextToken"]
+
+
+class FakeWaiterConfig:
+    def __init__(self, _delay, _max_attempts):
+
+        self.delay = _delay
+        self.max_attempts = _max_attempts
+
+
+class FakeWaiter:
+
+    # name: (describe method, id keyword, response key, state reader, success states, failure states)
+    WAITERS = {
+        "instance_exists": ("describe_instances", "InstanceIds", "Reservations",
+                            lambda r: r["Instances"][0]["State"]["Name"], None, []),
+        "instance_stopped": ("describe_instances", "InstanceIds", "Reservations",
+                             lambda r: r["Instances"][0]["State"]["Name"], ["stopped"],
+                             ["pending", "shutting-down", "terminated"]),
+        "instance_running": ("describe_instances", "InstanceIds", "Reservations",
+                             lambda r: r["Instances"][0]["State"]["Name"], ["running"],
+                             ["shutting-down", "terminated", "stopping"]),
+        "snapshot_completed": ("describe_snapshots", "SnapshotIds", "Snapshots", lambda r: r["State"],
+                               ["completed"], ["error"]),
+        "volume_available": ("describe_volumes", "VolumeIds", "Volumes", lambda r: r["State"],
+                             ["available"], ["deleted"]),
+        "volume_in_use": ("describe_volumes", "VolumeIds", "Volumes", lambda r: r["State"],
+                          ["in-use"], ["deleted"]),
+    }
+
+    def __init__(self, _client, _name):
+
+        self.client = _client
+        self.name = _name
+        self.config = FakeWaiterConfig(15, 40)
+
+    def wait(self, **kwargs):
+
+        method, id_key, response_key, read_state, success, failure = self.WAITERS[self.name]
+
+        for attempt in range(self.config.max_attempts):
+            try:
+                items = getattr(self.client, method)(**kwargs)[response_key]
+            except botocore.exceptions.ClientError as e:
+                # Like botocore's waiters: only instance_exists waits through a missing id, any other error ends it.
+                if not (self.name == "instance_exists" and e.response["Error"]["Code"].endswith("NotFound")):
+                    raise botocore.exceptions.WaiterError(
+                        self.name, "An error occurred ({}): {}".format(e.response["Error"]["Code"],
+                                                                       e.response["Error"]["Message"]), e.response)
+                items = []
+
+            if items:
+                state = read_state(items[0])
+                if success is None or state in success:
+                    return
+                if state in failure:
+                    raise botocore.exceptions.WaiterError(self.name, "Waiter encountered a terminal failure state",
+                                                          items[0])
+
+            self.client.backend.sleep(self.config.delay)
+
+        raise botocore.exceptions.WaiterError(self.name, "Max attempts exceeded", None)
+
+
+class FakeClientMeta:
+    def __init__(self):
+
+        self.events = botocore.hooks.HierarchicalEmitter()
+
+
+class FakeEC2Client:
+    def __init__(self, _backend, _max_attempts=RETRY_ATTEMPTS):
+
+        self.backend = _backend
+        self.max_attempts = _max_attempts
+        self.meta = FakeClientMeta()
+
+    def get_paginator(self, operation_name):
+
+        return FakePaginator(getattr(self, operation_name))
+
+    def get_waiter(self, waiter_name):
+
+        return FakeWaiter(self, waiter_name)
+
+    def __getattr__(self, name):
+
+        # Every API operation goes to the backend, behind the same throttling retries and events botocore has.
+        operation = getattr(self.backend, name)
+        if not callable(operation):
+            return operation
+        event_suffix = "ec2.{}".format("".join([word.capitalize() for word in name.split("_")]))
+
+        def call(**kwargs):
+            for attempt in range(self.max_attempts):
+                self.meta.events.emit("before-send.{}".format(event_suffix), request=kwargs)
+                try:
+                    response = operation(**kwargs)
+                except botocore.exceptions.ClientError as e:
+                    self.meta.events.emit("needs-retry.{}".format(event_suffix), response=(None, e.response),
+                                          attempts=attempt + 1)
+                    if e.response["Error"]["Code"] != "RequestLimitExceeded" or attempt == self.max_attempts - 1:
+                        raise
+                    with self.backend.lock:
+                        delay = self.backend.random.random() * min(20, 2 ** attempt)
+                    self.backend.sleep(delay)
+                else:
+                    self.meta.events.emit("needs-retry.{}".format(event_suffix), response=(None, response),
+                                          attempts=attempt + 1)
+                    return response
+
+        return call
+
+
+class FakeMeta:
+    def __init__(self):
+
+        self.data = None
+
+
+class FakeResourceObject:
+
+    # The describe call, its id keyword and how to pull the single item out of the response.
+    LOADERS = {}
+
+    def __init__(self, _client, _id):
+
+        self.client = _client
+        self.id = _id
+        self.meta = FakeMeta()
+
+    def load(self):
+
+        method, id_key, read = self.LOADERS[self.__class__.__name__]
+        self.meta.data = read(getattr(self.client, method)(**{id_key: [self.id]}))
+
+    def reload(self):
+
+        self.load()
+
+    def __getattr__(self, name):
+
+        # Attribute access reads the describe data, loading it on first use like boto3 resources do.
+        if name in ("client", "id", "meta"):
+            raise AttributeError(name)
+        if self.meta.data is None:
+            self.load()
+        key = "".join([part.capitalize() for part in name.split("_")])
+        return self.meta.data.get(key)
+
+
+class Instance(FakeResourceObject):
+
+    def stop(self):
+
+        return self.client.stop_instances(InstanceIds=[self.id])
+
+    def start(self):
+
+        return self.client.start_instances(InstanceIds=[self.id])
+
+    def detach_volume(self, VolumeId, Device=None):
+
+        return self.client.detach_volume(VolumeId=VolumeId, InstanceId=self.id, Device=Device)
+
+    def attach_volume(self, VolumeId, Device):
+
+        return self.client.attach_volume(VolumeId=VolumeId, InstanceId=self.id, Device=Device)
+
+    def modify_attribute(self, **kwargs):
+
+        return self.client.modify_instance_attribute(InstanceId=self.id, **kwargs)
+
+
+class Volume(FakeResourceObject):
+
+    def delete(self):
+
+        return self.client.delete_volume(VolumeId=self.id)
+
+    def create_tags(self, Tags):
+
+        return self.client.create_tags(Resources=[self.id], Tags=Tags)
+
+
+class Snapshot(FakeResourceObject):
+
+    def delete(self):
+
+        return self.client.delete_snapshot(SnapshotId=self.id)
+
+    def copy(self, **kwargs):
+
+        return self.client.copy_snapshot(SourceSnapshotId=self.id, **kwargs)
+
+
+Instance.LOADERS = Volume.LOADERS = Snapshot.LOADERS = {
+    "Instance": ("describe_instances", "InstanceIds", lambda r: r["Reservations"][0]["Instances"][0]),
+    "Volume": ("describe_volumes", "VolumeIds", lambda r: r["Volumes"][0]),
+    "Snapshot": ("describe_snapshots", "SnapshotIds", lambda r: r["Snapshots"][0]),
+}
+
+
+class FakeResourceMeta:
+    def __init__(self, _client):
+
+        self.client = _client
+
+
+class FakeEC2Resource:
+    def __init__(self, _client):
+
+        self.client = _client
+        self.meta = FakeResourceMeta(_client)
+
+    def Instance(self, instance_id):
+
+        return Instance(self.client, instance_id)
+
+    def Volume(self, volume_id):
+
+        return Volume(self.client, volume_id)
+
+    def Snapshot(self, snapshot_id):
+
+        return Snapshot(self.client, snapshot_id)
+
+    def create_snapshot(self, **kwargs):
+
+        data = self.client.create_snapshot(**kwargs)
+        snapshot = Snapshot(self.client, data["SnapshotId"])
+        snapshot.meta.data = data
+        return snapshot
+
+    def create_volume(self, **kwargs):
+
+        data = self.client.create_volume(**kwargs)
+        volume = Volume(self.client, data["VolumeId"])
+        volume.meta.data = data
+        return volume
+
+
+class FakeSession:
+    def __init__(self, _backend, _profile_name=None):
+
+        self.backend = _backend
+        self.profile_name = _profile_name
+        self.region_name = _backend.region
+
+    def client(self, service_name, config=None, **kwargs):
+
+        return FakeEC2Client(self.backend, self.max_attempts(config))
+
+    def resource(self, service_name, config=None, **kwargs):
+
+        return FakeEC2Resource(FakeEC2Client(self.backend, self.max_attempts(config)))
+
+    @staticmethod
+    def max_attempts(config):
+
+        if config is not None and config.retries and config.retries.get("max_attempts"):
+            return config.retries["max_attempts"]
+        return RETRY_ATTEMPTS
@@ -0,0 +1,225 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Rolling encryption of the members of an Auto Scaling group or a tag-defined instance group, a wave at a time, so
+    no more than max-unavailable members are ever down at once.
+Params:
+    The group (an ASG name, or "Key=Value" tag filters), max-unavailable as a count ("2") or a percentage ("25%") and
+    a function that encrypts a list of instances and returns their results.
+Conditions:
+    The ASG's HealthCheck, ReplaceUnhealthy, AZRebalance and Terminate processes are suspended while a wave is down,
+    so the ASG doesn't replace or scale in the stopped instances, and resumed once the wave is healthy again.
+    Processes that were already suspended stay suspended.  With HealthCheck suspended the ASG's own HealthStatus isn't updated, so a wave is only
+    healthy once its members pass their EC2 status checks and, for an ASG, are InService and healthy in its load
+    balancers and target groups.  A wave with a failed member, or one that doesn't come back healthy, stops the roll
+    of its group and leaves the processes suspended, so the ASG doesn't replace a member in the middle of its swap.
+"""
+
+import math
+import time
+from aws_volume_encryption_inventory import chunks, parse_filters
+
+# The ASG processes that would terminate or move stopped members.  Terminate also covers scale-in, which could
+# pick a member in the middle of its swap.
+SUSPENDED_PROCESSES = ["HealthCheck", "ReplaceUnhealthy", "AZRebalance", "Terminate"]
+
+# How long a wave may take to report healthy again, and how often to look.
+HEALTHY_TIMEOUT = 900
+HEALTHY_POLL_INTERVAL = 15
+
+# Target group states a member may be in and still count as healthy.  A target group no load balancer uses never
+# health checks its targets.
+HEALTHY_TARGET_STATES = ["healthy"]
+HEALTHY_TARGET_REASONS = ["Target.NotInUse"]
+
+
+def max_unavailable_count(max_unavailable, group_size):
+
+    # "25%" of the group (rounded down, at least one) or a plain count.
+    max_unavailable = str(max_unavailable).strip()
+    if max_unavailable.endswith("%"):
+        count = int(math.floor(group_size * float(max_unavailable[:-1]) / 100.0))
+    else:
+        count = int(max_unavailable)
+    return max(1, count)
+
+
+def waves(members, size):
+
+    for i in range(0, len(members), size):
+        yield members[i:i + size]
+
+
+class GroupRoller:
+    def __init__(self,
+                 _ec2_client,
+                 _autoscaling_client,
+                 _inventory,
+                 _group,
+                 _max_unavailable="1",
+                 _healthy_timeout=HEALTHY_TIMEOUT,
+                 _poll_interval=HEALTHY_POLL_INTERVAL,
+                 _elb_client=None,
+                 _elbv2_client=None):
+
+        # _group: {"asg": name} or {"tags": ["Key=Value", ...]}
+        self.ec2_client = _ec2_client
+        self.autoscaling_client = _autoscaling_client
+        self.elb_client = _elb_client
+        self.elbv2_client = _elbv2_client
+        self.inventory = _inventory
+        self.asg_name = _group.get("asg")
+        self.tag_filters = parse_filters(_group.get("tags", []))
+        self.max_unavailable = _max_unavailable
+        self.healthy_timeout = _healthy_timeout
+        self.poll_interval = _poll_interval
+        self.errors = []
+
+        if self.asg_name:
+            self.name = "ASG {}".format(self.asg_name)
+        else:
+            self.name = "group {}".format(", ".join(_group.get("tags", [])))
+
+    def members(self):
+
+        # The group's instance ids, with their instances and volumes loaded into the inventory.
+        if self.asg_name:
+            group = self.describe_group()
+            if group is None:
+                raise Exception("ERROR: Auto Scaling group {} not found".format(self.asg_name))
+            instance_ids = [i["InstanceId"] for i in group["Instances"] if i["LifecycleState"] == "InService"]
+            self.inventory.discover(self.ec2_client, instance_ids=instance_ids)
+            return [i for i in instance_ids if self.inventory.get_instance(i) is not None]
+
+        return list(self.inventory.stream(self.ec2_client, self.tag_filters))
+
+    def roll(self, members, encrypt, group_size=None):
+
+        # encrypt(instance_ids) runs one wave and returns its InstanceResults.  A percentage is of the whole group,
+        # members with nothing to encrypt included.
+        size = max_unavailable_count(self.max_unavailable, group_size or len(members))
+        planned = list(waves(members, size))
+        print("\n****Rolling {}: {} members in {} waves of at most {}".format(self.name, len(members), len(planned),
+                                                                         size))
+        results = []
+        for number, wave in enumerate(planned):
+            print("****{} wave {} of {}: {}".format(self.name, number + 1, len(planned), ", ".join(wave)))
+
+            suspended = self.suspend_processes()
+            try:
+                wave_results = encrypt(wave)
+                results += wave_results
+                failed = [r.instance_identification for r in wave_results if r.status == "failed"]
+                if failed:
+                    self.errors.append("ERROR: {} failed in wave {} of {}".format(", ".join(failed), number + 1,
+                                                                                 self.name))
+                else:
+                    self.wait_healthy(wave)
+            except Exception as e:
+                self.errors.append("{}".format(e))
+
+            if self.errors:
+                # Left suspended: the ASG would otherwise replace a member that may be halfway through its swap.
+                if suspended:
+                    print("---Leaving {} suspended on {} until the failed members are looked at".format(
+                        ", ".join(suspended), self.name))
+                print("****Stopping the roll of {} after wave {}: {}".format(self.name, number + 1,
+                                                                          "; ".join(self.errors)))
+                break
+
+            self.resume_processes(suspended)
+
+        return results
+
+    def describe_group(self):
+
+        groups = self.autoscaling_client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.asg_name])["AutoScalingGroups"]
+        return groups[0] if groups else None
+
+    def suspend_processes(self):
+
+        # Suspend only what isn't already suspended, and remember it so only that is resumed.
+        if not self.asg_name:
+            return []
+
+        already = [p["ProcessName"] for p in self.describe_group().get("SuspendedProcesses", [])]
+        to_suspend = [p for p in SUSPENDED_PROCESSES if p not in already]
+        if to_suspend:
+            print("---Suspending {} on {}".format(", ".join(to_suspend), self.name))
+            self.autoscaling_client.suspend_processes(AutoScalingGroupName=self.asg_name,
+                                                      ScalingProcesses=to_suspend)
+        return to_suspend
+
+    def resume_processes(self, suspended):
+
+        if suspended:
+            print("---Resuming {} on {}".format(", ".join(suspended), self.name))
+            self.autoscaling_client.resume_processes(AutoScalingGroupName=self.asg_name,
+                                                     ScalingProcesses=suspended)
+
+    def wait_healthy(self, instance_ids):
+
+        # Running with passing status checks, and for ASG members InService and healthy in the load balancers.
+        deadline = time.time() + self.healthy_timeout
+        while True:
+            unhealthy = self.unhealthy(instance_ids)
+            if not unhealthy:
+                return
+            if time.time() > deadline:
+                raise Exception("ERROR: {} not healthy after {} seconds: {}".format(
+                    self.name, self.healthy_timeout, ", ".join(unhealthy)))
+            time.sleep(self.poll_interval)
+
+    def unhealthy(self, instance_ids):
+
+        unhealthy = self.failing_status_checks(instance_ids)
+
+        if self.asg_name:
+            group = self.describe_group()
+            members = dict([(i["InstanceId"], i) for i in group["Instances"]])
+            unhealthy += [i for i in instance_ids if i not in members or members[i]["LifecycleState"] != "InService"]
+            unhealthy += self.unhealthy_in_load_balancers(group, instance_ids)
+
+        return [i for i in instance_ids if i in unhealthy]
+
+    def failing_status_checks(self, instance_ids):
+
+        healthy = []
+        for chunk in chunks(list(instance_ids), 100):
+            statuses = self.ec2_client.describe_instance_status(InstanceIds=chunk,
+                                                                IncludeAllInstances=True)["InstanceStatuses"]
+            healthy += [s["InstanceId"] for s in statuses if s["InstanceState"]["Name"] == "running" and
+                        s["InstanceStatus"]["Status"] in ("ok", "not-applicable") and
+                        s["SystemStatus"]["Status"] in ("ok", "not-applicable")]
+        return [i for i in instance_ids if i not in healthy]
+
+    def unhealthy_in_load_balancers(self, group, instance_ids):
+
+        # Members that a target group or classic load balancer of the ASG doesn't see as healthy yet.
+        unhealthy = []
+
+        if self.elbv2_client is not None:
+            for target_group_arn in group.get("TargetGroupARNs", []):
+                healthy = []
+                for chunk in chunks(list(instance_ids), 100):
+                    descriptions = self.elbv2_client.describe_target_health(
+                        TargetGroupArn=target_group_arn,
+                        Targets=[{"Id": i} for i in chunk])["TargetHealthDescriptions"]
+                    healthy += [d["Target"]["Id"] for d in descriptions
+                                if d["TargetHealth"]["State"] in HEALTHY_TARGET_STATES or
+                                d["TargetHealth"].get("Reason") in HEALTHY_TARGET_REASONS]
+                unhealthy += [i for i in instance_ids if i not in healthy]
+
+        if self.elb_client is not None:
+            for load_balancer_name in group.get("LoadBalancerNames", []):
+                healthy = []
+                for chunk in chunks(list(instance_ids), 100):
+                    states = self.elb_client.describe_instance_health(
+                        LoadBalancerName=load_balancer_name,
+                        Instances=[{"InstanceId": i} for i in chunk])["InstanceStates"]
+                    healthy += [s["InstanceId"] for s in states if s["State"] == "InService"]
+                unhealthy += [i for i in instance_ids if i not in healthy]
+
+        return unhealthy
@@ -0,0 +1,221 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Discover all the target instances and their volumes up front with a few paginated, filtered describe calls.
+Params:
+    An EC2 client plus the instance ids and instance names to look up.
+Conditions:
+    Builds an in-memory index (instance -> mappings -> volume attributes) the InstanceVolumeEncrypter reads from
+    instead of describing every instance and volume on its own.  Selection by EC2 filters is streamed a page at a
+    time, so work starts before the listing ends and finished instances can be forgotten again.  With snapshot
+    lineage on, the newest snapshot of every volume is looked up in the same batched way.
+"""
+
+# EC2 accepts up to 200 values per filter.
+FILTER_VALUE_LIMIT = 200
+
+# Everything but terminated, which can't be encrypted and would make name lookups ambiguous.
+INSTANCE_STATES = ["pending", "running", "shutting-down", "stopping", "stopped"]
+
+# Instances per describe_instances page while streaming; one page of instances and volumes is held at a time.
+STREAM_PAGE_SIZE = 500
+
+# Snapshots a lineage can continue from.  A pending one is waited on, since it's what EBS will base the next one on.
+LINEAGE_STATES = ["pending", "completed"]
+
+
+def chunks(items, size=FILTER_VALUE_LIMIT):
+
+    # Split a list into lists of at most size items.
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_filters(filter_strings):
+
+    # "tag:Environment=prod,staging" -> {"Name": "tag:Environment", "Values": ["prod", "staging"]}
+    filters = []
+    for filter_string in filter_strings or []:
+        if "=" not in filter_string:
+            raise Exception("ERROR: Filter {} should look like Name=Value1,Value2".format(filter_string))
+        name, values = filter_string.split("=", 1)
+        filters.append({"Name": name, "Values": values.split(",")})
+    return filters
+
+
+class Inventory:
+    def __init__(self, _snapshot_lineage=False):
+
+        # Plain dictionaries only, so the inventory can be handed to pool workers.
+        self.instances = {}
+        self.names = {}
+        self.volumes = {}
+        self.snapshots = {}
+        self.snapshot_lineage = _snapshot_lineage
+        self.api_calls = 0
+
+    def discover(self, ec2_client, instance_ids=None, instance_names=None):
+
+        # Filters are used instead of InstanceIds/VolumeIds so a single missing id doesn't fail the whole batch.
+        instance_paginator = ec2_client.get_paginator("describe_instances")
+        instance_filters = []
+
+        for chunk in chunks(list(instance_ids or [])):
+            instance_filters.append({"Name": "instance-id", "Values": chunk})
+
+        for chunk in chunks(list(instance_names or [])):
+            instance_filters.append({"Name": "tag:Name", "Values": chunk})
+
+        for instance_filter in instance_filters:
+            pages = instance_paginator.paginate(
+                Filters=[
+                    instance_filter,
+                    {"Name": "instance-state-name", "Values": INSTANCE_STATES},
+                ]
+            )
+            for page in pages:
+                self.api_calls += 1
+                for reservation in page[u"Reservations"]:
+                    for instance in reservation[u"Instances"]:
+                        self.add_instance(instance)
+
+        # Fetch every attached volume in the same batched way.
+        self.discover_volumes(ec2_client, self.instances.values())
+
+        print("****Discovered {} instances and {} volumes with {} API calls".format(
+            len(self.instances), len(self.volumes), self.api_calls))
+
+        return self
+
+    def stream(self, ec2_client, filters, wanted=None):
+
+        # Yield the ids of the instances matching the EC2 filters one describe page at a time, each with its volumes
+        # already in the inventory.  wanted(instance, volumes), given the instance's (device name, volume) pairs,
+        # says whether to yield it at all; the encrypter's own volume selection is passed in that way.
+        instance_paginator = ec2_client.get_paginator("describe_instances")
+        pages = instance_paginator.paginate(
+            Filters=list(filters) + [{"Name": "instance-state-name", "Values": INSTANCE_STATES}],
+            PaginationConfig={"PageSize": STREAM_PAGE_SIZE},
+        )
+
+        for page in pages:
+            self.api_calls += 1
+            page_instances = [i for r in page[u"Reservations"] for i in r[u"Instances"]]
+
+            # Instances discovered before (listed by id or name) may match the filters too.  Their workers read
+            # them from the inventory, so they're only left out of the stream, never forgotten here.
+            known = set([i[u"InstanceId"] for i in page_instances if i[u"InstanceId"] in self.instances])
+            for instance in page_instances:
+                self.add_instance(instance)
+            self.discover_volumes(ec2_client, page_instances)
+
+            for instance in page_instances:
+                if wanted is not None and not wanted(instance, self.instance_volumes(instance)):
+                    if instance[u"InstanceId"] not in known:
+                        self.forget(instance[u"InstanceId"])
+                    continue
+                yield instance[u"InstanceId"]
+
+    def discover_volumes(self, ec2_client, instances):
+
+        volume_ids = []
+        for instance in instances:
+            for block_device_mapping in instance.get(u"BlockDeviceMappings", []):
+                if "Ebs" in block_device_mapping:
+                    volume_ids.append(block_device_mapping["Ebs"]["VolumeId"])
+
+        volume_paginator = ec2_client.get_paginator("describe_volumes")
+        for chunk in chunks(volume_ids):
+            for page in volume_paginator.paginate(Filters=[{"Name": "volume-id", "Values": chunk}]):
+                self.api_calls += 1
+                for volume in page[u"Volumes"]:
+                    self.add_volume(volume)
+
+        if self.snapshot_lineage:
+            self.discover_snapshots(ec2_client, volume_ids)
+
+    def discover_snapshots(self, ec2_client, volume_ids):
+
+        # The newest snapshot of each volume owned by this account, from one describe per 200 volumes.
+        snapshot_paginator = ec2_client.get_paginator("describe_snapshots")
+        for chunk in chunks(list(volume_ids)):
+            pages = snapshot_paginator.paginate(
+                OwnerIds=["self"],
+                Filters=[
+                    {"Name": "volume-id", "Values": chunk},
+                    {"Name": "status", "Values": LINEAGE_STATES},
+                ]
+            )
+            for page in pages:
+                self.api_calls += 1
+                for snapshot in page[u"Snapshots"]:
+                    newest = self.snapshots.get(snapshot[u"VolumeId"])
+                    if newest is None or snapshot[u"StartTime"] > newest[u"StartTime"]:
+                        self.snapshots[snapshot[u"VolumeId"]] = snapshot
+
+    def instance_volumes(self, instance):
+
+        # (device name, volume) of every discovered EBS volume of the instance.
+        volumes = []
+        for block_device_mapping in instance.get(u"BlockDeviceMappings", []):
+            volume = self.get_volume(block_device_mapping.get("Ebs", {}).get("VolumeId"))
+            if volume is not None:
+                volumes.append((block_device_mapping["DeviceName"], volume))
+        return volumes
+
+    def forget(self, instance_id):
+
+        # Drop a finished instance and its volumes, so a streamed run only holds the instances in flight.
+        instance = self.instances.pop(instance_id, None)
+        if instance is None:
+            return
+
+        for block_device_mapping in instance.get(u"BlockDeviceMappings", []):
+            self.volumes.pop(block_device_mapping.get("Ebs", {}).get("VolumeId"), None)
+            self.snapshots.pop(block_device_mapping.get("Ebs", {}).get("VolumeId"), None)
+
+        for tag in instance.get(u"Tags", []):
+            if tag["Key"] == "Name" and instance_id in self.names.get(tag["Value"], []):
+                self.names[tag["Value"]].remove(instance_id)
+                if not self.names[tag["Value"]]:
+                    del self.names[tag["Value"]]
+
+    def add_instance(self, instance):
+
+        instance_id = instance[u"InstanceId"]
+        self.instances[instance_id] = instance
+
+        for tag in instance.get(u"Tags", []):
+            if tag["Key"] == "Name":
+                self.names.setdefault(tag["Value"], [])
+                if instance_id not in self.names[tag["Value"]]:
+                    self.names[tag["Value"]].append(instance_id)
+
+    def add_volume(self, volume):
+
+        self.volumes[volume[u"VolumeId"]] = volume
+
+    def get_instance(self, instance_id):
+
+        return self.instances.get(instance_id)
+
+    def get_volume(self, volume_id):
+
+        return self.volumes.get(volume_id)
+
+    def get_base_snapshot(self, volume_id):
+
+        # The newest snapshot of the volume, or None when there isn't one or lineage wasn't looked up.
+        return self.snapshots.get(volume_id)
+
+    def find_instance_id(self, instance_name):
+
+        # Same rules as InstanceVolumeEncrypter.get_instance_info_from_name: exactly one match.
+        instance_ids = self.names.get(instance_name, [])
+
+        if len(instance_ids) != 1:
+            raise Exception("ERROR: Check instance_name {}.\nReceived error {}.".format(
+                instance_name, "ERROR: Ambiguous instance_name {}".format(instance_name)))
+
+        return instance_ids[0]
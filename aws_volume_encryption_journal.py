@@ -0,0 +1,136 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Local SQLite journal of every phase each volume goes through, so an interrupted run can be resumed.
+Params:
+    The path of the journal database file.
+Conditions:
+    Safe to share between the worker threads of one run.  Every transition is also kept in a history table.
+"""
+
+import sqlite3
+import threading
+import time
+
+# The phases of one volume, in order.  "copied" only happens on the snapshot copy path.
+PHASES = ["queued", "snapshotted", "copied", "created", "detached", "attached", "cleaned"]
+
+# Phases that end an entry; a resumed run starts these volumes over.
+FINAL_PHASES = ["cleaned", "failed"]
+
+COLUMNS = [
+    "instance_id",
+    "device_name",
+    "delete_on_termination",
+    "pre_snapshot_id",
+    "snapshot_id",
+    "encrypted_snapshot_id",
+    "new_volume_id",
+    "encryption_path",
+]
+
+
+def phase_done(entry, phase):
+
+    # True when a journal entry has already completed the given phase.
+    if entry is None or entry["phase"] not in PHASES:
+        return False
+    return PHASES.index(entry["phase"]) >= PHASES.index(phase)
+
+
+class StateJournal:
+    def __init__(self, _path):
+
+        self.path = _path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS volumes ("
+                "volume_id TEXT PRIMARY KEY, phase TEXT, {}, updated_at REAL)".format(
+                    ", ".join(["{} TEXT".format(c) for c in COLUMNS])))
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS transitions ("
+                "volume_id TEXT, phase TEXT, recorded_at REAL)")
+
+    def record(self, volume_id, phase=None, **fields):
+
+        # Upsert the entry for a volume.  phase=None only stores new resource ids without moving the phase.
+        unknown = [k for k in fields if k not in COLUMNS]
+        if unknown:
+            raise Exception("ERROR: Unknown journal fields {}".format(", ".join(unknown)))
+
+        now = time.time()
+        with self.lock, self.connection:
+            existing = self.connection.execute("SELECT phase FROM volumes WHERE volume_id = ?",
+                                               (volume_id,)).fetchone()
+            if existing is None:
+                self.connection.execute("INSERT INTO volumes (volume_id, phase, updated_at) VALUES (?, ?, ?)",
+                                        (volume_id, phase or "queued", now))
+
+            updates = dict(fields)
+            if phase is not None:
+                updates["phase"] = phase
+            updates["updated_at"] = now
+
+            self.connection.execute(
+                "UPDATE volumes SET {} WHERE volume_id = ?".format(", ".join(["{} = ?".format(k) for k in updates])),
+                list(updates.values()) + [volume_id])
+
+            if phase is not None:
+                self.connection.execute("INSERT INTO transitions (volume_id, phase, recorded_at) VALUES (?, ?, ?)",
+                                        (volume_id, phase, now))
+
+    def reset(self, volume_id, **fields):
+
+        # Start a volume over: clear every resource id from an earlier run and go back to queued.
+        cleared = dict([(c, None) for c in COLUMNS])
+        cleared.update(fields)
+        self.record(volume_id, "queued", **cleared)
+
+    def get(self, volume_id):
+
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM volumes WHERE volume_id = ?", (volume_id,)).fetchone()
+        return self.to_entry(row)
+
+    def unfinished(self, instance_id=None):
+
+        # The unfinished entries of one instance, or of every instance.
+        query = "SELECT * FROM volumes WHERE phase NOT IN ({})".format(", ".join(["?"] * len(FINAL_PHASES)))
+        params = list(FINAL_PHASES)
+        if instance_id is not None:
+            query += " AND instance_id = ?"
+            params.append(instance_id)
+
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [self.to_entry(row) for row in rows]
+
+    @staticmethod
+    def resource_ids(entries):
+
+        # The snapshots and volumes the entries still hold.
+        ids = []
+        for entry in entries:
+            ids += [entry[c] for c in ["pre_snapshot_id", "snapshot_id", "encrypted_snapshot_id", "new_volume_id"]
+                    if entry[c]]
+        return ids
+
+    @staticmethod
+    def to_entry(row):
+
+        if row is None:
+            return None
+
+        entry = dict([(k, row[k]) for k in row.keys()])
+        entry["delete_on_termination"] = entry["delete_on_termination"] in ("1", "True", 1, True)
+        return entry
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
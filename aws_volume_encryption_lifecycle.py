@@ -0,0 +1,159 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    One coordinator per region that gathers the instances workers want stopped or started within a short window and
+    sends a single stop_instances or start_instances call for all of them, instead of one call per worker.
+Params:
+    An EC2 client plus the batch window and the most instances a single call is sent for.
+Conditions:
+    stop() and start() block until the call covering the instance has been sent and raise the instance's own
+    ClientError if EC2 refused it.  Waiting for the state change is left to the status poller, whose batched
+    describe lets each worker go on as soon as its own instance gets there.  A batch EC2 refuses as a whole (one
+    instance in the wrong state fails the call for all of them) is sent again one instance at a time, so only the
+    instances at fault see the error.
+"""
+
+import threading
+import time
+import botocore.exceptions
+from concurrent.futures import Future
+
+# Instances per stop_instances or start_instances call.
+MAX_BATCH_SIZE = 100
+
+ACTIONS = ["stop", "start"]
+
+
+class LifecycleRequest:
+    def __init__(self, _action, _instance_id):
+
+        self.action = _action
+        self.instance_id = _instance_id
+        self.requested_at = time.time()
+        self.future = Future()
+
+
+class LifecycleCoordinator:
+    def __init__(self, _ec2_client, _batch_window=2, _max_batch_size=MAX_BATCH_SIZE):
+
+        self.ec2_client = _ec2_client
+        self.batch_window = _batch_window
+        self.max_batch_size = _max_batch_size
+        self.api_calls = 0
+
+        self.pending = dict((action, []) for action in ACTIONS)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def submit(self, action, instance_id):
+
+        # Queue an instance for the next batch of its action and return a future that resolves once it's been sent.
+        request = LifecycleRequest(action, instance_id)
+
+        with self.condition:
+            if self.stopped:
+                raise Exception("ERROR: The lifecycle coordinator is stopped, can't {} {}".format(action, instance_id))
+
+            self.pending[action].append(request)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.batch_loop, name="lifecycle-coordinator")
+                self.thread.daemon = True
+                self.thread.start()
+
+            self.condition.notify()
+
+        return request.future
+
+    def stop_instance(self, instance_id):
+
+        return self.submit("stop", instance_id).result()
+
+    def start_instance(self, instance_id):
+
+        return self.submit("start", instance_id).result()
+
+    def stop(self):
+
+        # Anything still queued is sent before the thread exits, so no worker is left waiting.
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def batch_loop(self):
+
+        while True:
+            with self.condition:
+                while not self.due_batches(time.time()) and not self.stopped:
+                    self.condition.wait(self.time_to_next_batch(time.time()))
+
+                batches = self.due_batches(time.time(), take=True, flush=self.stopped)
+                if self.stopped and not batches:
+                    return
+
+            for action, requests in batches:
+                self.send(action, requests)
+
+    def time_to_next_batch(self, now):
+
+        # None (wait for a request) while nothing is queued.
+        waits = [self.batch_window - (now - requests[0].requested_at) for requests in self.pending.values() if requests]
+        if not waits:
+            return None
+        return max(0, min(waits))
+
+    def due_batches(self, now, take=False, flush=False):
+
+        # A batch goes out once its oldest request has waited the window or it's full.
+        batches = []
+        for action in ACTIONS:
+            requests = self.pending[action]
+            while requests and (flush or len(requests) >= self.max_batch_size or
+                                now - requests[0].requested_at >= self.batch_window):
+                batches.append((action, requests[:self.max_batch_size]))
+                if not take:
+                    return batches
+                requests = requests[self.max_batch_size:]
+                self.pending[action] = requests
+        return batches
+
+    def send(self, action, requests):
+
+        instance_ids = []
+        for request in requests:
+            if request.instance_id not in instance_ids:
+                instance_ids.append(request.instance_id)
+
+        try:
+            response = self.call(action, instance_ids)
+        except botocore.exceptions.ClientError as e:
+            if len(instance_ids) == 1:
+                for request in requests:
+                    request.future.set_exception(e)
+                return
+
+            # The whole batch was refused for one of them.  Find out which by sending them one by one.
+            print("---Batched {} of {} instances failed ({}), sending them one at a time".format(
+                action, len(instance_ids), e.response.get("Error", {}).get("Code")))
+            for instance_id in instance_ids:
+                self.send(action, [r for r in requests if r.instance_id == instance_id])
+            return
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+
+        for request in requests:
+            request.future.set_result(response.get(request.instance_id))
+
+    def call(self, action, instance_ids):
+
+        # Return {instance id: state change} for one stop_instances or start_instances call.
+        self.api_calls += 1
+        if action == "stop":
+            changes = self.ec2_client.stop_instances(InstanceIds=instance_ids).get("StoppingInstances", [])
+        else:
+            changes = self.ec2_client.start_instances(InstanceIds=instance_ids).get("StartingInstances", [])
+        return dict((change["InstanceId"], change) for change in changes)
@@ -0,0 +1,86 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Snapshot lineage of the volumes being encrypted: the newest existing snapshot of each volume (a DLM or AWS Backup
+    snapshot, or one kept by an earlier run), and how much a snapshot taken after it didn't have to upload.
+Params:
+    The snapshots found by the inventory, an EC2 client to read their data size and an EBS direct API client to count
+    changed blocks with.
+Conditions:
+    EBS makes a snapshot incremental to the newest completed snapshot of the same volume, so a recent one means the
+    snapshot after the stop only uploads what changed since.  Only snapshots younger than the max age are continued
+    from; an older one has too much to catch up on to plan around.  Lineage snapshots belong to someone else and are
+    never deleted.  The bytes saved are the parent's data less what changed since; when the parent's data size isn't
+    known the volume size stands in for it, which is only an upper bound since a full snapshot only uploads the
+    blocks that were ever written.
+"""
+
+import calendar
+import time
+import botocore.exceptions
+
+GIB = 1024 ** 3
+
+# Changed blocks per ListChangedBlocks page (the API's maximum).
+CHANGED_BLOCKS_PAGE_SIZE = 10000
+
+
+def snapshot_age_seconds(snapshot, now=None):
+
+    # StartTime is a datetime from boto3.
+    start_time = snapshot["StartTime"]
+    if hasattr(start_time, "utctimetuple"):
+        start_time = calendar.timegm(start_time.utctimetuple())
+    return max(0.0, (now or time.time()) - start_time)
+
+
+def is_fresh(snapshot, max_age_hours):
+
+    # Recent enough to continue the lineage from.
+    return snapshot is not None and snapshot_age_seconds(snapshot) <= max_age_hours * 3600
+
+
+def changed_bytes(ebs_client, first_snapshot_id, second_snapshot_id):
+
+    # Bytes that differ between two snapshots of the same lineage, from the EBS direct APIs.  None when they can't
+    # be read (no ebs:ListChangedBlocks permission, a key that can't be used, ...).
+    changed = 0
+    kwargs = {"FirstSnapshotId": first_snapshot_id, "SecondSnapshotId": second_snapshot_id,
+              "MaxResults": CHANGED_BLOCKS_PAGE_SIZE}
+    try:
+        while True:
+            page = ebs_client.list_changed_blocks(**kwargs)
+            changed += len(page.get("ChangedBlocks", [])) * page["BlockSize"]
+            if not page.get("NextToken"):
+                return changed
+            kwargs["NextToken"] = page["NextToken"]
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        print("---Can't count the changed blocks between {} and {}: {}".format(first_snapshot_id,
+                                                                            second_snapshot_id, e))
+        return None
+
+
+def snapshot_data_bytes(ec2_client, snapshot_id):
+
+    # Bytes of data a snapshot holds (FullSnapshotSizeInBytes), None when EC2 doesn't say.
+    try:
+        snapshots = ec2_client.describe_snapshots(SnapshotIds=[snapshot_id])["Snapshots"]
+    except botocore.exceptions.ClientError as e:
+        print("---Can't read the data size of snapshot {}: {}".format(snapshot_id, e))
+        return None
+    if not snapshots:
+        return None
+    return snapshots[0].get("FullSnapshotSizeInBytes")
+
+
+def bytes_saved(ebs_client, parent_snapshot_id, snapshot_id, size_gib, parent_data_bytes=None):
+
+    # The parent's data that didn't have to be uploaded again.  Without parent_data_bytes the whole volume size is
+    # used, an upper bound.
+    changed = changed_bytes(ebs_client, parent_snapshot_id, snapshot_id)
+    if changed is None:
+        return None
+    if parent_data_bytes is None:
+        parent_data_bytes = size_gib * GIB
+    return max(0, parent_data_bytes - changed)
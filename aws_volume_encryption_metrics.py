@@ -0,0 +1,185 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Per-phase timing of snapshot, copy, create_volume, detach, attach, stop and start, with volume size and type.
+Params:
+    An optional JSON-lines event file and an optional Prometheus textfile path.
+Conditions:
+    Events are appended as they happen.  The textfile holds one duration histogram per phase, volume type and status
+    and is rewritten atomically, so a node_exporter textfile collector never reads half a file.  Exporting is best
+    effort: a file that can't be written is logged and never fails the phase being timed.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Histogram bucket bounds in seconds, from quick API calls up to multi-hour snapshots of large volumes.
+DEFAULT_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800]
+
+METRIC_NAME = "aws_volume_encryption_phase_duration_seconds"
+GIB_METRIC_NAME = "aws_volume_encryption_phase_gibibytes_total"
+
+# Rewrite the textfile at most this often while events come in; close() always writes it.
+PROMETHEUS_WRITE_INTERVAL = 10
+
+
+def phase_history(jsonl_path):
+
+    # Totals per phase of the successful events in an earlier run's JSON-lines file: count, seconds and GiB.
+    history = {}
+    with open(jsonl_path) as jsonl_file:
+        for line in jsonl_file:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("event") != "phase" or event.get("status") != "ok":
+                continue
+
+            totals = history.setdefault(event["phase"], {"count": 0, "seconds": 0.0, "gib": 0})
+            totals["count"] += 1
+            totals["seconds"] += event["duration_seconds"]
+            totals["gib"] += event.get("size_gib") or 0
+    return history
+
+
+class PhaseTimer:
+    def __init__(self, _metrics, _phase, _labels):
+
+        self.metrics = _metrics
+        self.phase = _phase
+        self.labels = _labels
+        self.started_at = time.time()
+        self.duration = None
+
+    def done(self, status="ok"):
+
+        # Record the phase once, the first time it is finished.
+        if self.duration is None:
+            self.duration = time.time() - self.started_at
+            self.metrics.record(self.phase, self.duration, status, **self.labels)
+        return self.duration
+
+
+class PhaseMetrics:
+    def __init__(self, _jsonl_path=None, _prometheus_path=None, _buckets=None):
+
+        self.jsonl_path = _jsonl_path
+        self.prometheus_path = _prometheus_path
+        self.buckets = _buckets or DEFAULT_BUCKETS
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.histograms = {}
+        self.gibibytes = {}
+        self.events = 0
+        self.last_prometheus_write = 0
+
+        if _jsonl_path:
+            self.jsonl_file = open(_jsonl_path, "a")
+        else:
+            self.jsonl_file = None
+
+    def start(self, phase, **labels):
+
+        # Start timing a phase.  Call done() on the returned timer, with status "error" when the phase failed.
+        return PhaseTimer(self, phase, labels)
+
+    def record(self, phase, duration, status="ok", **labels):
+
+        event = {"event": "phase", "time": time.time(), "phase": phase, "duration_seconds": round(duration, 3),
+                 "status": status}
+        event.update(labels)
+
+        key = (phase, labels.get("volume_type") or "", status)
+
+        with self.lock:
+            self.events += 1
+
+            histogram = self.histograms.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0,
+                                                         "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += duration
+            histogram["count"] += 1
+
+            if labels.get("size_gib"):
+                self.gibibytes[key] = self.gibibytes.get(key, 0) + labels["size_gib"]
+
+            if self.jsonl_file is not None:
+                try:
+                    self.jsonl_file.write(json.dumps(event, sort_keys=True) + "\n")
+                    self.jsonl_file.flush()
+                except (IOError, OSError) as e:
+                    print("---Can't write the metrics event to {}: {}".format(self.jsonl_path, e))
+
+            # Claim the write here, so only one of the threads recording at the same time rewrites the textfile.
+            write_prometheus = time.time() - self.last_prometheus_write >= PROMETHEUS_WRITE_INTERVAL
+            if write_prometheus:
+                self.last_prometheus_write = time.time()
+
+        if write_prometheus:
+            self.write_prometheus()
+
+    def write_prometheus(self):
+
+        if not self.prometheus_path:
+            return
+
+        # One writer at a time, so an older snapshot of the histograms never replaces a newer one.
+        with self.write_lock:
+            self.write_textfile()
+
+    def write_textfile(self):
+
+        lines = [
+            "# HELP {} Duration of each volume encryption phase.".format(METRIC_NAME),
+            "# TYPE {} histogram".format(METRIC_NAME),
+        ]
+
+        with self.lock:
+            for key in sorted(self.histograms):
+                phase, volume_type, status = key
+                histogram = self.histograms[key]
+                labels = 'phase="{}",volume_type="{}",status="{}"'.format(phase, volume_type, status)
+
+                for index, bound in enumerate(self.buckets):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(METRIC_NAME, labels, bound,
+                                                                    histogram["buckets"][index]))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(METRIC_NAME, labels, histogram["count"]))
+                lines.append("{}_sum{{{}}} {}".format(METRIC_NAME, labels, round(histogram["sum"], 3)))
+                lines.append("{}_count{{{}}} {}".format(METRIC_NAME, labels, histogram["count"]))
+
+            lines.append("# HELP {} Volume size handled by each phase, in GiB.".format(GIB_METRIC_NAME))
+            lines.append("# TYPE {} counter".format(GIB_METRIC_NAME))
+            for key in sorted(self.gibibytes):
+                phase, volume_type, status = key
+                lines.append('{}{{phase="{}",volume_type="{}",status="{}"}} {}'.format(
+                    GIB_METRIC_NAME, phase, volume_type, status, self.gibibytes[key]))
+
+        # Write a temporary file of its own next to the target and rename, so readers only ever see a complete file.
+        temporary_path = None
+        try:
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.prometheus_path)),
+                                                          prefix=os.path.basename(self.prometheus_path) + ".",
+                                                          suffix=".tmp")
+            with os.fdopen(descriptor, "w") as textfile:
+                textfile.write("\n".join(lines) + "\n")
+            os.rename(temporary_path, self.prometheus_path)
+        except (IOError, OSError) as e:
+            print("---Can't write the metrics textfile {}: {}".format(self.prometheus_path, e))
+            if temporary_path is not None and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def close(self):
+
+        self.write_prometheus()
+
+        with self.lock:
+            if self.jsonl_file is not None:
+                self.jsonl_file.close()
+                self.jsonl_file = None
@@ -0,0 +1,261 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Dry-run plan of what a run would do: the volumes queued on every instance, the actions on each, the GiB to
+    snapshot, the expected downtime per instance and the expected run time and snapshot cost.
+Params:
+    The batched discovery of a target, the run's options and the phase throughput of earlier runs (their
+    --metrics_jsonl files), falling back to defaults when there is none.
+Conditions:
+    Only reads discovery data, so it has no side effects.  The selection rules here are the ones the encrypter uses.
+"""
+
+from aws_volume_encryption_lineage import is_fresh
+from aws_volume_encryption_prewarm import FAST_SNAPSHOT_RESTORE_SECONDS_PER_GIB, MAX_INITIALIZATION_RATE, \
+    initialization_seconds
+from aws_volume_encryption_scheduler import longest_first, makespan, lower_bound
+from aws_volume_encryption_volumetypes import performance_settings, target_settings
+
+# Seconds each fixed-length phase takes when no earlier run says otherwise.
+DEFAULT_PHASE_SECONDS = {
+    "stop": 45,
+    "start": 40,
+    "create_volume": 15,
+    "detach": 10,
+    "attach": 10,
+    "incremental_snapshot": 60,
+}
+
+# Phases whose time grows with the volume size, and the rest.
+SIZED_PHASES = ["snapshot", "hot_snapshot", "copy", "fast_snapshot_restore"]
+
+HOURS_PER_MONTH = 730
+
+
+def volume_needs_encryption(encrypted, kms_key_id, encryption_key_arn, ignore_encrypted):
+
+    # Unencrypted volumes always do.  Encrypted ones only when they should move to another key.
+    if encrypted:
+        return ignore_encrypted is False and kms_key_id != encryption_key_arn
+    return True
+
+
+def choose_encryption_path(encrypted, copy_snapshot, encryption_key_arn):
+
+    # "copy" makes an encrypted snapshot copy first, "direct" creates the encrypted volume from the snapshot.
+    if copy_snapshot or (encrypted and not encryption_key_arn):
+        return "copy"
+    return "direct"
+
+
+class ThroughputRates:
+    def __init__(self, _seconds_per_gib, _copy_seconds_per_gib, _history=None):
+
+        # Per-GiB rates and fixed phase times, from the history of earlier runs where it has the phase.
+        self.source = "history" if _history else "defaults"
+        self.seconds_per_gib = {
+            "snapshot": _seconds_per_gib,
+            "hot_snapshot": _seconds_per_gib,
+            "copy": _copy_seconds_per_gib,
+            "fast_snapshot_restore": FAST_SNAPSHOT_RESTORE_SECONDS_PER_GIB,
+        }
+        self.phase_seconds = dict(DEFAULT_PHASE_SECONDS)
+
+        for phase, totals in (_history or {}).items():
+            if phase in SIZED_PHASES and totals["gib"] > 0:
+                self.seconds_per_gib[phase] = totals["seconds"] / totals["gib"]
+            elif phase in self.phase_seconds and totals["count"] > 0:
+                self.phase_seconds[phase] = totals["seconds"] / totals["count"]
+
+    def to_dict(self):
+
+        return {
+            "source": self.source,
+            "seconds_per_gib": dict([(k, round(v, 3)) for k, v in self.seconds_per_gib.items()]),
+            "phase_seconds": dict([(k, round(v, 1)) for k, v in self.phase_seconds.items()]),
+        }
+
+
+class Planner:
+    def __init__(self,
+                 _inventory,
+                 _rates,
+                 _encrypt_all,
+                 _ignore_encrypted,
+                 _encryption_key_arn,
+                 _force_volume_type,
+                 _keep_snapshots,
+                 _gp2_to_gp3=False,
+                 _max_volume_workers=1,
+                 _hot_snapshot=False,
+                 _copy_snapshot=False,
+                 _snapshot_lineage_max_age_hours=24,
+                 _prewarm="none",
+                 _volume_initialization_rate=MAX_INITIALIZATION_RATE):
+
+        self.inventory = _inventory
+        self.rates = _rates
+        self.encrypt_all = _encrypt_all
+        self.ignore_encrypted = _ignore_encrypted
+        self.encryption_key_arn = _encryption_key_arn
+        self.force_volume_type = _force_volume_type
+        self.gp2_to_gp3 = _gp2_to_gp3
+        self.keep_snapshots = _keep_snapshots
+        self.max_volume_workers = _max_volume_workers
+        self.hot_snapshot = _hot_snapshot
+        self.copy_snapshot = _copy_snapshot
+        self.snapshot_lineage_max_age_hours = _snapshot_lineage_max_age_hours
+        self.prewarm = _prewarm
+        self.volume_initialization_rate = _volume_initialization_rate
+
+    def plan_target(self, profile, region, instance_ids, instance_names, max_workers):
+
+        instances = []
+        for item in instance_ids + instance_names:
+            instances.append(self.plan_instance(item))
+
+        # Same order and slots the run itself would use.
+        durations = [seconds for plan, seconds in
+                     longest_first([(p, p["ExpectedDurationSeconds"]) for p in instances])]
+
+        return {
+            "Profile": profile,
+            "Region": region,
+            "Workers": max_workers,
+            "Instances": instances,
+            "SnapshotGiB": sum([p["SnapshotGiB"] for p in instances]),
+            "ExpectedRunSeconds": round(makespan(durations, max_workers)),
+            "BestRunSeconds": round(lower_bound(durations, max_workers)),
+        }
+
+    def plan_instance(self, instance_unknown):
+
+        plan = {"Instance": instance_unknown, "InstanceId": None, "Action": "not_found", "Volumes": [],
+                "SnapshotGiB": 0, "ExpectedDowntimeSeconds": 0, "ExpectedDurationSeconds": 0}
+
+        try:
+            if instance_unknown.startswith("i-"):
+                instance_id = instance_unknown
+            else:
+                instance_id = self.inventory.find_instance_id(instance_unknown)
+        except Exception as e:
+            plan["Error"] = str(e)
+            return plan
+
+        instance_data = self.inventory.get_instance(instance_id)
+        if instance_data is None:
+            return plan
+
+        plan["InstanceId"] = instance_id
+        plan["State"] = instance_data["State"]["Name"]
+
+        for block_device_mapping in instance_data.get("BlockDeviceMappings", []):
+            volume_data = self.inventory.get_volume(block_device_mapping["Ebs"]["VolumeId"])
+            if volume_data is None:
+                continue
+            if block_device_mapping["DeviceName"] != instance_data.get("RootDeviceName") and not self.encrypt_all:
+                continue
+            if not volume_needs_encryption(volume_data.get("Encrypted"), volume_data.get("KmsKeyId"),
+                                           self.encryption_key_arn, self.ignore_encrypted):
+                continue
+            plan["Volumes"].append(self.plan_volume(volume_data, block_device_mapping["DeviceName"]))
+
+        if not plan["Volumes"]:
+            plan["Action"] = "skip"
+            return plan
+
+        plan["Action"] = "encrypt"
+        plan["SnapshotGiB"] = sum([v["SizeGiB"] for v in plan["Volumes"]])
+
+        # Snapshot, copy and create run on the volume workers, then every volume is swapped in one batched
+        # detach/attach phase, all while stopped.
+        phase_seconds = self.rates.phase_seconds
+        downtime = phase_seconds["stop"] + phase_seconds["start"]
+        downtime += makespan(sorted([v["ExpectedSeconds"] for v in plan["Volumes"]], reverse=True),
+                             self.max_volume_workers)
+        downtime += phase_seconds["detach"] + phase_seconds["attach"]
+
+        # Hot snapshots all start together before the stop.
+        before_stop = 0
+        if self.hot_snapshot:
+            before_stop = max([v["SizeGiB"] * self.rates.seconds_per_gib["hot_snapshot"] for v in plan["Volumes"]
+                               if "hot_snapshot" in v["Actions"]] or [0])
+
+        plan["ExpectedDowntimeSeconds"] = round(downtime)
+        plan["ExpectedDurationSeconds"] = round(before_stop + downtime)
+        return plan
+
+    def plan_volume(self, volume_data, device_name):
+
+        encryption_path = choose_encryption_path(volume_data.get("Encrypted"),
+                                                 self.copy_snapshot or self.prewarm == "fsr", self.encryption_key_arn)
+        size = volume_data["Size"]
+        rates = self.rates
+
+        # A recent snapshot of the volume found by discovery makes ours incremental, like a hot snapshot does.
+        base = self.inventory.get_base_snapshot(volume_data["VolumeId"])
+        if not is_fresh(base, self.snapshot_lineage_max_age_hours):
+            base = None
+
+        actions = []
+        if self.hot_snapshot:
+            actions.append("hot_snapshot")
+        if self.hot_snapshot or base is not None:
+            seconds = rates.phase_seconds["incremental_snapshot"]
+        else:
+            seconds = size * rates.seconds_per_gib["snapshot"]
+        actions.append("snapshot")
+
+        if encryption_path == "copy":
+            actions.append("copy")
+            seconds += size * rates.seconds_per_gib["copy"]
+
+        # Fast snapshot restore is waited on before the volume is created; an initialization rate runs after the start.
+        expected_initialization = None
+        if self.prewarm == "fsr":
+            actions.append("fast_snapshot_restore")
+            seconds += size * rates.seconds_per_gib["fast_snapshot_restore"]
+        elif self.prewarm == "initialization_rate":
+            expected_initialization = round(initialization_seconds(size, self.volume_initialization_rate))
+
+        actions += ["create_volume", "detach", "attach"]
+        seconds += rates.phase_seconds["create_volume"]
+
+        if self.keep_snapshots:
+            actions.append("delete_volume")
+        else:
+            actions += ["delete_snapshots", "delete_volume"]
+
+        before = performance_settings(volume_data.get("VolumeType"), size, volume_data.get("Iops"),
+                                      volume_data.get("Throughput"))
+        after = target_settings(before["VolumeType"], size, before["Iops"], before["Throughput"],
+                                self.force_volume_type, self.gp2_to_gp3)
+
+        return {
+            "VolumeId": volume_data["VolumeId"],
+            "DeviceName": device_name,
+            "SizeGiB": size,
+            "VolumeType": volume_data.get("VolumeType"),
+            "NewVolumeType": after["VolumeType"],
+            "Before": before,
+            "After": after,
+            "Encrypted": volume_data.get("Encrypted"),
+            "EncryptionPath": encryption_path,
+            "BaseSnapshotId": base["SnapshotId"] if base is not None else None,
+            "Actions": actions,
+            "ExpectedSeconds": round(seconds),
+            "ExpectedInitializationSeconds": expected_initialization,
+        }
+
+
+def snapshot_cost(snapshot_gib, run_seconds, price_per_gib_month, copy_gib=0, keep_snapshots=False):
+
+    # Snapshot storage for the length of the run, or a month of it for snapshots that are kept.  Upper bound: every
+    # snapshot is billed as full size for the whole run.
+    gib = snapshot_gib + copy_gib
+    if keep_snapshots:
+        months = 1.0
+    else:
+        months = run_seconds / 3600.0 / HOURS_PER_MONTH
+    return round(gib * price_per_gib_month * months, 4)
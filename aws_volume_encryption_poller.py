@@ -0,0 +1,267 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    One background poller that checks every in-flight snapshot, volume, instance and fast snapshot restore with a
+    single batched describe call per resource type per tick, instead of one waiter per resource per worker.
+Params:
+    An EC2 client plus the polling interval bounds, and optionally a progress tracker to hand every describe result to.
+Conditions:
+    Workers get a future from watch() (or block in wait()) and see a botocore WaiterError on failure or timeout,
+    the same as they would from a waiter.  A poll that fails for any other reason (a connection error, a read
+    timeout) is logged and retried with backoff; after MAX_POLL_FAILURES in a row every pending wait fails instead.
+    wait() also gives up on its own a little after the resource's timeout, so a poller that died can't hang a run.
+"""
+
+import threading
+import time
+import botocore.exceptions
+from concurrent.futures import Future, TimeoutError
+from aws_volume_encryption_inventory import chunks
+from aws_volume_encryption_prewarm import FAST_SNAPSHOT_RESTORE_READY_STATES, FAST_SNAPSHOT_RESTORE_FAILURE_STATES, \
+    FAST_SNAPSHOT_RESTORE_TIMEOUT
+from aws_volume_encryption_ratelimit import THROTTLE_ERROR_CODES
+
+# Matches the waiters used before: snapshot_completed with 120 attempts, the others with 40, all 15 seconds apart.
+SNAPSHOT_TIMEOUT = 120 * 15
+VOLUME_TIMEOUT = 40 * 15
+INSTANCE_TIMEOUT = 40 * 15
+
+# Polls in a row that may fail outright before every pending wait is failed, and how long past a resource's own
+# timeout a wait holds on before it gives up on the poller.
+MAX_POLL_FAILURES = 5
+WAIT_MARGIN = 300
+
+
+class PollRequest:
+    def __init__(self, _kind, _resource_id, _success_states, _failure_states, _timeout):
+
+        self.kind = _kind
+        self.resource_id = _resource_id
+        self.success_states = _success_states
+        self.failure_states = _failure_states
+        self.deadline = time.time() + _timeout
+        self.state = None
+        self.future = Future()
+
+
+class StatusPoller:
+    def __init__(self, _ec2_client, _min_interval=5, _max_interval=30, _progress=None):
+
+        self.ec2_client = _ec2_client
+        self.progress = _progress
+        self.min_interval = _min_interval
+        self.max_interval = _max_interval
+        self.interval = _min_interval
+        self.api_calls = 0
+
+        self.requests = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.failures = 0
+
+    def watch(self, kind, resource_id, success_states, failure_states=(), timeout=VOLUME_TIMEOUT):
+
+        # Register a resource and return a future that resolves with its describe data.
+        request = PollRequest(kind, resource_id, success_states, failure_states, timeout)
+
+        with self.condition:
+            self.requests.append(request)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.poll_loop, name="status-poller")
+                self.thread.daemon = True
+                self.thread.start()
+
+            self.condition.notify()
+
+        return request.future
+
+    def wait(self, kind, resource_id, success_states, failure_states=(), timeout=VOLUME_TIMEOUT):
+
+        return self.result(self.watch(kind, resource_id, success_states, failure_states, timeout), timeout)
+
+    @staticmethod
+    def result(future, timeout=VOLUME_TIMEOUT):
+
+        # The poller resolves every request by its deadline; this only trips when the poller itself is gone.
+        try:
+            return future.result(timeout + WAIT_MARGIN)
+        except TimeoutError:
+            raise botocore.exceptions.WaiterError(name="status_poller", reason="Status poller stopped answering",
+                                                  last_response=None)
+
+    def wait_snapshot_completed(self, snapshot_id):
+
+        return self.wait("snapshot", snapshot_id, ["completed"], ["error"], SNAPSHOT_TIMEOUT)
+
+    def watch_volume_available(self, volume_id):
+
+        return self.watch("volume", volume_id, ["available"], ["error", "deleted"], VOLUME_TIMEOUT)
+
+    def wait_volume_available(self, volume_id):
+
+        return self.result(self.watch_volume_available(volume_id), VOLUME_TIMEOUT)
+
+    def wait_fast_snapshot_restore_enabled(self, snapshot_id, timeout=FAST_SNAPSHOT_RESTORE_TIMEOUT):
+
+        return self.wait("fast_snapshot_restore", snapshot_id, FAST_SNAPSHOT_RESTORE_READY_STATES,
+                         FAST_SNAPSHOT_RESTORE_FAILURE_STATES, timeout)
+
+    def wait_instance_stopped(self, instance_id):
+
+        return self.wait("instance", instance_id, ["stopped"], ["pending", "shutting-down", "terminated"],
+                         INSTANCE_TIMEOUT)
+
+    def wait_instance_running(self, instance_id):
+
+        return self.wait("instance", instance_id, ["running"], ["shutting-down", "terminated", "stopping"],
+                         INSTANCE_TIMEOUT)
+
+    def stop(self):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def poll_loop(self):
+
+        while True:
+            with self.condition:
+                while not self.requests and not self.stopped:
+                    self.condition.wait()
+
+                if self.stopped:
+                    return
+
+                pending = list(self.requests)
+
+            try:
+                changed = self.poll(pending)
+                self.failures = 0
+            except Exception as e:
+                # Connection errors, read timeouts and the like: keep the thread alive and back off.
+                self.failures += 1
+                print("---Status poll failed ({} in a row): {}".format(self.failures, e))
+                if self.failures >= MAX_POLL_FAILURES:
+                    for request in pending:
+                        self.resolve(request, None, "Status poll failed: {}".format(e))
+                    self.failures = 0
+                self.interval = self.max_interval
+                changed = None
+
+            # Adaptive backoff: poll quickly while things are moving, back off while nothing changes.
+            if changed:
+                self.interval = self.min_interval
+            elif changed is not None:
+                self.interval = min(self.interval * 1.5, self.max_interval)
+
+            with self.condition:
+                if not self.stopped:
+                    self.condition.wait(self.interval)
+
+    def poll(self, pending):
+
+        changed = False
+        by_kind = {}
+        for request in pending:
+            by_kind.setdefault(request.kind, []).append(request)
+
+        for kind, requests in by_kind.items():
+            resource_ids = list(set([r.resource_id for r in requests]))
+
+            try:
+                states = self.describe(kind, resource_ids)
+            except botocore.exceptions.ClientError as e:
+                if e.response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES:
+                    # Throttled: leave everything pending and slow the whole poller down.
+                    self.interval = min(self.interval * 2, self.max_interval)
+                else:
+                    for request in requests:
+                        self.resolve(request, None, "{}".format(e))
+                continue
+
+            if self.progress is not None:
+                for resource_id, (state, data) in states.items():
+                    self.progress.update(resource_id, state, data)
+
+            for request in requests:
+                if request.resource_id in states:
+                    state, data = states[request.resource_id]
+
+                    if state != request.state:
+                        request.state = state
+                        changed = True
+
+                    if state in request.success_states:
+                        self.resolve(request, data)
+                        continue
+
+                    if state in request.failure_states:
+                        self.resolve(request, data, "Waiter encountered a terminal failure state")
+                        continue
+
+                if time.time() > request.deadline:
+                    self.resolve(request, None, "Max attempts exceeded")
+
+        return changed
+
+    def resolve(self, request, data, failure_reason=None):
+
+        with self.condition:
+            if request in self.requests:
+                self.requests.remove(request)
+
+        if request.future.done():
+            return
+
+        if failure_reason is None:
+            request.future.set_result(data)
+        else:
+            request.future.set_exception(botocore.exceptions.WaiterError(
+                name="{}_{}".format(request.kind, "_".join(request.success_states)),
+                reason=failure_reason,
+                last_response=data,
+            ))
+
+    def describe(self, kind, resource_ids):
+
+        # Return {resource id: (state, describe data)} for one resource type in as few calls as possible.
+        states = {}
+
+        for chunk in chunks(resource_ids):
+            if kind == "snapshot":
+                paginator = self.ec2_client.get_paginator("describe_snapshots")
+                for page in paginator.paginate(OwnerIds=["self"], Filters=[{"Name": "snapshot-id", "Values": chunk}]):
+                    self.api_calls += 1
+                    for snapshot in page[u"Snapshots"]:
+                        states[snapshot[u"SnapshotId"]] = (snapshot[u"State"], snapshot)
+
+            elif kind == "volume":
+                paginator = self.ec2_client.get_paginator("describe_volumes")
+                for page in paginator.paginate(Filters=[{"Name": "volume-id", "Values": chunk}]):
+                    self.api_calls += 1
+                    for volume in page[u"Volumes"]:
+                        states[volume[u"VolumeId"]] = (volume[u"State"], volume)
+
+            elif kind == "instance":
+                paginator = self.ec2_client.get_paginator("describe_instances")
+                for page in paginator.paginate(Filters=[{"Name": "instance-id", "Values": chunk}]):
+                    self.api_calls += 1
+                    for reservation in page[u"Reservations"]:
+                        for instance in reservation[u"Instances"]:
+                            states[instance[u"InstanceId"]] = (instance[u"State"][u"Name"], instance)
+
+            elif kind == "fast_snapshot_restore":
+                # By snapshot id: a run only ever enables a snapshot in the one zone of its instance.
+                paginator = self.ec2_client.get_paginator("describe_fast_snapshot_restores")
+                for page in paginator.paginate(Filters=[{"Name": "snapshot-id", "Values": chunk}]):
+                    self.api_calls += 1
+                    for entry in page[u"FastSnapshotRestores"]:
+                        states[entry[u"SnapshotId"]] = (entry[u"State"], entry)
+
+            else:
+                raise Exception("ERROR: Unknown resource type {} for the status poller".format(kind))
+
+        return states
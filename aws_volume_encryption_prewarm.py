@@ -0,0 +1,117 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Pre-warm the encrypted volumes, so they run at full speed as soon as the instance is started again instead of
+    loading every block from S3 on first read.
+Params:
+    An EC2 client, the snapshot the new volume is created from and the instance's availability zone, or the ids of
+    the new volumes.
+Conditions:
+    fsr enables Fast Snapshot Restore on the encrypted snapshot in the instance's zone and waits until it's enabled
+    (fully optimized) before the volume is created; it's disabled again at cleanup, since it's billed per snapshot and
+    zone for every hour it's on.  It only applies to volumes that keep the snapshot's key, so fsr always takes the
+    copy path, and the wait counts towards the downtime (EBS optimizes about a TiB an hour).  Only a few snapshots
+    of a region can have it on at once; volumes that don't get a slot, or whose snapshot doesn't optimize in time,
+    fall back to initialization_rate.  initialization_rate creates the volume with a provisioned initialization
+    rate, which fully initializes it in a predictable time after the instance is started, and reports the progress.
+"""
+
+import time
+import botocore.exceptions
+from aws_volume_encryption_inventory import chunks
+
+PREWARM_MODES = ["none", "fsr", "initialization_rate"]
+
+# Fast Snapshot Restore states: enabling -> optimizing -> enabled.  Volumes created while it's optimizing aren't
+# fully initialized yet, so only enabled counts.
+FAST_SNAPSHOT_RESTORE_READY_STATES = ["enabled"]
+FAST_SNAPSHOT_RESTORE_FAILURE_STATES = ["disabling", "disabled"]
+FAST_SNAPSHOT_RESTORE_TIMEOUT = 4 * 3600
+FAST_SNAPSHOT_RESTORE_POLL_INTERVAL = 15
+
+# Snapshots a region can have Fast Snapshot Restore on at once (the default EBS quota).
+MAX_FAST_SNAPSHOT_RESTORES = 5
+
+# About how long a snapshot takes to optimize, per GiB, when no earlier run says otherwise.
+FAST_SNAPSHOT_RESTORE_SECONDS_PER_GIB = 3600.0 / 1024
+
+# Volume initialization rates EBS accepts, in MiB/s.
+MIN_INITIALIZATION_RATE = 100
+MAX_INITIALIZATION_RATE = 300
+
+# How often initialization progress is looked at without a status poller, and how long past the expected time it's
+# waited for.
+INITIALIZATION_POLL_INTERVAL = 30
+INITIALIZATION_TIMEOUT_MARGIN = 3600
+
+
+def initialization_seconds(size_gib, rate):
+
+    # How long a volume created with an initialization rate takes to be fully initialized.
+    return size_gib * 1024.0 / rate
+
+
+def enable_fast_snapshot_restore(ec2_client, snapshot_id, availability_zone):
+
+    response = ec2_client.enable_fast_snapshot_restores(AvailabilityZones=[availability_zone],
+                                                        SourceSnapshotIds=[snapshot_id])
+    errors = []
+    for unsuccessful in response.get("Unsuccessful", []):
+        for state_error in unsuccessful.get("FastSnapshotRestoreStateErrors", []):
+            errors.append("{} ({})".format(state_error["Error"].get("Message"), state_error["Error"].get("Code")))
+    if errors:
+        raise Exception("ERROR: Can't enable fast snapshot restore on {} in {}: {}".format(
+            snapshot_id, availability_zone, "; ".join(errors)))
+
+
+def disable_fast_snapshot_restore(ec2_client, snapshot_id, availability_zone):
+
+    # Best effort: a snapshot that's being deleted loses fast snapshot restore anyway.
+    try:
+        ec2_client.disable_fast_snapshot_restores(AvailabilityZones=[availability_zone],
+                                                  SourceSnapshotIds=[snapshot_id])
+    except botocore.exceptions.ClientError as e:
+        print("---Can't disable fast snapshot restore on {} in {}: {}".format(snapshot_id, availability_zone, e))
+
+
+def fast_snapshot_restore_state(ec2_client, snapshot_id, availability_zone):
+
+    paginator = ec2_client.get_paginator("describe_fast_snapshot_restores")
+    pages = paginator.paginate(Filters=[{"Name": "snapshot-id", "Values": [snapshot_id]},
+                                        {"Name": "availability-zone", "Values": [availability_zone]}])
+    for page in pages:
+        for entry in page["FastSnapshotRestores"]:
+            return entry["State"], entry
+    return None, None
+
+
+def wait_fast_snapshot_restore(ec2_client, snapshot_id, availability_zone, timeout=FAST_SNAPSHOT_RESTORE_TIMEOUT,
+                               poll_interval=FAST_SNAPSHOT_RESTORE_POLL_INTERVAL):
+
+    # There's no waiter for it; fails with a WaiterError like one would.
+    deadline = time.time() + timeout
+    while True:
+        state, entry = fast_snapshot_restore_state(ec2_client, snapshot_id, availability_zone)
+        if state in FAST_SNAPSHOT_RESTORE_READY_STATES:
+            return entry
+        if state in FAST_SNAPSHOT_RESTORE_FAILURE_STATES:
+            raise botocore.exceptions.WaiterError(name="fast_snapshot_restore_enabled",
+                                                  reason="Waiter encountered a terminal failure state",
+                                                  last_response=entry)
+        if time.time() > deadline:
+            raise botocore.exceptions.WaiterError(name="fast_snapshot_restore_enabled",
+                                                  reason="Max attempts exceeded", last_response=entry)
+        time.sleep(poll_interval)
+
+
+def initialization_progress(ec2_client, volume_ids):
+
+    # {volume id: (percent initialized, estimated seconds left)} from the volume status, None where EBS doesn't say.
+    progress = {}
+    for chunk in chunks(list(volume_ids)):
+        statuses = ec2_client.describe_volume_status(VolumeIds=chunk)["VolumeStatuses"]
+        for status in statuses:
+            details = status.get("InitializationStatusDetails") or {}
+            progress[status["VolumeId"]] = (details.get("Progress"), details.get("EstimatedTimeToCompleteInSeconds"))
+    return progress
@@ -0,0 +1,319 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Live progress of the snapshots, copies and volumes a run is waiting on, with throughput and an ETA per resource
+    and for the whole run, so a stuck copy shows up in minutes instead of when its waiter gives up hours later.
+Params:
+    The output mode (auto, live, events or off), how often events are written and how long a snapshot may sit at the
+    same percentage before it's called stalled.
+Conditions:
+    The status poller hands every describe result to update(); the encrypter says which resources it's waiting on
+    and for which phase with track() and done().  live redraws one consolidated view at the bottom of the terminal
+    and prints the run's log above it; events writes one JSON line per interval instead, for when there's no TTY.
+    auto picks live when stderr is a terminal.  The run ETA is the snapshot GiB still to go over the snapshot GiB done
+    per second so far, so it only settles once the first snapshots have made progress.
+"""
+
+import json
+import sys
+import threading
+import time
+from aws_volume_encryption_scheduler import format_duration
+
+PROGRESS_MODES = ["auto", "live", "events", "off"]
+
+# Phases that move a volume's data, counted towards the run's GiB done.
+SNAPSHOT_PHASES = ["snapshot", "incremental_snapshot"]
+
+# How often the live view is redrawn, and the most resources it lists (the slowest first).
+LIVE_REFRESH_SECONDS = 1
+LIVE_MAX_ROWS = 20
+
+ANSI_CLEAR_LINES = "\033[{}F\033[J"
+
+
+def parse_percent(progress):
+
+    # Snapshot Progress is a string like "45%", empty until EBS reports any.
+    try:
+        return float((progress or "").rstrip("%"))
+    except ValueError:
+        return None
+
+
+class ProgressItem:
+    def __init__(self, _resource_id, _kind, _phase, _labels):
+
+        self.resource_id = _resource_id
+        self.kind = _kind
+        self.phase = _phase
+        self.labels = _labels
+        self.size_gib = _labels.get("size_gib") or 0
+        self.started_at = time.time()
+        self.state = None
+        self.percent = None
+        self.first_percent = None
+        self.first_percent_at = None
+        self.changed_at = self.started_at
+        self.stall_reported = False
+
+    def gib_done(self):
+
+        return self.size_gib * (self.percent or 0) / 100.0
+
+    def eta_seconds(self, now):
+
+        # From the rate since the percentage was first seen, so a snapshot picked up halfway isn't counted as fast.
+        if self.percent is None or self.first_percent_at is None or self.percent <= self.first_percent:
+            return None
+        rate = (self.percent - self.first_percent) / max(now - self.first_percent_at, 1e-6)
+        return (100.0 - self.percent) / rate
+
+    def throughput_mib(self, now):
+
+        if self.percent is None or self.first_percent_at is None or self.percent <= self.first_percent:
+            return None
+        mib = self.size_gib * 1024.0 * (self.percent - self.first_percent) / 100.0
+        return mib / max(now - self.first_percent_at, 1e-6)
+
+    def report(self, now, stall_seconds):
+
+        eta = self.eta_seconds(now)
+        throughput = self.throughput_mib(now)
+        return {
+            "resource_id": self.resource_id,
+            "kind": self.kind,
+            "phase": self.phase,
+            "instance_id": self.labels.get("instance_id"),
+            "volume_id": self.labels.get("volume_id"),
+            "size_gib": self.size_gib,
+            "state": self.state,
+            "percent": self.percent,
+            "elapsed_seconds": round(now - self.started_at, 1),
+            "throughput_mib_per_second": round(throughput, 1) if throughput is not None else None,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "stalled": now - self.changed_at >= stall_seconds,
+        }
+
+
+class LiveOutput:
+
+    # Stands in for stdout while the live view is up, so the log scrolls above the view instead of through it.
+    def __init__(self, _tracker, _stream):
+
+        self.tracker = _tracker
+        self.stream = _stream
+
+    def write(self, text):
+
+        self.tracker.write_above(text)
+
+    def flush(self):
+
+        self.stream.flush()
+
+
+class ProgressTracker:
+    def __init__(self, _mode="auto", _interval=30, _stall_seconds=900, _stream=None):
+
+        self.stream = _stream or sys.stderr
+        self.interval = _interval
+        self.stall_seconds = _stall_seconds
+
+        if _mode == "auto":
+            is_tty = getattr(self.stream, "isatty", None)
+            _mode = "live" if is_tty is not None and is_tty() else "events"
+        self.mode = _mode
+
+        self.items = {}
+        self.started_at = time.time()
+        self.expected_gib = 0
+        self.snapshotted_gib = 0
+        self.finished = 0
+        self.failed = 0
+
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.thread = None
+        self.stopped = False
+        self.live_lines = 0
+        self.stdout = None
+
+    def start(self):
+
+        if self.mode == "off":
+            return
+
+        if self.mode == "live":
+            self.stdout = sys.stdout
+            sys.stdout = LiveOutput(self, self.stdout)
+
+        self.thread = threading.Thread(target=self.render_loop, name="progress")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+
+        if self.thread is None:
+            return
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+        # One last view or event with the final totals.
+        self.render()
+        if self.stdout is not None:
+            sys.stdout = self.stdout
+            self.stdout = None
+
+    def expect(self, gib):
+
+        # GiB the run is going to snapshot, as far as it's known up front.
+        with self.lock:
+            self.expected_gib += gib
+
+    def track(self, resource_id, kind, phase, **labels):
+
+        with self.lock:
+            self.items[resource_id] = ProgressItem(resource_id, kind, phase, labels)
+
+    def update(self, resource_id, state, data):
+
+        # Called by the status poller with every describe result; resources nobody tracks are ignored.
+        now = time.time()
+        with self.lock:
+            item = self.items.get(resource_id)
+            if item is None:
+                return
+
+            percent = parse_percent(data.get("Progress")) if item.kind == "snapshot" else None
+            if state != item.state or (percent is not None and percent != item.percent):
+                item.changed_at = now
+                item.stall_reported = False
+            item.state = state
+
+            if percent is not None:
+                if item.first_percent is None:
+                    item.first_percent = percent
+                    item.first_percent_at = now
+                item.percent = percent
+
+            stalled = not item.stall_reported and now - item.changed_at >= self.stall_seconds
+            if stalled:
+                item.stall_reported = True
+
+        if stalled:
+            print("---{} {} of volume {} on {} hasn't moved from {} in {}".format(
+                item.phase, resource_id, item.labels.get("volume_id"), item.labels.get("instance_id"),
+                "{:.0f}%".format(item.percent) if item.percent is not None else item.state,
+                format_duration(now - item.changed_at)))
+
+    def done(self, resource_id, status="ok"):
+
+        with self.lock:
+            item = self.items.pop(resource_id, None)
+            if item is None:
+                return
+
+            if status == "ok":
+                self.finished += 1
+                if item.phase in SNAPSHOT_PHASES:
+                    self.snapshotted_gib += item.size_gib
+            else:
+                self.failed += 1
+
+    def summary(self, now=None):
+
+        now = now or time.time()
+        with self.lock:
+            items = [item.report(now, self.stall_seconds) for item in self.items.values()]
+            gib_done = self.snapshotted_gib + sum([item.gib_done() for item in self.items.values()
+                                                   if item.phase in SNAPSHOT_PHASES])
+            gib_in_flight = sum([item.size_gib for item in self.items.values() if item.phase in SNAPSHOT_PHASES])
+            total_gib = max(self.expected_gib, self.snapshotted_gib + gib_in_flight)
+            finished = self.finished
+            failed = self.failed
+
+        elapsed = now - self.started_at
+        throughput = gib_done / elapsed if elapsed > 0 else 0
+        eta = (total_gib - gib_done) / throughput if throughput > 0 else None
+
+        return {
+            "event": "progress",
+            "time": now,
+            "elapsed_seconds": round(elapsed, 1),
+            "gib_done": round(gib_done, 1),
+            "gib_total": round(total_gib, 1),
+            "throughput_mib_per_second": round(throughput * 1024, 1),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "in_flight": len(items),
+            "finished": finished,
+            "failed": failed,
+            "stalled": len([item for item in items if item["stalled"]]),
+            "items": sorted(items, key=lambda item: -(item["eta_seconds"] or item["elapsed_seconds"])),
+        }
+
+    def render_loop(self):
+
+        refresh = LIVE_REFRESH_SECONDS if self.mode == "live" else self.interval
+        while True:
+            with self.condition:
+                if not self.stopped:
+                    self.condition.wait(refresh)
+                if self.stopped:
+                    return
+            self.render()
+
+    def render(self):
+
+        summary = self.summary()
+        with self.lock:
+            if self.mode == "live":
+                self.clear_live()
+                lines = self.live_view(summary)
+                self.stream.write("\n".join(lines) + "\n")
+                self.live_lines = len(lines)
+            else:
+                self.stream.write(json.dumps(summary, sort_keys=True) + "\n")
+            self.stream.flush()
+
+    def write_above(self, text):
+
+        # Log text goes above the live view, which is drawn again under it on the next refresh.
+        with self.lock:
+            self.clear_live()
+            self.stream.write(text)
+
+    def clear_live(self):
+
+        if self.live_lines:
+            self.stream.write(ANSI_CLEAR_LINES.format(self.live_lines))
+            self.live_lines = 0
+
+    @staticmethod
+    def live_view(summary):
+
+        lines = ["====Progress: {} of {} GiB snapshotted, {} MiB/s, ETA {} | {} in flight, {} done, {} failed, "
+                 "{} stalled | {}".format(summary["gib_done"], summary["gib_total"],
+                                          summary["throughput_mib_per_second"],
+                                          format_duration(summary["eta_seconds"])
+                                          if summary["eta_seconds"] is not None else "unknown",
+                                          summary["in_flight"], summary["finished"], summary["failed"],
+                                          summary["stalled"], format_duration(summary["elapsed_seconds"]))]
+
+        for item in summary["items"][:LIVE_MAX_ROWS]:
+            lines.append("    {:<20} {:<22} {:<20} {:<24} {:>6} GiB {:>5} {:>9} {:>10}{}".format(
+                item["instance_id"] or "", item["resource_id"], item["volume_id"] or "", item["phase"],
+                item["size_gib"],
+                "{:.0f}%".format(item["percent"]) if item["percent"] is not None else (item["state"] or "-"),
+                "{} MiB/s".format(item["throughput_mib_per_second"])
+                if item["throughput_mib_per_second"] is not None else "",
+                format_duration(item["eta_seconds"]) if item["eta_seconds"] is not None else "",
+                "  STALLED" if item["stalled"] else ""))
+
+        if len(summary["items"]) > LIVE_MAX_ROWS:
+            lines.append("    ... and {} more".format(len(summary["items"]) - LIVE_MAX_ROWS))
+        return lines
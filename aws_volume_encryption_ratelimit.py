@@ -0,0 +1,128 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Client-side token buckets per EC2 API action category, shared by every thread calling the same account and
+    region, that slow down when EC2 throttles and speed back up while it doesn't.
+Params:
+    Requests per second and bucket size for each category ("describe" and "mutate", as EC2 meters them).
+Conditions:
+    Hooks into botocore's before-send and needs-retry events, so every attempt (retries included) takes a token and
+    every throttled attempt halves the rate of its category (additive increase, multiplicative decrease).  The rate
+    never goes above the configured one, which should be the account's limit.
+"""
+
+import threading
+import time
+
+# Error codes that mean slow down rather than fail.
+THROTTLE_ERROR_CODES = ["RequestLimitExceeded", "Throttling", "ThrottlingException"]
+
+# EC2 meters non-mutating actions separately from mutating ones.
+DESCRIBE_PREFIXES = ("Describe", "Get", "List")
+
+# Multiplicative decrease on a throttle, and the share of the configured rate won back per second without one.
+DECREASE_FACTOR = 0.5
+RECOVERY_PER_SECOND = 0.05
+
+# Never slow a category below this many requests per second.
+MIN_RATE = 0.2
+
+
+def action_category(operation_name):
+
+    if operation_name.startswith(DESCRIBE_PREFIXES):
+        return "describe"
+    return "mutate"
+
+
+class TokenBucket:
+    def __init__(self, _rate, _burst, _clock=time.time, _sleep=time.sleep):
+
+        self.max_rate = float(_rate)
+        self.rate = float(_rate)
+        self.burst = float(_burst)
+        self.tokens = float(_burst)
+        self.clock = _clock
+        self.sleep = _sleep
+        self.lock = threading.Lock()
+        self.updated_at = _clock()
+        self.throttles = 0
+        self.waited_seconds = 0.0
+
+    def refill(self, now):
+
+        # Called under the lock.  Tokens come back at the current rate, and the rate creeps back up to the maximum.
+        elapsed = max(0.0, now - self.updated_at)
+        self.updated_at = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.rate = min(self.max_rate, self.rate + elapsed * self.max_rate * RECOVERY_PER_SECOND)
+
+    def acquire(self):
+
+        # Take a token, waiting for it when the bucket is empty.  Tokens can go negative: each waiter reserves its
+        # own, so callers are served in the order they came in.
+        with self.lock:
+            self.refill(self.clock())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited_seconds += wait
+
+        if wait > 0:
+            self.sleep(wait)
+
+    def throttled(self):
+
+        with self.lock:
+            self.refill(self.clock())
+            self.throttles += 1
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    def __init__(self, _limits, _clock=time.time, _sleep=time.sleep):
+
+        # _limits: {"describe": (rate, burst), "mutate": (rate, burst)}.  Categories left out, or with a rate of 0,
+        # are not limited.
+        self.buckets = {}
+        for category, (rate, burst) in (_limits or {}).items():
+            if rate:
+                self.buckets[category] = TokenBucket(rate, max(1, burst), _clock=_clock, _sleep=_sleep)
+
+    def attach(self, client):
+
+        # Limit every call of a botocore client, and of the client behind a resource.
+        client.meta.events.register("before-send.ec2", self.before_send)
+        client.meta.events.register("needs-retry.ec2", self.needs_retry)
+        return client
+
+    def bucket(self, event_name):
+
+        # Event names end in the operation name, e.g. before-send.ec2.DescribeInstances.
+        return self.buckets.get(action_category(event_name.split(".")[-1]))
+
+    def before_send(self, event_name, **kwargs):
+
+        bucket = self.bucket(event_name)
+        if bucket is not None:
+            bucket.acquire()
+
+    def needs_retry(self, event_name, response=None, **kwargs):
+
+        # Only looks at the response; botocore's own retry handler still decides on the retry.
+        if response is None:
+            return None
+
+        parsed = response[1] or {}
+        if parsed.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES:
+            bucket = self.bucket(event_name)
+            if bucket is not None:
+                bucket.throttled()
+        return None
+
+    def stats(self):
+
+        return dict([(category, {"rate": round(b.rate, 2), "throttles": b.throttles,
+                                 "waited_seconds": round(b.waited_seconds, 1)})
+                     for category, b in self.buckets.items()])
@@ -0,0 +1,133 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Machine-readable run report: every instance's result with the old and new id, device, KMS key, type and
+    performance and phase timings of each of its volumes, written out as the instances finish.
+Params:
+    The report path.  A .csv path gets CSV, anything else JSON.
+Conditions:
+    JSON is one array of instance results, each holding its volumes.  CSV is one row per volume, with the instance
+    columns repeated, and one row with empty volume columns for an instance that has no volumes to show (skipped,
+    not found, or failed before any volume was worked on).  Errors of the instance itself are on each of its rows.
+    Each result is flushed as soon as it's written, so a killed run still leaves every finished instance on disk;
+    only the closing bracket of the JSON is missing then.
+"""
+
+import csv
+import json
+import threading
+
+REPORT_FORMATS = ["json", "csv"]
+
+CSV_COLUMNS = ["RunId", "Profile", "Region", "InstanceId", "InstanceName", "InstanceStatus", "DowntimeSeconds",
+               "DeviceName", "VolumeId", "NewVolumeId", "Status", "KmsKeyId", "NewKmsKeyId", "VolumeType",
+               "NewVolumeType", "SizeGiB", "Iops", "NewIops", "Throughput", "NewThroughput", "EncryptionPath",
+               "Prewarm", "BaseSnapshotId", "SnapshotBytesSaved", "PhaseSeconds", "Errors"]
+
+
+def report_format(path):
+
+    if path.lower().endswith(".csv"):
+        return "csv"
+    return "json"
+
+
+def format_phase_seconds(phase_seconds):
+
+    # "copy=120.5;snapshot=300.1", sorted so rows compare.
+    return ";".join(["{}={}".format(phase, seconds) for phase, seconds in sorted((phase_seconds or {}).items())])
+
+
+def csv_rows(result):
+
+    # One row per volume of an InstanceResult.
+    instance = {
+        "RunId": result.run_id,
+        "Profile": result.profile,
+        "Region": result.region,
+        "InstanceId": result.instance_id,
+        "InstanceName": result.instance_name,
+        "InstanceStatus": result.status,
+        "DowntimeSeconds": round(result.downtime_seconds, 1) if result.downtime_seconds is not None else None,
+    }
+
+    if not result.volumes:
+        row = dict(instance)
+        row["PhaseSeconds"] = format_phase_seconds(result.phase_seconds)
+        row["Errors"] = "; ".join(result.errors)
+        return [row]
+
+    # Errors of the instance rather than of one volume (a failed start, a volume that couldn't be reattached) go on
+    # every row, so they aren't lost once the instance has volumes.
+    volume_errors = [volume["Error"] for volume in result.volumes if volume["Error"]]
+    instance_errors = [error for error in result.errors if not any([error in v for v in volume_errors])]
+
+    rows = []
+    for volume in result.volumes:
+        before = volume.get("Before") or {}
+        after = volume.get("After") or {}
+        row = dict(instance)
+        row.update({
+            "DeviceName": volume["DeviceName"],
+            "VolumeId": volume["VolumeId"],
+            "NewVolumeId": volume["NewVolumeId"],
+            "Status": volume["Status"],
+            "KmsKeyId": volume["KmsKeyId"],
+            "NewKmsKeyId": volume["NewKmsKeyId"],
+            "VolumeType": before.get("VolumeType"),
+            "NewVolumeType": after.get("VolumeType"),
+            "SizeGiB": volume["SizeGiB"],
+            "Iops": before.get("Iops"),
+            "NewIops": after.get("Iops"),
+            "Throughput": before.get("Throughput"),
+            "NewThroughput": after.get("Throughput"),
+            "EncryptionPath": volume["EncryptionPath"],
+            "Prewarm": volume["Prewarm"],
+            "BaseSnapshotId": volume["BaseSnapshotId"],
+            "SnapshotBytesSaved": volume["SnapshotBytesSaved"],
+            "PhaseSeconds": format_phase_seconds(volume["PhaseSeconds"]),
+            "Errors": "; ".join([error for error in [volume["Error"]] + instance_errors if error]),
+        })
+        rows.append(row)
+    return rows
+
+
+class ReportWriter:
+    def __init__(self, _path, _format=None):
+
+        self.path = _path
+        self.format = _format or report_format(_path)
+        self.lock = threading.Lock()
+        self.results = 0
+
+        self.report_file = open(_path, "w")
+        if self.format == "csv":
+            self.writer = csv.DictWriter(self.report_file, fieldnames=CSV_COLUMNS, lineterminator="\n")
+            self.writer.writeheader()
+        else:
+            self.writer = None
+            self.report_file.write("[")
+        self.report_file.flush()
+
+    def write(self, result):
+
+        # Called from the worker threads as instances finish.
+        with self.lock:
+            if self.format == "csv":
+                for row in csv_rows(result):
+                    self.writer.writerow(row)
+            else:
+                if self.results:
+                    self.report_file.write(",")
+                self.report_file.write("\n" + json.dumps(result.to_dict(), sort_keys=True, default=str))
+            self.results += 1
+            self.report_file.flush()
+
+    def close(self):
+
+        with self.lock:
+            if self.format == "json":
+                self.report_file.write("\n]\n")
+            self.report_file.close()
+        print("****Report of {} instances written to {}".format(self.results, self.path))
@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Longest-job-first ordering of the instances of a run, from estimates based on their volume sizes.
+Params:
+    (job, estimated seconds) pairs and the number of worker slots they run on.
+Conditions:
+    The orchestrator hands jobs to free slots in the order given, so sorting the longest first is LPT list
+    scheduling, which finishes within 4/3 of the best possible makespan.  The estimates only need to rank the jobs.
+"""
+
+import heapq
+
+
+def longest_first(jobs):
+
+    # Sort (job, seconds) pairs longest first.  Ties keep their given order.
+    return sorted(jobs, key=lambda job: job[1], reverse=True)
+
+
+def makespan(durations, slots):
+
+    # Expected total run time when the durations are handed, in order, to whichever of the slots frees up first.
+    loads = [0.0] * max(1, min(slots, len(durations)))
+    for duration in durations:
+        heapq.heappush(loads, heapq.heappop(loads) + duration)
+    return max(loads) if durations else 0.0
+
+
+def lower_bound(durations, slots):
+
+    # No schedule finishes before its longest job or before the work is spread evenly over every slot.
+    if not durations:
+        return 0.0
+    return max(max(durations), sum(durations) / float(max(1, min(slots, len(durations)))))
+
+
+class JobEstimator:
+    def __init__(self, _seconds_per_gib, _overhead_seconds, _copy_seconds_per_gib=0, _max_volume_workers=1):
+
+        self.seconds_per_gib = _seconds_per_gib
+        self.overhead_seconds = _overhead_seconds
+        self.copy_seconds_per_gib = _copy_seconds_per_gib
+        self.max_volume_workers = _max_volume_workers
+
+    def estimate(self, volume_sizes, copies=None):
+
+        # Stop, swap and start cost about the same for every instance; the snapshots (and copies) grow with size.
+        # copies says, volume by volume, which ones take the encrypted snapshot copy.
+        if not volume_sizes:
+            return 0.0
+
+        copies = copies or [False] * len(volume_sizes)
+        volume_seconds = []
+        for size, copy in zip(volume_sizes, copies):
+            per_gib = self.seconds_per_gib
+            if copy:
+                per_gib += self.copy_seconds_per_gib
+            volume_seconds.append(size * per_gib)
+
+        # The volumes of one instance share its volume workers the same way instances share the worker slots.
+        volumes = sorted(volume_seconds, reverse=True)
+        return self.overhead_seconds + makespan(volumes, self.max_volume_workers)
+
+
+def format_duration(seconds):
+
+    hours, remainder = divmod(int(round(seconds)), 3600)
+    return "{}h{:02d}m{:02d}s".format(hours, remainder // 60, remainder % 60)
@@ -0,0 +1,148 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    Find the snapshots and volumes runs left behind, by the run id tag every created resource carries, and delete
+    them in parallel.
+Params:
+    An EC2 client (behind the run's rate limiter), optionally the run ids to sweep, a minimum age and the resource
+    ids an unfinished journal entry still needs.
+Conditions:
+    Only resources with the run id tag are ever touched: snapshots in any state, volumes only while they're not
+    attached.  The tag comes off the encrypted volume once it's attached and off snapshots kept with keep_snapshots,
+    so what a run is meant to leave behind is never swept.  Resources younger than the minimum age (a run that may
+    still be going) and resources a --resume would pick up again are left alone.
+"""
+
+import calendar
+import time
+import uuid
+import botocore.exceptions
+from aws_volume_encryption_inventory import chunks
+from concurrent.futures import ThreadPoolExecutor
+
+# Tags every snapshot and volume a run creates carries until it's meant to stay.
+RUN_TAG_KEY = "aws_volume_encryption:run-id"
+INSTANCE_TAG_KEY = "aws_volume_encryption:instance-id"
+
+# Volumes that can be deleted; attached ones are never swept.
+SWEPT_VOLUME_STATES = ["available", "error"]
+
+# Errors that mean the resource is already gone, and ones that mean it's still in use by something else.
+GONE_ERROR_CODES = ["InvalidSnapshot.NotFound", "InvalidVolume.NotFound"]
+IN_USE_ERROR_CODES = ["InvalidSnapshot.InUse", "VolumeInUse", "IncorrectState"]
+
+
+def new_run_id():
+
+    # Sorts by start time, and is unique enough for runs started the same second.
+    return "{}-{}".format(time.strftime("%Y%m%dT%H%M%S", time.gmtime()), uuid.uuid4().hex[:8])
+
+
+def run_tags(run_id, instance_id):
+
+    return [{"Key": RUN_TAG_KEY, "Value": run_id}, {"Key": INSTANCE_TAG_KEY, "Value": instance_id}]
+
+
+def created_at(resource):
+
+    # Snapshots have a StartTime, volumes a CreateTime; both datetimes from boto3.
+    created = resource.get("StartTime") or resource.get("CreateTime")
+    if hasattr(created, "utctimetuple"):
+        created = calendar.timegm(created.utctimetuple())
+    return created
+
+
+class Sweeper:
+    def __init__(self, _ec2_client, _run_ids=None, _min_age_hours=1, _protected_ids=None, _max_workers=10):
+
+        self.ec2_client = _ec2_client
+        self.run_ids = list(_run_ids or [])
+        self.min_age_seconds = _min_age_hours * 3600
+        self.protected_ids = set(_protected_ids or [])
+        self.max_workers = _max_workers
+        self.api_calls = 0
+
+    def find(self):
+
+        # Every leftover of the runs asked for (all runs when none were), with batched, paginated describes.
+        if self.run_ids:
+            run_filters = [{"Name": "tag:{}".format(RUN_TAG_KEY), "Values": chunk} for chunk in chunks(self.run_ids)]
+        else:
+            run_filters = [{"Name": "tag-key", "Values": [RUN_TAG_KEY]}]
+
+        leftovers = []
+        snapshot_paginator = self.ec2_client.get_paginator("describe_snapshots")
+        volume_paginator = self.ec2_client.get_paginator("describe_volumes")
+
+        for run_filter in run_filters:
+            for page in snapshot_paginator.paginate(OwnerIds=["self"], Filters=[run_filter]):
+                self.api_calls += 1
+                leftovers += [self.leftover("snapshot", s["SnapshotId"], s["VolumeSize"], s) for s in page["Snapshots"]]
+
+            volume_filters = [run_filter, {"Name": "status", "Values": SWEPT_VOLUME_STATES}]
+            for page in volume_paginator.paginate(Filters=volume_filters):
+                self.api_calls += 1
+                leftovers += [self.leftover("volume", v["VolumeId"], v["Size"], v) for v in page["Volumes"]]
+
+        now = time.time()
+        swept = []
+        for leftover in leftovers:
+            if leftover["Id"] in self.protected_ids:
+                print("---Keeping {} {}, an unfinished journal entry needs it (run with --resume to finish it)".format(
+                    leftover["Type"], leftover["Id"]))
+            elif self.min_age_seconds and leftover["CreatedAt"] is not None and \
+                    now - leftover["CreatedAt"] < self.min_age_seconds:
+                print("---Keeping {} {} of run {}, it's newer than the minimum age".format(
+                    leftover["Type"], leftover["Id"], leftover["RunId"]))
+            else:
+                swept.append(leftover)
+        return swept
+
+    @staticmethod
+    def leftover(resource_type, resource_id, size, resource):
+
+        tags = dict([(t["Key"], t["Value"]) for t in resource.get("Tags", [])])
+        return {
+            "Type": resource_type,
+            "Id": resource_id,
+            "SizeGiB": size,
+            "State": resource.get("State"),
+            "RunId": tags.get(RUN_TAG_KEY),
+            "InstanceId": tags.get(INSTANCE_TAG_KEY),
+            "CreatedAt": created_at(resource),
+        }
+
+    def delete(self, leftovers):
+
+        # The deletes run side by side; the client's rate limiter keeps them under the account's API limits.
+        results = {"deleted": [], "in_use": [], "failed": []}
+        executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        try:
+            futures = [(leftover, executor.submit(self.delete_one, leftover)) for leftover in leftovers]
+            for leftover, future in futures:
+                outcome = future.result()
+                results[outcome].append(leftover["Id"])
+        finally:
+            executor.shutdown(wait=True)
+        return results
+
+    def delete_one(self, leftover):
+
+        try:
+            if leftover["Type"] == "snapshot":
+                self.ec2_client.delete_snapshot(SnapshotId=leftover["Id"])
+            else:
+                self.ec2_client.delete_volume(VolumeId=leftover["Id"])
+        except botocore.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            if code in GONE_ERROR_CODES:
+                return "deleted"
+            if code in IN_USE_ERROR_CODES:
+                print("---{} {} is in use, leaving it: {}".format(leftover["Type"], leftover["Id"], e))
+                return "in_use"
+            print("ERROR: Can't delete {} {}: {}".format(leftover["Type"], leftover["Id"], e))
+            return "failed"
+
+        print("---Deleted {} {} of run {}".format(leftover["Type"], leftover["Id"], leftover["RunId"]))
+        return "deleted"
@@ -0,0 +1,122 @@
+#! /usr/bin/python
+
+"""
+Overview:
+    The volume type, size, IOPS and throughput the new encrypted volume is created with, so it performs at least as
+    well as the volume it replaces.
+Params:
+    The original volume's type, size, IOPS and throughput, plus force_volume_type and the gp2 to gp3 upgrade policy.
+Conditions:
+    By default the new volume keeps the original's type, size, provisioned IOPS (io1, io2, gp3) and throughput (gp3).
+    A forced type keeps whatever of them the new type can be given at the volume's size.  With gp2_to_gp3 a gp2
+    volume comes back as gp3 with the IOPS and throughput of its gp2 burst baseline or better: at least the 3000 IOPS
+    gp2 bursts to, 3 IOPS per GiB above that, and the 128 or 250 MiB/s gp2 gives at its size.  IOPS and throughput
+    are only passed where the type takes them, since EBS rejects them on the others.
+"""
+
+# Types whose IOPS can be provisioned, and the ones whose throughput can.
+PROVISIONED_IOPS_TYPES = ["io1", "io2", "gp3"]
+PROVISIONED_THROUGHPUT_TYPES = ["gp3"]
+
+# gp2: 3 IOPS per GiB up to 16000, bursting to 3000.  128 MiB/s up to 170 GiB, 250 MiB/s from there on.
+GP2_IOPS_PER_GIB = 3
+GP2_MAX_IOPS = 16000
+GP2_BURST_IOPS = 3000
+GP2_SMALL_VOLUME_GIB = 170
+GP2_SMALL_VOLUME_THROUGHPUT = 128
+GP2_MAX_THROUGHPUT = 250
+
+# gp3: 3000 IOPS and 125 MiB/s included, up to 16000 IOPS (500 per GiB) and 1000 MiB/s (0.25 MiB/s per IOPS).
+GP3_BASELINE_IOPS = 3000
+GP3_BASELINE_THROUGHPUT = 125
+GP3_MAX_IOPS = 16000
+GP3_MAX_IOPS_PER_GIB = 500
+GP3_MAX_THROUGHPUT = 1000
+GP3_MAX_THROUGHPUT_PER_IOPS = 0.25
+
+# io1 and io2 IOPS bounds, overall and per GiB.
+IO_MIN_IOPS = 100
+IO_MAX_IOPS = {"io1": 64000, "io2": 256000}
+IO_MAX_IOPS_PER_GIB = {"io1": 50, "io2": 500}
+
+
+def gp2_baseline(size_gib):
+
+    # (IOPS, MiB/s) a gp2 volume of this size gives, counting the burst it can sustain for hours.
+    iops = max(GP2_BURST_IOPS, min(GP2_MAX_IOPS, GP2_IOPS_PER_GIB * size_gib))
+    if size_gib <= GP2_SMALL_VOLUME_GIB:
+        throughput = GP2_SMALL_VOLUME_THROUGHPUT
+    else:
+        throughput = GP2_MAX_THROUGHPUT
+    return iops, throughput
+
+
+def gp3_settings(size_gib, iops, throughput):
+
+    # gp3 IOPS and throughput of at least the included baseline, within what gp3 allows at this size.
+    iops = max(GP3_BASELINE_IOPS, min(iops or 0, GP3_MAX_IOPS, GP3_MAX_IOPS_PER_GIB * size_gib))
+    throughput = max(GP3_BASELINE_THROUGHPUT, min(throughput or 0, GP3_MAX_THROUGHPUT,
+                                                  int(iops * GP3_MAX_THROUGHPUT_PER_IOPS)))
+    return iops, throughput
+
+
+def io_iops(volume_type, size_gib, iops):
+
+    # io1 or io2 IOPS as close to iops as the type allows at this size, e.g. a forced io1 from a small gp2 volume
+    # can't keep the 3000 IOPS gp2 bursts to.
+    return max(IO_MIN_IOPS, min(iops or IO_MIN_IOPS, IO_MAX_IOPS[volume_type],
+                                IO_MAX_IOPS_PER_GIB[volume_type] * size_gib))
+
+
+def performance_settings(volume_type, size_gib, iops, throughput):
+
+    # What the report shows of a volume.
+    return {"VolumeType": volume_type, "SizeGiB": size_gib, "Iops": iops, "Throughput": throughput}
+
+
+def describe_performance(settings):
+
+    # "gp3 100 GiB, 3000 IOPS, 125 MiB/s"
+    parts = ["{} {} GiB".format(settings["VolumeType"], settings["SizeGiB"])]
+    if settings["Iops"]:
+        parts.append("{} IOPS".format(settings["Iops"]))
+    if settings["Throughput"]:
+        parts.append("{} MiB/s".format(settings["Throughput"]))
+    return ", ".join(parts)
+
+
+def target_settings(volume_type, size_gib, iops, throughput, force_volume_type="", gp2_to_gp3=False):
+
+    # The performance settings of the new volume, as performance_settings.  Iops and Throughput are None where the
+    # type doesn't take them.
+    new_type = force_volume_type or volume_type
+    if gp2_to_gp3 and new_type == "gp2":
+        new_type = "gp3"
+
+    # Nothing to provision: the new volume performs like the original by its type and size alone.
+    if new_type == volume_type and new_type not in PROVISIONED_IOPS_TYPES:
+        return performance_settings(volume_type, size_gib, iops, throughput)
+
+    # A gp2 volume's IOPS and throughput are what its size gives it.
+    if volume_type == "gp2":
+        iops, throughput = gp2_baseline(size_gib)
+
+    new_iops = None
+    new_throughput = None
+    if new_type == "gp3":
+        new_iops, new_throughput = gp3_settings(size_gib, iops, throughput)
+    elif new_type in IO_MAX_IOPS:
+        new_iops = io_iops(new_type, size_gib, iops)
+
+    return performance_settings(new_type, size_gib, new_iops, new_throughput)
+
+
+def performance_args(settings):
+
+    # The create_volume arguments for target_settings.
+    args = {"VolumeType": settings["VolumeType"], "Size": settings["SizeGiB"]}
+    if settings["Iops"] is not None and settings["VolumeType"] in PROVISIONED_IOPS_TYPES:
+        args["Iops"] = settings["Iops"]
+    if settings["Throughput"] is not None and settings["VolumeType"] in PROVISIONED_THROUGHPUT_TYPES:
+        args["Throughput"] = settings["Throughput"]
+    return args